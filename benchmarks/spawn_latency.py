@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+'''
+Benchmark of the latency to launch the processes of the jobs as a function
+of the memory used by the manager process.
+Compares the launcher used by the jobs (based on "posix_spawn" when
+available) with a plain "subprocess.Popen".
+'''
+
+__author__  = ['Miguel Ramos Pernas']
+__email__   = ['miguel.ramos.pernas@cern.ch']
+
+# Python
+import argparse
+import os
+import resource
+import subprocess
+import tempfile
+import time
+
+# Local
+from jobmgr import spawn
+
+
+def popen( command, cwd, stdout, stderr ):
+    '''
+    Launch a process using "subprocess.Popen".
+    '''
+    with open(stdout, 'wt') as out, open(stderr, 'wt') as err:
+        return subprocess.Popen(command, cwd=cwd, stdout=out, stderr=err)
+
+
+def latency( launcher, cwd, n ):
+    '''
+    Return the mean time (in milliseconds) to launch "n" processes.
+    '''
+    out = os.path.join(cwd, 'stdout')
+    err = os.path.join(cwd, 'stderr')
+
+    total = 0.
+    for _ in range(n):
+        start = time.time()
+        p = launcher(['true'], cwd, out, err)
+        total += time.time() - start
+        p.wait()
+
+    return 1e3 * total / n
+
+
+def main():
+    '''
+    Main function.
+    '''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[0, 256, 1024],
+                        help='Memory (in MB) to allocate in the manager')
+    parser.add_argument('--n', type=int, default=200,
+                        help='Number of processes to launch per point')
+    args = parser.parse_args()
+
+    cwd = tempfile.mkdtemp()
+
+    print('{:>10} {:>10} {:>12} {:>12}'.format('alloc (MB)', 'RSS (MB)', 'spawn (ms)', 'popen (ms)'))
+
+    ballast = []
+    for size in args.sizes:
+
+        # Touch the pages so they are really allocated
+        ballast.append(bytearray(os.urandom(1)) * (size * 1024**2))
+
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+        print('{:>10} {:>10.0f} {:>12.3f} {:>12.3f}'.format(
+            size, rss, latency(spawn.spawn, cwd, args.n), latency(popen, cwd, args.n)))
+
+        del ballast[:]
+
+
+if __name__ == '__main__':
+    main()
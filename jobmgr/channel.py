@@ -0,0 +1,166 @@
+'''
+Channels to send data between steps.
+'''
+
+__author__  = ['Miguel Ramos Pernas']
+__email__   = ['miguel.ramos.pernas@cern.ch']
+
+# Python
+import collections
+import threading
+
+__all__ = ['Channel']
+
+
+class Channel(object):
+
+    def __init__( self, capacity = None ):
+        '''
+        Object to send lists of work items from a producer to one or more
+        consumers.
+        Each message is split in contiguous batches, one per consumer.
+        Messages are kept till all the consumers acknowledge them, and the
+        last one is always kept, so a consumer which is restarted receives
+        again its batch.
+        If the channel is aborted (e.g. because the producer failed), the
+        consumers receive None.
+        This object is thread-safe.
+
+        :param capacity: maximum number of messages pending to be \
+        acknowledged. When it is reached, the producer blocks till the \
+        consumers process the pending messages. If None, the capacity is \
+        not bounded.
+        :type capacity: int or None
+
+        :ivar capacity: Maximum number of messages pending to be acknowledged.
+        '''
+        super(Channel, self).__init__()
+
+        self.capacity = capacity
+
+        self._cond      = threading.Condition()
+        self._consumers = 0
+        self._aborted   = False
+        self._last      = None
+        self._messages  = collections.deque()
+
+    def _batch( self, items, consumer ):
+        '''
+        Return the batch of a message corresponding to the given consumer.
+
+        :param items: items of the message.
+        :type items: list
+        :param consumer: consumer ID.
+        :type consumer: int
+        :returns: batch of items.
+        :rtype: list
+        '''
+        n = max(self._consumers, 1)
+
+        return items[consumer * len(items) // n:(consumer + 1) * len(items) // n]
+
+    def abort( self ):
+        '''
+        Abort the channel, so the consumers receive None till new data is
+        sent or the channel is cleared.
+        '''
+        with self._cond:
+            self._aborted = True
+            self._cond.notify_all()
+
+    def ack( self, consumer = 0 ):
+        '''
+        Acknowledge the oldest message pending for the given consumer.
+
+        :param consumer: consumer ID.
+        :type consumer: int
+        '''
+        with self._cond:
+
+            for items, pending in self._messages:
+                if consumer in pending:
+                    pending.discard(consumer)
+                    break
+
+            while self._messages and not self._messages[0][1]:
+                self._messages.popleft()
+
+            self._cond.notify_all()
+
+    def clear( self ):
+        '''
+        Remove all the messages and the abort signal.
+        '''
+        with self._cond:
+            self._aborted = False
+            self._last    = None
+            self._messages.clear()
+            self._cond.notify_all()
+
+    def get( self, consumer = 0, timeout = None ):
+        '''
+        Get the batch of the oldest message not acknowledged by the given
+        consumer. If all of them have been acknowledged, the batch of the
+        last message is returned. If no message has been sent, wait for it.
+
+        :param consumer: consumer ID.
+        :type consumer: int
+        :param timeout: maximum time to wait (in seconds).
+        :type timeout: float or None
+        :returns: batch of items, or None if the channel has been aborted or \
+        the timeout expires.
+        :rtype: list or None
+        '''
+        with self._cond:
+
+            while not self._aborted and self._last is None:
+                if not self._cond.wait(timeout) and timeout is not None:
+                    break
+
+            if self._aborted or self._last is None:
+                return None
+
+            for items, pending in self._messages:
+                if consumer in pending:
+                    return self._batch(items, consumer)
+
+            return self._batch(self._last, consumer)
+
+    def put( self, items, timeout = None ):
+        '''
+        Send a message to the consumers, waiting if the channel is full.
+
+        :param items: work items.
+        :type items: list
+        :param timeout: maximum time to wait (in seconds).
+        :type timeout: float or None
+        :returns: whether the message was sent.
+        :rtype: bool
+        '''
+        with self._cond:
+
+            while self.capacity is not None and len(self._messages) >= self.capacity:
+                if not self._cond.wait(timeout) and timeout is not None:
+                    return False
+
+            items = list(items)
+
+            self._aborted = False
+            self._last    = items
+
+            self._messages.append((items, set(range(max(self._consumers, 1)))))
+
+            self._cond.notify_all()
+
+        return True
+
+    def subscribe( self ):
+        '''
+        Add a new consumer to the channel.
+
+        :returns: consumer ID.
+        :rtype: int
+        '''
+        with self._cond:
+            self._consumers += 1
+            return self._consumers - 1
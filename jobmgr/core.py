@@ -6,9 +6,20 @@ __author__  = ['Miguel Ramos Pernas']
 __email__   = ['miguel.ramos.pernas@cern.ch']
 
 # Python
+import bisect
+import collections
+import functools
+import hashlib
+import heapq
+import itertools
+import json
 import logging
+import math
+import multiprocessing
+import os
 import threading
 import time
+import weakref
 
 # For python2 and python3 compatibility
 try:
@@ -16,22 +27,213 @@ try:
 except:
     import queue
 
-__all__ = ['ContextManager', 'JobRegistry', 'StatusCode', 'Watchdog']
+# Local
+from . import logs, status, triggers
+
+__all__ = ['AdmissionController', 'ContextManager', 'JobRegistry', 'RetryPolicy', 'RuntimeHistory', 'Scheduler', 'StallDetector', 'StatusCode', 'StragglerDetector', 'Watchdog']
+
+# Clock used by the timers of the watchdogs
+__clock__ = getattr(time, 'monotonic', time.time)
+
+# Maximum time between updates of the status of the jobs
+__watchdog_interval__ = 0.1
+
+# Locks protecting the status transitions of the jobs. Jobs are mapped to them
+# through their identifiers, so jobs do not need to hold a lock.
+__status_locks__ = tuple(threading.RLock() for _ in range(64))
+
+
+def _read_pressure( path ):
+    '''
+    Read the share of time some tasks were stalled on a resource in the last
+    ten seconds, from a pressure stall information (PSI) file of Linux.
+
+    :param path: path to the file (e.g. "/proc/pressure/cpu").
+    :type path: str
+    :returns: percentage of time, or None if the file can not be read.
+    :rtype: float or None
+    '''
+    try:
+        with open(path, 'rt') as f:
+            for l in f:
+                if l.startswith('some '):
+                    return float(l.split()[1].split('=')[1])
+    except (IOError, OSError, IndexError, ValueError):
+        pass
+
+    return None
+
+
+def system_pressure():
+    '''
+    Read the load of the system.
+    Values which can not be read in this system are set to None.
+
+    :returns: load average of the last minute per CPU ("load"), fraction \
+    of the memory available ("memory") and percentage of time some tasks \
+    were stalled on CPU, memory or I/O in the last ten seconds \
+    ("cpu_pressure", "memory_pressure" and "io_pressure").
+    :rtype: dict(str, float or None)
+    '''
+    out = {}
+
+    try:
+        out['load'] = os.getloadavg()[0] / multiprocessing.cpu_count()
+    except (AttributeError, OSError):
+        out['load'] = None
+
+    out['memory'] = None
+    try:
+        info = {}
+        with open('/proc/meminfo', 'rt') as f:
+            for l in f:
+                k, v = l.split(':', 1)
+                info[k] = float(v.split()[0])
+
+        out['memory'] = info['MemAvailable'] / info['MemTotal']
+    except (IOError, OSError, KeyError, ValueError, ZeroDivisionError):
+        pass
+
+    for r in ('cpu', 'memory', 'io'):
+        out[r + '_pressure'] = _read_pressure('/proc/pressure/' + r)
+
+    return out
+
+
+def compare_and_set( job, expected, new ):
+    '''
+    Change the status of a job if it is one of the expected values, as an
+    atomic operation.
+
+    :param job: job to modify.
+    :type job: JobBase
+    :param expected: status allowing the transition.
+    :type expected: collection(str)
+    :param new: new status.
+    :type new: str
+    :returns: whether the status has been changed.
+    :rtype: bool
+    '''
+    with status_lock(job):
+
+        if job._status not in expected:
+            return False
+
+        job._status = new
+
+        return True
+
+
+def status_lock( job ):
+    '''
+    Return the lock protecting the status transitions of a job.
+    The locks are shared among jobs, and they are reentrant, so a thread
+    can hold the locks of many jobs at the same time.
+
+    :param job: job to lock.
+    :type job: JobBase
+    :returns: lock of the job.
+    :rtype: threading.RLock
+    '''
+    return __status_locks__[(id(job) >> 4) % len(__status_locks__)]
+
+
+def _weak_method( method ):
+    '''
+    Return a weak reference to a bound method, for the versions of python
+    without :class:`weakref.WeakMethod`.
+
+    :param method: bound method.
+    :type method: method
+    :returns: function returning the method, or None if its object has \
+    been deleted.
+    :rtype: function
+    '''
+    obj, func = weakref.ref(method.__self__), method.__func__
+
+    def ref():
+        o = obj()
+        return func.__get__(o, type(o)) if o is not None else None
+
+    return ref
 
 
 class JobRegistry(list):
 
-    def __init__( self ):
+    def __init__( self, scheduler = None, status_path = None, stall = None, history = None, single_flight = False ):
         '''
         Represent a registry of jobs.
         This object owns the jobs, bringing kill signals on deletion.
         It is responsability of the user to keep it alive.
+        Jobs can be registered, submitted and killed from many threads at
+        the same time.
         Attached to this class there is a :class:`Watchdog`, which automatically
-        checks the status of the jobs.
+        checks the status of the jobs and starts those submitted to the
+        :class:`Scheduler`.
+
+        :param scheduler: scheduler to start the submitted jobs. It can be \
+        shared among many registries. By default, a scheduler without \
+        limit on the number of running jobs is created.
+        :type scheduler: Scheduler or None
+        :param status_path: if provided, the status of the jobs is published \
+        in a file in this path, which can be read from other processes \
+        through a :class:`StatusReader` (see :class:`StatusTable`).
+        :type status_path: str or None
+        :param stall: detector of stalled processes, used by the watchdog \
+        on the running jobs (including the steps of the jobs).
+        :type stall: StallDetector or None
+        :param history: where to record the runtimes of the jobs (including \
+        the steps of the jobs) once they terminate, used to estimate the \
+        time to finish the jobs (see :func:`JobRegistry.eta`).
+        :type history: RuntimeHistory or None
+        :param single_flight: whether to run identical jobs only once. If \
+        a job is submitted while an identical job (with the same command, \
+        input files and environment) is queued or running, it is attached \
+        to the execution of the latter instead of being queued. Both jobs \
+        share the output directory and see the same status and result. \
+        Killing the attached job does not affect the other.
+        :type single_flight: bool
+
+        :ivar scheduler: Scheduler to start the submitted jobs.
+        :ivar history: Where to record the runtimes of the jobs.
+        :ivar single_flight: Whether to run identical jobs only once.
+        :ivar status_table: Table where the status of the jobs is published.
+        :ivar watchdog: Object monitoring the jobs.
         '''
         super(JobRegistry, self).__init__()
 
-        self.watchdog = Watchdog()
+        # Lock to add or replace jobs
+        self._lock = threading.Lock()
+
+        # Submitted jobs waiting for other jobs or files, with their priority,
+        # user, the jobs they depend on and the handles of the patterns of
+        # the files which have not appeared yet
+        self._waiting      = {}
+        self._waiting_lock = threading.Lock()
+        self._file_watcher = None
+
+        self.single_flight = single_flight
+
+        # Jobs queued or running by their fingerprints, the jobs attached to
+        # them and the identifiers of the jobs which have been attached
+        self._flights      = {}
+        self._followers    = []
+        self._attached     = set()
+        self._flights_lock = threading.Lock()
+
+        self.scheduler = scheduler if scheduler is not None else Scheduler()
+
+        if status_path is not None:
+            self.status_table = status.StatusTable(status_path)
+        else:
+            self.status_table = None
+
+        self.history = history
+
+        self.watchdog = Watchdog(self.scheduler, self.status_table, stall)
+        self.watchdog.add_listener(self._sync_followers)
+        self.watchdog.add_listener(self._record_runtimes)
+        self.watchdog.add_listener(self._release_waiting)
 
     def __del__( self ):
         '''
@@ -39,6 +241,9 @@ class JobRegistry(list):
         '''
         self.watchdog.stop()
 
+        if self._file_watcher is not None:
+            self._file_watcher.stop()
+
         # Kill the non-terminated jobs
         for j in filter(lambda j: j.status() != StatusCode.terminated, self):
             j.kill()
@@ -47,6 +252,13 @@ class JobRegistry(list):
         for j in self:
             j.wait()
 
+        # Publish the final status of the jobs, since the watchdog is stopped
+        if self.status_table is not None:
+            for j in self:
+                j.update_status()
+                self.status_table.publish(j)
+            self.status_table.close()
+
     def __repr__( self ):
         '''
         Representation as a string.
@@ -65,6 +277,321 @@ class JobRegistry(list):
         '''
         return '\n'.join(map(str, self))
 
+    def _file_arrived( self, job, pattern, path ):
+        '''
+        Mark the pattern of the files a job is waiting for as satisfied.
+        Called by the :class:`FileWatcher`.
+
+        :param job: waiting job.
+        :type job: JobBase
+        :param pattern: pattern of the files.
+        :type pattern: str
+        :param path: path to the file which has appeared.
+        :type path: str
+        '''
+        with self._waiting_lock:
+
+            entry = self._waiting.get(id(job))
+
+            if entry is None:
+                return
+
+            handle = entry[4].pop(pattern, None)
+
+        if handle is not None:
+            self._file_watcher.remove(handle)
+
+        self._release(job)
+
+    def _log_jobs( self ):
+        '''
+        Return the jobs with log files, looking also into the steps of the
+        jobs.
+
+        :returns: jobs with log files.
+        :rtype: generator(JobBase)
+        '''
+        for j in self:
+            if hasattr(j, 'steps'):
+                for s in j.steps._log_jobs():
+                    yield s
+            else:
+                yield j
+
+    def _record_runtimes( self, jobs ):
+        '''
+        Record the runtimes of the terminated jobs in the history.
+        Called by the :class:`Watchdog`.
+
+        :param jobs: jobs watched by the watchdog.
+        :type jobs: list(JobBase)
+        '''
+        if self.history is not None:
+            # Attached jobs share the runtime of the jobs they are attached to
+            self.history.update(j for j in jobs if id(j) not in self._attached)
+
+    def _queue( self, job, priority, user ):
+        '''
+        Submit a job to the scheduler or, if "single_flight" is set and an
+        identical job is queued or running, attach the job to it.
+
+        :param job: job to submit.
+        :type job: JobBase
+        :param priority: priority of the job.
+        :type priority: float
+        :param user: user submitting the job.
+        :type user: object
+        :returns: whether the job has been queued or attached.
+        :rtype: bool
+        '''
+        fp = job._fingerprint() if self.single_flight and hasattr(job, '_fingerprint') else None
+
+        if fp is None:
+            return self.scheduler.submit(job, priority, user)
+
+        with self._flights_lock:
+
+            leader = self._flights.get(fp)
+
+            if leader is not None and leader is not job and leader.status() in (StatusCode.queued, StatusCode.running):
+
+                if not job._attach(leader):
+
+                    logging.getLogger(__name__).warning(
+                        'Job is already {}; not submitting it again'.format(job.status()))
+
+                    return False
+
+                logging.getLogger(__name__).info(
+                    'Job "{}" is identical to job "{}"; attaching it to its execution'.format(job.full_jid(), leader.full_jid()))
+
+                self._followers.append(job)
+                self._attached.add(id(job))
+
+                return True
+
+            self._flights[fp] = job
+            self._attached.discard(id(job))
+
+        return self.scheduler.submit(job, priority, user)
+
+    def _release( self, job ):
+        '''
+        Submit a waiting job to the scheduler once the jobs it depends on
+        have terminated and the files it waits for have appeared.
+        If any of the jobs it depends on fails, or if it is killed while
+        waiting, the job is killed.
+
+        :param job: waiting job.
+        :type job: JobBase
+        '''
+        with self._waiting_lock:
+
+            entry = self._waiting.get(id(job))
+
+            if entry is None:
+                return
+
+            _, priority, user, after, files = entry
+
+            states = [j.status() for j in after]
+
+            killed = getattr(job, '_kill_event', None)
+            killed = killed is not None and killed.is_set()
+
+            failed = any(s in (StatusCode.killed, StatusCode.timed_out) for s in states)
+
+            if not killed and not failed and (files or any(s != StatusCode.terminated for s in states)):
+                return
+
+            del self._waiting[id(job)]
+
+        for h in files.values():
+            self._file_watcher.remove(h)
+
+        if killed or failed:
+
+            if failed:
+                logging.getLogger(__name__).warning(
+                    'Job "{}" depends on a job which did not terminate; killing it'.format(job.full_jid()))
+
+            compare_and_set(job, (StatusCode.new, StatusCode.terminated, StatusCode.killed, StatusCode.timed_out), StatusCode.killed)
+        else:
+            self._queue(job, priority, user)
+
+    def _release_waiting( self, jobs ):
+        '''
+        Release the waiting jobs whose conditions are satisfied.
+        Called by the :class:`Watchdog`.
+
+        :param jobs: jobs watched by the watchdog.
+        :type jobs: list(JobBase)
+        '''
+        with self._waiting_lock:
+            waiting = [e[0] for e in self._waiting.values()]
+
+        for j in waiting:
+            self._release(j)
+
+    def _sync_followers( self, jobs ):
+        '''
+        Copy the status and the result of the jobs with attached jobs to the
+        latter, and forget about the finished jobs.
+        Called by the :class:`Watchdog`.
+
+        :param jobs: jobs watched by the watchdog.
+        :type jobs: list(JobBase)
+        '''
+        with self._flights_lock:
+
+            self._followers = [j for j in self._followers if not j._sync_leader()]
+
+            for fp, j in list(self._flights.items()):
+                if j.status() not in (StatusCode.new, StatusCode.queued, StatusCode.running):
+                    del self._flights[fp]
+
+    def compact( self ):
+        '''
+        Replace the finished jobs by compact records (see :class:`JobRecord`),
+        releasing their threads, events and any other resource attached to
+        them.
+        The full objects are rehydrated when needed (e.g. on a call to
+        :func:`JobRecord.start`).
+        Jobs which do not support compaction are kept untouched.
+
+        :returns: number of compacted jobs.
+        :rtype: int
+        '''
+        n = 0
+        for i, j in enumerate(self):
+
+            if j.status() not in (StatusCode.terminated, StatusCode.killed, StatusCode.timed_out):
+                continue
+
+            r = j.compact(self)
+
+            if r is not None:
+                self.watchdog.unwatch(j)
+                self.replace(j, r)
+                n += 1
+
+        return n
+
+    def eta( self ):
+        '''
+        Estimate the time needed to finish the running and queued jobs of
+        this registry, from the runtimes stored in the history.
+        The remaining work is assigned to the slots of the scheduler,
+        starting by the longest jobs. Jobs without previous runtimes are
+        assumed to take the average runtime of the history.
+
+        :returns: estimated time (in seconds), or None if there is no \
+        history or it is empty.
+        :rtype: float or None
+        '''
+        if self.history is None:
+            return None
+
+        now = time.time()
+
+        running = []
+        queued  = []
+        for j in list(self):
+
+            s = j.status()
+
+            if s == StatusCode.running:
+                running.append(self.history.remaining(j, now))
+            elif s == StatusCode.queued:
+                queued.append(self.history.remaining(j, now))
+
+        if None in running or None in queued:
+            return None
+
+        slots = self.scheduler.max_running
+
+        if self.scheduler.admission is not None:
+            slots = self.scheduler.admission.limit if slots is None else min(slots, self.scheduler.admission.limit)
+
+        if slots is None:
+            slots = len(running) + len(queued)
+
+        # Jobs might be running without going through the scheduler
+        slots = max(slots, len(running), 1)
+
+        # Longest-processing-time-first list scheduling
+        ends = sorted(running) + [0.] * (slots - len(running))
+
+        heapq.heapify(ends)
+
+        for t in sorted(queued, reverse=True):
+            heapq.heappush(ends, heapq.heappop(ends) + t)
+
+        return max(ends)
+
+    def follow( self, name = 'stdout', pattern = None, interval = 0.1, refresh = 1. ):
+        '''
+        Follow the lines written to the "stdout" or "stderr" files of all the
+        running jobs (including the steps of the jobs), till no job is
+        running or queued.
+        For the jobs running when this function is called, only the new
+        lines are returned. Jobs started afterwards are followed from the
+        beginning.
+
+        :param name: log file to follow ("stdout" or "stderr").
+        :type name: str
+        :param pattern: if provided, only the lines matching this regular \
+        expression are returned.
+        :type pattern: str or None
+        :param interval: time to wait between checks of the files.
+        :type interval: float
+        :param refresh: time between checks of the running jobs.
+        :type refresh: float
+        :returns: jobs and new lines.
+        :rtype: generator(tuple(JobBase, str))
+        :raises ValueError: if name is not "stdout" or "stderr".
+        '''
+        if name not in ('stdout', 'stderr'):
+            raise ValueError('Log file must be either "stdout" or "stderr"')
+
+        f = logs.LogFollower(pattern)
+
+        jobs  = {}
+        first = True
+        last  = None
+
+        while True:
+
+            if last is None or time.time() - last >= refresh:
+
+                last = time.time()
+
+                active = {}
+                for j in self._log_jobs():
+                    if j.status() in (StatusCode.queued, StatusCode.running):
+                        active[id(j)] = j
+
+                for k, j in active.items():
+                    if k not in f:
+                        jobs[k] = j
+                        f.add(k, os.path.join(j._odir, name), from_start=not first)
+
+                for k in f.keys():
+                    if k not in active:
+                        for _, l in f.remove(k):
+                            yield jobs[k], l
+                        del jobs[k]
+
+                first = False
+
+                if not f:
+                    break
+
+            for k, l in f.poll():
+                yield jobs[k], l
+
+            time.sleep(interval)
+
     def register( self, job ):
         '''
         Register the given job, returning its new job ID.
@@ -75,17 +602,155 @@ class JobRegistry(list):
         :returns: next available job ID.
         :rtype: int
         '''
-        if len(self):
-            jid = max(map(lambda s: int(s), range(len(self)))) + 1
-        else:
-            jid = 0
-
-        self.append(job)
+        with self._lock:
+            jid = len(self)
+            self.append(job)
 
         self.watchdog.watch(job)
 
         return jid
 
+    def replace( self, old, new ):
+        '''
+        Replace a job of this registry by another object representing it
+        (e.g. a compact record).
+        This method is reserved for subclasses of :class:`JobBase`.
+
+        :param old: job to replace.
+        :type old: JobBase or JobRecord
+        :param new: new object.
+        :type new: JobBase or JobRecord
+        :raises ValueError: if the job is not in the registry.
+        '''
+        with self._lock:
+            jid = getattr(old, 'jid', None)
+
+            if jid is not None and jid < len(self) and self[jid] is old:
+                self[jid] = new
+            else:
+                self[self.index(old)] = new
+
+    def search( self, pattern = None, name = 'stdout', markers_only = False ):
+        '''
+        Search for the lines matching a regular expression in the log files
+        of the jobs (including the steps of the jobs).
+        For the jobs which index their logs, the indices (see
+        :class:`LogIndex`) are updated and only the parts of the files
+        which can match are read. The rest of the files are scanned.
+
+        :param pattern: regular expression (using :func:`re.search`). If \
+        None, all the lines are considered to match.
+        :type pattern: str or None
+        :param name: log file to search in ("stdout" or "stderr").
+        :type name: str
+        :param markers_only: whether to consider only the lines with errors \
+        or warnings.
+        :type markers_only: bool
+        :returns: jobs, line numbers (starting from zero) and matching lines.
+        :rtype: list(tuple(JobBase, int, str))
+        :raises ValueError: if name is not "stdout" or "stderr".
+        '''
+        if name not in ('stdout', 'stderr'):
+            raise ValueError('Log file must be either "stdout" or "stderr"')
+
+        out = []
+        for j in self._log_jobs():
+
+            path = os.path.join(j._odir, name)
+
+            if not os.path.exists(path):
+                continue
+
+            if os.path.exists(logs.LogIndex.index_path(path)):
+                lines = logs.LogIndex.build(path).search(pattern, markers_only)
+            else:
+                lines = logs.search(path, pattern, markers_only)
+
+            out += [(j, n, l) for n, l in lines]
+
+        return out
+
+    def submit( self, job, priority = 0, user = None, after = None, files = None ):
+        '''
+        Submit a job of this registry to the scheduler, which will start it
+        once there are free slots.
+        The job can wait for other jobs to terminate, or for files to
+        appear (see :class:`FileWatcher`), before being queued. Waiting
+        jobs keep their status. They are queued as soon as the watchdog
+        sees the last job they depend on terminating, or as soon as the
+        last file appears, without polling the jobs. If any of the jobs
+        they depend on is killed or times out, the job is killed. Killing
+        a waiting job prevents it from being queued.
+        If "single_flight" is set, the job might be attached to an
+        identical job instead of being queued (see :class:`JobRegistry`).
+
+        :param job: job to submit.
+        :type job: JobBase
+        :param priority: priority of the job (greater values run first).
+        :type priority: float
+        :param user: user submitting the job, used for the fair-share \
+        scheduling.
+        :type user: object
+        :param after: jobs which must terminate before queuing the job.
+        :type after: collection(JobBase) or None
+        :param files: patterns of the files which must appear before \
+        queuing the job. Each pattern must be matched by at least one \
+        file. Only the file names can contain wildcards.
+        :type files: collection(str) or None
+        :returns: whether the job has been queued, or whether it is waiting \
+        (see :func:`Scheduler.submit`).
+        :rtype: bool
+        '''
+        if not after and not files:
+            return self._queue(job, priority, user)
+
+        with self._waiting_lock:
+
+            if id(job) in self._waiting or job.status() in (StatusCode.queued, StatusCode.running):
+
+                logging.getLogger(__name__).warning(
+                    'Job is already {}; not submitting it again'.format(
+                        'waiting' if id(job) in self._waiting else job.status()))
+
+                return False
+
+            if files and self._file_watcher is None:
+                self._file_watcher = triggers.FileWatcher()
+
+            # A previous kill must not prevent queuing the job
+            if getattr(job, '_kill_event', None) is not None:
+                job._kill_event.clear()
+
+            self._waiting[id(job)] = (job, priority, user, list(after or ()), dict.fromkeys(files or ()))
+
+        for p in set(files or ()):
+
+            try:
+                handle = self._file_watcher.add(p, functools.partial(self._file_arrived, job, p))
+            except Exception:
+                with self._waiting_lock:
+                    entry = self._waiting.pop(id(job), None)
+                if entry is not None:
+                    for h in entry[4].values():
+                        self._file_watcher.remove(h)
+                raise
+
+            with self._waiting_lock:
+
+                entry = self._waiting.get(id(job))
+
+                # The file might have already appeared
+                if entry is not None and p in entry[4]:
+                    entry[4][p] = handle
+                    handle = None
+
+            if handle is not None:
+                self._file_watcher.remove(handle)
+
+        self._release(job)
+
+        return True
+
 
 class ContextManager(JobRegistry):
 
@@ -168,6 +833,862 @@ class ContextManager(JobRegistry):
         self.__del__()
 
 
+class AdmissionController(object):
+
+    def __init__( self, start = None, minimum = 1, maximum = None, increase = 1, decrease = 0.5, load = 1., memory = 0.1, reserve = 0.05, pressure = 20., interval = 1., probe = None ):
+        '''
+        Object to adapt the number of jobs running at the same time to the
+        pressure of the system, through an additive-increase and
+        multiplicative-decrease (AIMD) controller.
+        The system is probed at most once per interval. If it is overloaded
+        (the load average per CPU, the fraction of available memory or the
+        pressure stall information of Linux exceed their limits), the limit
+        is multiplied by "decrease". Otherwise, if there are more jobs
+        running or waiting than the limit, it is raised by "increase".
+        If the fraction of available memory drops below "reserve", no jobs
+        are started till it is recovered, so the running jobs are not
+        killed by the system for running out of memory.
+        It is meant to be used by a :class:`Scheduler`.
+
+        :param start: initial limit. By default, the number of CPUs.
+        :type start: int or None
+        :param minimum: minimum limit.
+        :type minimum: int
+        :param maximum: maximum limit.
+        :type maximum: int or None
+        :param increase: jobs added to the limit if the system is not \
+        overloaded.
+        :type increase: int
+        :param decrease: factor to multiply the limit if the system is \
+        overloaded.
+        :type decrease: float
+        :param load: maximum load average of the last minute per CPU.
+        :type load: float
+        :param memory: minimum fraction of available memory.
+        :type memory: float
+        :param reserve: fraction of available memory below which no jobs \
+        are started.
+        :type reserve: float
+        :param pressure: maximum percentage of time some tasks can be \
+        stalled on CPU, memory or I/O (see "/proc/pressure").
+        :type pressure: float
+        :param interval: minimum time (in seconds) between probes.
+        :type interval: float
+        :param probe: function returning the load of the system, like \
+        :func:`system_pressure` (used by default).
+        :type probe: function or None
+
+        :ivar limit: Current limit on the number of running jobs.
+        :ivar paused: Whether the start of jobs is paused since the system \
+        is running out of memory.
+        :ivar minimum: Minimum limit.
+        :ivar maximum: Maximum limit.
+        :ivar increase: Jobs added to the limit if the system is not overloaded.
+        :ivar decrease: Factor to multiply the limit if the system is overloaded.
+        :ivar load: Maximum load average per CPU.
+        :ivar memory: Minimum fraction of available memory.
+        :ivar reserve: Fraction of available memory below which no jobs \
+        are started.
+        :ivar pressure: Maximum percentage of time tasks can be stalled.
+        :ivar interval: Minimum time between probes.
+        '''
+        super(AdmissionController, self).__init__()
+
+        self.minimum  = minimum
+        self.maximum  = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.load     = load
+        self.memory   = memory
+        self.reserve  = reserve
+        self.pressure = pressure
+        self.interval = interval
+
+        self.limit  = start if start is not None else multiprocessing.cpu_count()
+        self.paused = False
+
+        self._probe  = probe if probe is not None else system_pressure
+        self._probed = None
+        self._lock   = threading.Lock()
+
+    def _overloaded( self, values ):
+        '''
+        Check whether the system is overloaded.
+
+        :param values: load of the system (see :func:`system_pressure`).
+        :type values: dict(str, float or None)
+        :returns: whether the system is overloaded.
+        :rtype: bool
+        '''
+        if values.get('load') is not None and values['load'] > self.load:
+            return True
+
+        if values.get('memory') is not None and values['memory'] < self.memory:
+            return True
+
+        return any(values.get(r + '_pressure') is not None and values[r + '_pressure'] > self.pressure
+                   for r in ('cpu', 'memory', 'io'))
+
+    def update( self, running, pending ):
+        '''
+        Probe the system, if the last probe is older than the interval,
+        and return the number of jobs which can run at the same time.
+
+        :param running: number of running jobs.
+        :type running: int
+        :param pending: number of jobs waiting to be started.
+        :type pending: int
+        :returns: maximum number of running jobs (zero if paused).
+        :rtype: int
+        '''
+        with self._lock:
+
+            now = __clock__()
+
+            if self._probed is None or now - self._probed >= self.interval:
+
+                self._probed = now
+
+                values = self._probe()
+
+                self.paused = values.get('memory') is not None and values['memory'] < self.reserve
+
+                if self.paused or self._overloaded(values):
+                    self.limit = int(math.floor(self.limit * self.decrease))
+                elif running + pending > self.limit:
+                    self.limit += self.increase
+
+                self.limit = max(self.limit, self.minimum)
+
+                if self.maximum is not None:
+                    self.limit = min(self.limit, self.maximum)
+
+                if self.paused:
+                    logging.getLogger(__name__).warning(
+                        'Available memory below {:.0%}; pausing the start of jobs'.format(self.reserve))
+
+            return 0 if self.paused else self.limit
+
+
+class RetryPolicy(object):
+
+    def __init__( self, max_attempts = 3, backoff = 1., factor = 2., max_backoff = None, exit_codes = None, signals = None ):
+        '''
+        Policy to retry failed jobs or steps.
+        The time to wait before each retry grows exponentially with the
+        number of attempts.
+
+        :param max_attempts: maximum number of attempts (including the first).
+        :type max_attempts: int
+        :param backoff: time to wait (in seconds) before the first retry.
+        :type backoff: float
+        :param factor: factor to multiply the waiting time after each retry.
+        :type factor: float
+        :param max_backoff: maximum waiting time (in seconds). If None, the \
+        waiting time is not bounded.
+        :type max_backoff: float or None
+        :param exit_codes: exit codes that trigger a retry. If None, any \
+        non-zero exit code triggers a retry.
+        :type exit_codes: collection(int) or None
+        :param signals: signals that trigger a retry when they terminate the \
+        process. If None, any signal triggers a retry. Processes killed by \
+        the user are never retried.
+        :type signals: collection(int) or None
+
+        :ivar max_attempts: Maximum number of attempts.
+        :ivar backoff: Time to wait before the first retry.
+        :ivar factor: Factor to multiply the waiting time after each retry.
+        :ivar max_backoff: Maximum waiting time.
+        :ivar exit_codes: Exit codes that trigger a retry.
+        :ivar signals: Signals that trigger a retry.
+        '''
+        super(RetryPolicy, self).__init__()
+
+        self.max_attempts = max_attempts
+        self.backoff      = backoff
+        self.factor       = factor
+        self.max_backoff  = max_backoff
+        self.exit_codes   = exit_codes
+        self.signals      = signals
+
+    def delay( self, attempt ):
+        '''
+        Return the time to wait after the given failed attempt.
+
+        :param attempt: number of the attempt that failed (starting from 1).
+        :type attempt: int
+        :returns: time to wait (in seconds).
+        :rtype: float
+        '''
+        d = self.backoff * self.factor**(attempt - 1)
+
+        if self.max_backoff is not None:
+            d = min(d, self.max_backoff)
+
+        return d
+
+    def should_retry( self, attempt, code ):
+        '''
+        Determine whether a process must be retried.
+
+        :param attempt: number of the attempt that failed (starting from 1).
+        :type attempt: int
+        :param code: exit code of the process. Negative values correspond \
+        to processes terminated by a signal.
+        :type code: int
+        :returns: whether to retry the process.
+        :rtype: bool
+        '''
+        if code == 0 or attempt >= self.max_attempts:
+            return False
+
+        if code < 0:
+            return self.signals is None or -code in self.signals
+        else:
+            return self.exit_codes is None or code in self.exit_codes
+
+
+class RuntimeHistory(object):
+
+    def __init__( self, path = None ):
+        '''
+        Storage of the runtimes of the jobs and steps which terminated
+        successfully, to predict the runtime of similar jobs.
+        Runtimes are grouped by the name of the executable (the name of the
+        step for :class:`Step` objects) and a signature of the command
+        (without the input data of the steps). Runtimes of stepped jobs
+        are predicted as the sum of those of their steps.
+        If a path is given, the history is loaded from it and saved again
+        each time new runtimes are recorded, so it is kept among sessions.
+        This object is thread-safe.
+
+        :param path: path to the file storing the history.
+        :type path: str or None
+
+        :ivar path: Path to the file storing the history.
+        '''
+        super(RuntimeHistory, self).__init__()
+
+        self.path = path
+
+        self._lock     = threading.Lock()
+        self._stats    = {}
+        self._recorded = {}
+
+        if path is not None and os.path.exists(path):
+            with open(path, 'rt') as f:
+                self._stats = {k: tuple(v) for k, v in json.load(f).items()}
+
+    def __len__( self ):
+        '''
+        Return the number of groups of jobs in the history.
+
+        :returns: number of groups.
+        :rtype: int
+        '''
+        with self._lock:
+            return len(self._stats)
+
+    def _mean( self ):
+        '''
+        Return the average runtime of all the groups in the history.
+
+        :returns: average runtime (in seconds), or None if the history is \
+        empty.
+        :rtype: float or None
+        '''
+        with self._lock:
+            if not self._stats:
+                return None
+            return sum(m for _, m in self._stats.values()) / len(self._stats)
+
+    def key( self, job ):
+        '''
+        Return the group of a job.
+
+        :param job: job.
+        :type job: Job
+        :returns: group of the job, or None if its runtime is not tracked.
+        :rtype: str or None
+        '''
+        if not hasattr(job, '_runtime_key') or not hasattr(job, 'command'):
+            return None
+
+        signature = hashlib.sha1(json.dumps(list(job.command)).encode()).hexdigest()[:16]
+
+        return '{}:{}'.format(job._runtime_key(), signature)
+
+    def predict( self, job ):
+        '''
+        Predict the runtime of a job.
+
+        :param job: job (or stepped job).
+        :type job: JobBase
+        :returns: predicted runtime (in seconds), or None if there are no \
+        runtimes for it.
+        :rtype: float or None
+        '''
+        if hasattr(job, 'steps'):
+
+            times = [self.predict(s) for s in job.steps]
+
+            if not times or None in times:
+                return None
+
+            return sum(times)
+
+        key = self.key(job)
+
+        with self._lock:
+            stats = self._stats.get(key)
+
+        return stats[1] if stats is not None else None
+
+    def record( self, key, runtime ):
+        '''
+        Store the runtime of a successful job.
+        The average is updated incrementally.
+
+        :param key: group of the job (see :func:`RuntimeHistory.key`).
+        :type key: str
+        :param runtime: runtime (in seconds).
+        :type runtime: float
+        '''
+        with self._lock:
+
+            n, mean = self._stats.get(key, (0, 0.))
+
+            n += 1
+
+            self._stats[key] = (n, mean + (runtime - mean) / n)
+
+    def remaining( self, job, now = None ):
+        '''
+        Estimate the time needed for a job to finish, considering the time
+        it has been running. Jobs without previous runtimes are assumed to
+        take the average runtime of the history.
+
+        :param job: job (or stepped job).
+        :type job: JobBase
+        :param now: current time. By default, the time of the system.
+        :type now: float or None
+        :returns: remaining time (in seconds), or None if the history is \
+        empty.
+        :rtype: float or None
+        '''
+        now = now if now is not None else time.time()
+
+        if hasattr(job, 'steps'):
+
+            times = [self.remaining(s, now) for s in job.steps if s.status() != StatusCode.terminated]
+
+            if None in times:
+                return None
+
+            return sum(times)
+
+        t = self.predict(job)
+
+        if t is None:
+            t = self._mean()
+            if t is None:
+                return None
+
+        if job.status() == StatusCode.running and getattr(job, 'start_time', None) is not None:
+            return max(t - (now - job.start_time), 0.)
+
+        return t
+
+    def save( self ):
+        '''
+        Save the history in its file, replacing it atomically.
+        '''
+        if self.path is None:
+            return
+
+        with self._lock:
+            stats = dict(self._stats)
+
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+
+        with open(tmp, 'wt') as f:
+            json.dump(stats, f)
+
+        os.rename(tmp, self.path)
+
+    def update( self, jobs ):
+        '''
+        Record the runtimes of the given jobs (and their steps) which have
+        terminated successfully since the last call, saving the history if
+        any runtime has been recorded.
+
+        :param jobs: jobs to look at.
+        :type jobs: iterable(JobBase)
+        '''
+        new = False
+
+        jobs = list(jobs)
+        while jobs:
+
+            j = jobs.pop()
+
+            jobs.extend(getattr(j, 'steps', ()))
+
+            if j.status() != StatusCode.terminated or getattr(j, 'skipped', False):
+                continue
+
+            start, end = getattr(j, 'start_time', None), getattr(j, 'end_time', None)
+
+            if start is None or end is None or self._recorded.get(id(j)) == end:
+                continue
+
+            key = self.key(j)
+            if key is None:
+                continue
+
+            self._recorded[id(j)] = end
+
+            self.record(key, end - start)
+
+            new = True
+
+        if new:
+            self.save()
+
+
+class Scheduler(object):
+
+    def __init__( self, max_running = None, aging = 0., weights = None, admission = None, history = None, clock = None, shared = None ):
+        '''
+        Object to start the submitted jobs, limiting the number of jobs
+        running at the same time.
+        Jobs are queued per user in heaps, where jobs with higher priority
+        are started first. The priority of a job grows linearly with the
+        time it has been waiting (aging), so low-priority jobs are not
+        starved. When a slot is free, the next job is taken from the user
+        with the lowest number of running jobs relative to its weight
+        (fair-share).
+        Dispatching a job costs O(log N) operations, with N the number of
+        queued jobs of the user.
+        This object is thread-safe, and can be shared among registries.
+
+        :param max_running: maximum number of jobs running at the same time. \
+        If None, jobs are started as soon as they are submitted.
+        :type max_running: int or None
+        :param aging: increase of the priority of queued jobs per second.
+        :type aging: float
+        :param weights: fair-share weights of the users. Users not in the \
+        dictionary have a weight of one.
+        :type weights: dict or None
+        :param admission: controller adapting the number of jobs running at \
+        the same time to the load of the system. The limit defined by \
+        "max_running" is still respected.
+        :type admission: AdmissionController or None
+        :param history: runtimes of previous jobs. If provided, the queued \
+        jobs with the same priority are started by decreasing predicted \
+        runtime (longest processing time first), which reduces the time \
+        to finish all the jobs. Jobs without previous runtimes are started \
+        first.
+        :type history: RuntimeHistory or None
+        :param clock: function returning the current time, used for the \
+        aging. By default, :func:`time.time` is used. It can be replaced \
+        by a virtual clock (see :class:`Simulator`).
+        :type clock: function or None
+        :param shared: queue shared with the schedulers of other processes \
+        in the host. If provided, jobs are only started if there are free \
+        slots in the host, and the queued jobs can be run by other \
+        processes whose schedulers are idle.
+        :type shared: SharedQueue or None
+
+        :ivar max_running: Maximum number of jobs running at the same time.
+        :ivar aging: Increase of the priority of queued jobs per second.
+        :ivar weights: Fair-share weights of the users.
+        :ivar admission: Controller adapting the number of running jobs.
+        :ivar history: Runtimes of previous jobs.
+        :ivar clock: Function returning the current time.
+        :ivar shared: Queue shared with the schedulers of other processes.
+        '''
+        super(Scheduler, self).__init__()
+
+        self.max_running = max_running
+        self.aging       = aging
+        self.weights     = dict(weights) if weights is not None else {}
+        self.admission   = admission
+        self.history     = history
+        self.clock       = clock if clock is not None else time.time
+        self.shared      = shared
+
+        self._lock    = threading.RLock()
+        self._counter = itertools.count()
+        self._pending = {}
+        self._running = {}
+
+    def __len__( self ):
+        '''
+        Return the number of queued jobs.
+
+        :returns: number of queued jobs.
+        :rtype: int
+        '''
+        with self._lock:
+            return sum(map(len, self._pending.values()))
+
+    def _next_user( self ):
+        '''
+        Return the user with queued jobs and the lowest share of running jobs.
+
+        :returns: user.
+        :rtype: object
+        '''
+        return min(self._pending, key=lambda u: len(self._running.get(u, ())) / float(self.weights.get(u, 1.)))
+
+    def dispatch( self ):
+        '''
+        Free the slots of the finished jobs and start the queued jobs while
+        there are free slots.
+
+        :returns: started jobs.
+        :rtype: list(JobBase)
+        '''
+        with self._lock:
+
+            n = 0
+            for u, jobs in list(self._running.items()):
+
+                jobs = [j for j in jobs if j.status() not in (StatusCode.terminated, StatusCode.killed, StatusCode.timed_out)]
+
+                if jobs:
+                    self._running[u] = jobs
+                    n += len(jobs)
+                else:
+                    del self._running[u]
+
+            limit = self.max_running
+
+            if self.admission is not None:
+
+                a = self.admission.update(n, sum(map(len, self._pending.values())))
+
+                limit = a if limit is None else min(limit, a)
+
+            if self.shared is not None:
+
+                a = self.shared.update(n, sum(map(len, self._pending.values())))
+
+                limit = a if limit is None else min(limit, a)
+
+            started = []
+            while self._pending and (limit is None or n < limit):
+
+                u = self._next_user()
+
+                heap = self._pending[u]
+
+                entry = heapq.heappop(heap)
+
+                job = entry[-1]
+
+                if not heap:
+                    del self._pending[u]
+
+                # The job might have been killed while queued. The status lock
+                # prevents killing it till it is started.
+                with status_lock(job):
+
+                    if job.status() != StatusCode.queued:
+                        continue
+
+                    if self.shared is not None:
+
+                        claimed = self.shared.claim(job)
+
+                        if claimed is None:
+                            # No free slots in the host
+                            heapq.heappush(self._pending.setdefault(u, []), entry)
+                            break
+
+                        if not claimed:
+                            # Taken by another process
+                            continue
+
+                    job.start()
+
+                self._running.setdefault(u, []).append(job)
+
+                started.append(job)
+
+                n += 1
+
+            return started
+
+    def running( self ):
+        '''
+        Return the number of running jobs started by this scheduler.
+
+        :returns: number of running jobs.
+        :rtype: int
+        '''
+        with self._lock:
+            return sum(map(len, self._running.values()))
+
+    def submit( self, job, priority = 0, user = None ):
+        '''
+        Queue the given job and start jobs if there are free slots.
+
+        :param job: job to submit.
+        :type job: JobBase
+        :param priority: priority of the job (greater values run first).
+        :type priority: float
+        :param user: user submitting the job.
+        :type user: object
+        :returns: whether the job has been queued. Jobs which are already \
+        queued or running are not submitted again.
+        :rtype: bool
+        '''
+        with self._lock:
+
+            if not compare_and_set(job, (StatusCode.new, StatusCode.terminated, StatusCode.killed, StatusCode.timed_out), StatusCode.queued):
+
+                logging.getLogger(__name__).warning(
+                    'Job is already {}; not submitting it again'.format(job.status()))
+
+                return False
+
+            # Aging adds "aging * (now - t)" to the priority of every queued
+            # job, so the order only depends on "aging * t - priority"
+            key = self.aging * self.clock() - priority
+
+            # Longest jobs first among those with the same priority
+            if self.history is not None:
+                t = self.history.predict(job)
+                length = -t if t is not None else -float('inf')
+            else:
+                length = 0.
+
+            heapq.heappush(self._pending.setdefault(user, []), (key, length, next(self._counter), job))
+
+            if self.shared is not None:
+                self.shared.publish(job, priority)
+
+        self.dispatch()
+
+        return True
+
+
+class StallDetector(object):
+
+    # What to do with the stalled jobs
+    __actions__ = ('kill', 'flag')
+
+    def __init__( self, output = None, cpu = None, heartbeat = None, heartbeat_file = 'heartbeat', action = 'kill', interval = 5. ):
+        '''
+        Object to detect processes which are stuck without exiting (e.g.
+        deadlocked), from cheap signals of progress:
+
+        * output: growth of the "stdout" and "stderr" files.
+        * cpu: CPU time consumed by the process, read from \
+        "/proc/<pid>/stat" (only on systems providing it).
+        * heartbeat: modification time of a file periodically touched by \
+        the process.
+
+        Each signal is given a window, and a process is considered stalled
+        once none of the enabled signals has progressed within its window.
+        The checks are done by the :class:`Watchdog` of a
+        :class:`JobRegistry`, on all its running jobs at once and at most
+        once per interval, so they remain cheap with many jobs. Hence each
+        registry needs its own detector.
+
+        :param output: window (in seconds) for the growth of the log files.
+        :type output: float or None
+        :param cpu: window (in seconds) for the CPU time of the process.
+        :type cpu: float or None
+        :param heartbeat: window (in seconds) for the heartbeat file. A \
+        missing file does not show any progress.
+        :type heartbeat: float or None
+        :param heartbeat_file: path to the heartbeat file, relative to the \
+        working directory of the process.
+        :type heartbeat_file: str
+        :param action: "kill" to kill the stalled jobs (as if \
+        :func:`JobBase.kill` had been called) or "flag" to just mark them \
+        (see :attr:`Job.stalled`).
+        :type action: str
+        :param interval: minimum time (in seconds) between checks.
+        :type interval: float
+        :raises ValueError: if the action is unknown or no window is given.
+
+        :ivar output: Window for the growth of the log files.
+        :ivar cpu: Window for the CPU time of the process.
+        :ivar heartbeat: Window for the heartbeat file.
+        :ivar heartbeat_file: Path to the heartbeat file.
+        :ivar action: What to do with the stalled jobs.
+        :ivar interval: Minimum time between checks.
+        '''
+        if action not in self.__actions__:
+            raise ValueError('Unknown action "{}"; choose between {}'.format(
+                action, self.__actions__))
+
+        if output is None and cpu is None and heartbeat is None:
+            raise ValueError('At least one window must be provided')
+
+        super(StallDetector, self).__init__()
+
+        self.output         = output
+        self.cpu            = cpu
+        self.heartbeat      = heartbeat
+        self.heartbeat_file = heartbeat_file
+        self.action         = action
+        self.interval       = interval
+
+        # Time of the last check, and state of the running jobs, with the
+        # ID of their process, the values of the signals and the time when
+        # they changed for the last time
+        self._checked = None
+        self._state   = {}
+
+    def _cpu_times( self, pids ):
+        '''
+        Read the CPU time consumed by the given processes (including their
+        children which have been waited for).
+
+        :param pids: process IDs.
+        :type pids: iterable(int)
+        :returns: CPU time (in clock ticks) of each process, for those \
+        which exist.
+        :rtype: dict(int, int)
+        '''
+        times = {}
+        for pid in pids:
+            try:
+                fd = os.open('/proc/{}/stat'.format(pid), os.O_RDONLY)
+                try:
+                    data = os.read(fd, 1024)
+                finally:
+                    os.close(fd)
+            except OSError:
+                continue
+
+            # The name of the process might contain spaces, so the fields
+            # are read after it (utime, stime, cutime and cstime)
+            fields = data[data.rfind(b')') + 2:].split()
+
+            times[pid] = sum(int(f) for f in fields[11:15])
+
+        return times
+
+    def _signals( self, job, cpu ):
+        '''
+        Read the signals of progress of a job.
+
+        :param job: running job.
+        :type job: Job
+        :param cpu: CPU times of the processes.
+        :type cpu: dict(int, int)
+        :returns: values of the enabled signals.
+        :rtype: dict(str, object)
+        '''
+        values = {}
+
+        if self.output is not None:
+
+            size = 0
+            for n in ('stdout', 'stderr'):
+                try:
+                    size += os.stat(os.path.join(job._odir, n)).st_size
+                except OSError:
+                    pass
+
+            values['output'] = size
+
+        if self.cpu is not None and cpu is not None:
+            values['cpu'] = cpu.get(job.pid)
+
+        if self.heartbeat is not None:
+            try:
+                values['heartbeat'] = os.stat(os.path.join(job._wdir, self.heartbeat_file)).st_mtime
+            except OSError:
+                values['heartbeat'] = None
+
+        return values
+
+    def check( self, jobs ):
+        '''
+        Check whether the running processes of the given jobs have stalled,
+        killing or flagging them.
+        Nothing is done if the last check was done less than "interval"
+        seconds ago.
+
+        :param jobs: jobs to check. The steps of the jobs are also checked.
+        :type jobs: iterable(JobBase)
+        :returns: jobs which have been found to be stalled in this check.
+        :rtype: list(Job)
+        '''
+        now = __clock__()
+
+        if self._checked is not None and now - self._checked < self.interval:
+            return []
+
+        self._checked = now
+
+        running = []
+
+        jobs = list(jobs)
+        while jobs:
+
+            j = jobs.pop()
+
+            jobs.extend(getattr(j, 'steps', ()))
+
+            # Only the jobs with a process running
+            if not hasattr(j, '_mark_stalled') or j.status() != StatusCode.running:
+                continue
+
+            if j.pid is None or j.start_time is None or j.end_time is not None:
+                continue
+
+            running.append(j)
+
+        # The process files are read in one pass
+        if self.cpu is not None and os.path.exists('/proc/self/stat'):
+            cpu = self._cpu_times(j.pid for j in running)
+        else:
+            cpu = None
+
+        windows = {'output': self.output, 'cpu': self.cpu, 'heartbeat': self.heartbeat}
+
+        state   = {}
+        stalled = []
+        for j in running:
+
+            values = self._signals(j, cpu)
+
+            last = self._state.get(id(j))
+
+            if last is None or last[0] != j.pid:
+                # New process
+                changed = {k: now for k in values}
+            else:
+                changed = {k: (now if values[k] != last[1].get(k) else last[2][k]) for k in values}
+
+            state[id(j)] = (j.pid, values, changed)
+
+            if j.stalled:
+                continue
+
+            if all(now - changed[k] >= windows[k] for k in values):
+
+                logging.getLogger(__name__).warning(
+                    'Process of job "{}" has stalled'.format(j.full_jid()))
+
+                j._mark_stalled(self.action == 'kill')
+
+                stalled.append(j)
+
+        # Jobs which are not running anymore are dropped
+        self._state = state
+
+        return stalled
+
+
 class StatusCode(object):
     '''
     Hold the different possible status of jobs and steps.
@@ -175,6 +1696,9 @@ class StatusCode(object):
     new = 'new'
     ''' The instance has just been created. '''
 
+    queued = 'queued'
+    ''' The instance is waiting to be started by a :class:`Scheduler`. '''
+
     running = 'running'
     ''' The instance is running. '''
 
@@ -184,21 +1708,114 @@ class StatusCode(object):
     killed = 'killed'
     ''' The job/step has failed or has been killed. '''
 
+    timed_out = 'timed out'
+    ''' The job/step has been killed since it exceeded its time limit. '''
+
+
+class StragglerDetector(object):
+
+    def __init__( self, percentile = 50., multiple = 2., min_samples = 5 ):
+        '''
+        Object to detect jobs running for much longer than similar jobs.
+        The runtimes of the successful jobs are stored in groups (the name
+        of the step for :class:`Step` objects). A job is considered a
+        straggler if its runtime exceeds the given percentile of the
+        distribution of its group, multiplied by a factor.
+        This object is thread-safe, and it is meant to be shared among
+        many jobs.
+
+        :param percentile: percentile of the runtime distribution to use as \
+        a reference (between 0 and 100).
+        :type percentile: float
+        :param multiple: factor to multiply the reference runtime.
+        :type multiple: float
+        :param min_samples: minimum number of runtimes needed to consider \
+        jobs as stragglers.
+        :type min_samples: int
+
+        :ivar percentile: Percentile of the runtime distribution to use.
+        :ivar multiple: Factor to multiply the reference runtime.
+        :ivar min_samples: Minimum number of runtimes needed.
+        '''
+        super(StragglerDetector, self).__init__()
+
+        self.percentile  = percentile
+        self.multiple    = multiple
+        self.min_samples = min_samples
+
+        self._lock     = threading.Lock()
+        self._runtimes = {}
+
+    def record( self, key, runtime ):
+        '''
+        Store the runtime of a successful job.
+
+        :param key: group of the job.
+        :type key: str
+        :param runtime: runtime of the job (in seconds).
+        :type runtime: float
+        '''
+        with self._lock:
+            bisect.insort(self._runtimes.setdefault(key, []), runtime)
+
+    def threshold( self, key ):
+        '''
+        Return the runtime from which jobs of the given group are considered
+        stragglers.
+
+        :param key: group of the job.
+        :type key: str
+        :returns: threshold (in seconds), or None if there are not enough \
+        samples for this group.
+        :rtype: float or None
+        '''
+        with self._lock:
+
+            r = self._runtimes.get(key, ())
+
+            if len(r) < max(self.min_samples, 1):
+                return None
+
+            i = min(int(round(self.percentile / 100. * (len(r) - 1))), len(r) - 1)
+
+            return r[i] * self.multiple
+
 
 class Watchdog(object):
 
-    def __init__( self ):
+    def __init__( self, scheduler = None, table = None, stall = None ):
         '''
         Object to iterate over a set of jobs and update its status.
         The objects are passed throguh the :func:`Watchdog.watch` method.
         To be thread-safe, one must ensure to do not delete the jobs before
         stopping the watchdog monitoring (through :func:`Watchdog.stop`).
+
+        :param scheduler: scheduler to dispatch after each update.
+        :type scheduler: Scheduler or None
+        :param table: table to publish the status of the jobs after each \
+        update.
+        :type table: StatusTable or None
+        :param stall: detector of stalled processes, to check the jobs \
+        after each update.
+        :type stall: StallDetector or None
         '''
         super(Watchdog, self).__init__()
 
-        self._stop_event = threading.Event()
-        self._job_queue  = queue.Queue()
-        self._task       = None
+        self._scheduler = scheduler
+        self._table     = table
+        self._stall     = stall
+        self._listeners = []
+
+        self._stop_event  = threading.Event()
+        self._job_queue   = queue.Queue()
+        self._drop_queue  = queue.Queue()
+        self._task        = None
+
+        # Heap of timers, with their expiration times, a counter to break
+        # ties and the callbacks
+        self._timers      = []
+        self._timer_lock  = threading.Lock()
+        self._timer_count = itertools.count()
 
         self.start()
 
@@ -211,39 +1828,191 @@ class Watchdog(object):
         while not self._job_queue.empty():
             self._job_queue.get()
 
+    def _expire_timers( self ):
+        '''
+        Call the callbacks of the expired timers.
+
+        :returns: time till the next timer expires, or None if there are \
+        no timers.
+        :rtype: float or None
+        '''
+        while True:
+            with self._timer_lock:
+
+                if not self._timers:
+                    return None
+
+                left = self._timers[0][0] - __clock__()
+
+                if left > 0:
+                    return left
+
+                timer = heapq.heappop(self._timers)
+
+            callback, timer[2] = timer[2], None
+
+            if callback is None:
+                # Cancelled
+                continue
+
+            try:
+                callback()
+            except Exception as e:
+                logging.getLogger(__name__).error(
+                    'Error processing an expired timer: {}'.format(e))
+
+    def _dropped( self ):
+        '''
+        Consume the queue of jobs which must not be watched anymore.
+        Each request drops one entry of the job, so a job watched again
+        after being dropped (e.g. a compacted job which is started again)
+        is kept.
+
+        :returns: number of entries to drop for each job identifier.
+        :rtype: collections.Counter
+        '''
+        drop = collections.Counter()
+        while not self._drop_queue.empty():
+            drop[id(self._drop_queue.get())] += 1
+
+        return drop
+
     def _update_status( self ):
         '''
         Update the status of the jobs in the queue.
         '''
+        drop = self._dropped()
+
         jlst = []
         while not self._job_queue.empty():
             j = self._job_queue.get()
+
+            if drop[id(j)] > 0:
+                drop[id(j)] -= 1
+                continue
+
             j.update_status()
 
+            if self._table is not None:
+                self._table.publish(j)
+
             jlst.append(j)
 
         for j in jlst:
             self._job_queue.put(j)
 
+        if self._stall is not None:
+            self._stall.check(jlst)
+
+        for r in list(self._listeners):
+
+            l = r()
+
+            if l is None:
+                # The owner of the method has been deleted
+                self._listeners.remove(r)
+                continue
+
+            try:
+                l(jlst)
+            except Exception as e:
+                logging.getLogger(__name__).error(
+                    'Error notifying the status of the jobs: {}'.format(e))
+
     def _watchdog( self ):
         '''
         Main function to watch for the jobs.
         '''
         while not self._stop_event.is_set():
 
+            self._expire_timers()
+
             self._update_status()
 
-            # To reduce the CPU consumption
-            time.sleep(0.1)
+            if self._scheduler is not None:
+                self._scheduler.dispatch()
+
+            # To reduce the CPU consumption, wait till the next update or
+            # till the next timer expires
+            left = self._expire_timers()
+
+            if left is None or left > __watchdog_interval__:
+                left = __watchdog_interval__
+
+            self._stop_event.wait(left)
 
         # Do the last update before exiting
         self._update_status()
 
+    def add_listener( self, callback ):
+        '''
+        Call a function after each update of the status of the jobs.
+        Callbacks are called from the thread of the watchdog, so they must
+        not block.
+        Only weak references to methods are kept, so the watchdog does not
+        keep their objects alive.
+
+        :param callback: function to call, taking the list of watched jobs.
+        :type callback: function
+        '''
+        if hasattr(callback, '__self__'):
+            self._listeners.append(getattr(weakref, 'WeakMethod', _weak_method)(callback))
+        else:
+            self._listeners.append(lambda: callback)
+
+    def add_timer( self, delay, callback ):
+        '''
+        Call a function once the given time has passed.
+        All the timers are held in a single heap, and their callbacks are
+        called from the thread of the watchdog, so they must not block.
+        Timers do not expire while the watchdog is stopped.
+
+        :param delay: time to wait (in seconds).
+        :type delay: float
+        :param callback: function to call, without arguments.
+        :type callback: function
+        :returns: timer, to cancel it through :func:`Watchdog.cancel_timer`.
+        :rtype: list
+        '''
+        timer = [__clock__() + delay, next(self._timer_count), callback]
+
+        with self._timer_lock:
+            heapq.heappush(self._timers, timer)
+
+        return timer
+
+    def cancel_timer( self, timer ):
+        '''
+        Cancel a timer, so its callback is not called.
+        Timers which have already expired are ignored.
+
+        :param timer: timer returned by :func:`Watchdog.add_timer`.
+        :type timer: list
+        '''
+        # The timer is removed from the heap once it expires
+        timer[2] = None
+
+    def remove_listener( self, callback ):
+        '''
+        Stop calling a function added with :func:`Watchdog.add_listener`.
+
+        :param callback: function to remove.
+        :type callback: function
+        :raises ValueError: if the function is not a listener.
+        '''
+        for r in list(self._listeners):
+            if r() == callback:
+                self._listeners.remove(r)
+                return
+
+        raise ValueError('Function is not a listener of the watchdog')
+
     def start( self ):
         '''
         Start monitoring the jobs.
         '''
         if self._task is None:
+            self._stop_event.clear()
             self._task = threading.Thread(target=self._watchdog)
             self._task.start()
 
@@ -260,6 +2029,27 @@ class Watchdog(object):
             self._task.join()
             self._task = None
 
+    def unwatch( self, job ):
+        '''
+        Stop monitoring the given job.
+        The job is removed from the queue on the next update.
+        '''
+        self._drop_queue.put(job)
+
+        if self._task is None:
+            # Nobody is going to process the queues, so do it here
+            drop = self._dropped()
+
+            jlst = []
+            while not self._job_queue.empty():
+                jlst.append(self._job_queue.get())
+
+            for j in jlst:
+                if drop[id(j)] > 0:
+                    drop[id(j)] -= 1
+                else:
+                    self._job_queue.put(j)
+
     def watch( self, job ):
         '''
         Start monitoring the given job.
@@ -0,0 +1,201 @@
+'''
+Interface to run jobs following the "concurrent.futures" module.
+'''
+
+__author__  = ['Miguel Ramos Pernas']
+__email__   = ['miguel.ramos.pernas@cern.ch']
+
+# Python
+import concurrent.futures
+import functools
+import threading
+
+# Local
+from .core import JobRegistry, StatusCode
+from .jobs import JobBase, JobRecord, PyJob
+
+__all__ = ['JobExecutor']
+
+
+class JobExecutor(concurrent.futures.Executor):
+
+    def __init__( self, registry = None, path = None ):
+        '''
+        Executor running jobs of a :class:`JobRegistry` through its
+        :class:`Scheduler`, following the interface of
+        :class:`concurrent.futures.Executor`.
+        Submitting a job returns a :class:`concurrent.futures.Future`,
+        which is resolved by the :class:`Watchdog` of the registry once the
+        job finishes, so no polling is needed. The futures can be used
+        with :func:`concurrent.futures.wait`,
+        :func:`concurrent.futures.as_completed` and their callbacks.
+        Callables can also be submitted, which are run through a
+        :class:`PyJob`.
+        The futures are only resolved while the watchdog of the registry
+        is running.
+
+        :param registry: registry of the jobs. By default, a new registry \
+        is created, whose watchdog is stopped on :func:`JobExecutor.shutdown`.
+        :type registry: JobRegistry or None
+        :param path: where to create the output directories of the jobs \
+        running callables.
+        :type path: str or None
+
+        :ivar registry: Registry of the jobs.
+        :ivar path: Where to create the output directories of the jobs \
+        running callables.
+        '''
+        super(JobExecutor, self).__init__()
+
+        self._owner = registry is None
+
+        self.registry = registry if registry is not None else JobRegistry()
+        self.path     = path
+
+        self._lock     = threading.Lock()
+        self._pending  = {}
+
+        # Serializes the submissions, so a job is not submitted twice
+        self._submit_lock = threading.Lock()
+        self._shutdown = False
+
+        self.registry.watchdog.add_listener(self._update)
+
+    def _cancel( self, job, future ):
+        '''
+        Kill a job if its future has been cancelled.
+
+        :param job: job associated to the future.
+        :type job: JobBase
+        :param future: finished future.
+        :type future: concurrent.futures.Future
+        '''
+        if future.cancelled():
+
+            with self._lock:
+                self._pending.pop(id(job), None)
+
+            job.kill()
+
+    def _update( self, jobs ):
+        '''
+        Resolve the futures of the finished jobs.
+        Called by the :class:`Watchdog` of the registry.
+
+        :param jobs: jobs watched by the watchdog.
+        :type jobs: list(JobBase)
+        '''
+        with self._lock:
+            pending = list(self._pending.values())
+
+        for job, future in pending:
+
+            status = job.status()
+
+            if status in (StatusCode.new, StatusCode.queued):
+                # Waiting for other jobs or files, or queued
+                continue
+
+            if not future.running() and not future.set_running_or_notify_cancel():
+                # Cancelled
+                continue
+
+            if status == StatusCode.running:
+                continue
+
+            with self._lock:
+                self._pending.pop(id(job), None)
+
+            if status == StatusCode.terminated:
+                future.set_result(job)
+            else:
+                future.set_exception(RuntimeError(
+                    'Job "{}" finished with status "{}"'.format(job.full_jid(), status)))
+
+    def shutdown( self, wait = True, cancel_futures = False ):
+        '''
+        Stop accepting jobs.
+
+        :param wait: whether to wait for the submitted jobs to finish. If \
+        the registry is owned by the executor, its watchdog is stopped \
+        afterwards.
+        :type wait: bool
+        :param cancel_futures: whether to cancel the futures of the jobs \
+        which have not been started, killing them.
+        :type cancel_futures: bool
+        '''
+        with self._lock:
+            self._shutdown = True
+            futures = [f for _, f in self._pending.values()]
+
+        if cancel_futures:
+            for f in futures:
+                f.cancel()
+
+        if wait:
+            concurrent.futures.wait(futures)
+
+            if self._owner:
+                self.registry.watchdog.stop()
+
+    def submit( self, fn, *args, **kwargs ):
+        '''
+        Submit a job to the scheduler of the registry, returning a future
+        which is resolved once the job finishes.
+        If a job is provided, the keyword arguments are those of
+        :func:`JobRegistry.submit`. Otherwise, it must be a callable,
+        which is run in a :class:`PyJob` with the given arguments.
+        The result of the future is the job. If it does not terminate
+        successfully (it is killed or it times out), the future holds a
+        :class:`RuntimeError`. Cancelling the future of a queued job
+        kills it. Submitting a job whose future is pending returns the
+        same future.
+
+        :param fn: job of the registry, or callable to run.
+        :type fn: JobBase or JobRecord or function
+        :param args: arguments to the callable.
+        :type args: tuple
+        :param kwargs: keyword arguments to :func:`JobRegistry.submit` or \
+        to the callable.
+        :type kwargs: dict
+        :returns: future of the job.
+        :rtype: concurrent.futures.Future
+        :raises RuntimeError: if the executor has been shut down.
+        :raises ValueError: if the job has already been submitted to the \
+        registry, but not through the executor.
+        '''
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('Unable to submit jobs after shutdown')
+
+        if isinstance(fn, JobRecord):
+            job  = fn.rehydrate()
+            opts = kwargs
+        elif isinstance(fn, JobBase):
+            job  = fn
+            opts = kwargs
+        else:
+            job  = PyJob(fn, args, self.path, kwargs=kwargs, registry=self.registry)
+            opts = {}
+
+        with self._submit_lock:
+
+            with self._lock:
+                pending = self._pending.get(id(job))
+
+            if pending is not None:
+                return pending[1]
+
+            # The job must be queued before the watchdog looks at it, since
+            # its status might correspond to a previous execution
+            if not self.registry.submit(job, **opts):
+                raise ValueError('Job "{}" has already been submitted'.format(job.full_jid()))
+
+            future = concurrent.futures.Future()
+
+            with self._lock:
+                self._pending[id(job)] = (job, future)
+
+        future.add_done_callback(functools.partial(self._cancel, job))
+
+        return future
@@ -6,27 +6,46 @@ __author__  = ['Miguel Ramos Pernas']
 __email__   = ['miguel.ramos.pernas@cern.ch']
 
 # Python
+import array
+import hashlib
+import heapq
 import inspect
+import json
 import logging
+import multiprocessing
 import os
-import re
-import subprocess
 import shutil
+import tempfile
 import threading
+import time
+import weakref
 from distutils.spawn import find_executable
 
-# For python2 and python3 compatibility
-try:
-    import Queue as queue
-except:
-    import queue
-
 # Local
-from . import utils
-from .core import ContextManager, JobRegistry, StatusCode
+from . import logs, pool, spawn, utils
+from .channel import Channel
+from .core import ContextManager, JobRegistry, StatusCode, compare_and_set, status_lock
+
+
+__all__ = ['JobBase', 'Job', 'JobArray', 'JobRecord', 'PyJob', 'Step', 'SteppedJob']
+
 
+def _log_path( odir, name ):
+    '''
+    Return the path to a log file of a job.
 
-__all__ = ['JobBase', 'Job', 'Step', 'SteppedJob']
+    :param odir: output directory of the job.
+    :type odir: str
+    :param name: log file ("stdout" or "stderr").
+    :type name: str
+    :returns: path to the log file.
+    :rtype: str
+    :raises ValueError: if name is not "stdout" or "stderr".
+    '''
+    if name not in ('stdout', 'stderr'):
+        raise ValueError('Log file must be either "stdout" or "stderr"')
+
+    return os.path.join(odir, name)
 
 
 class JobBase(object):
@@ -36,6 +55,9 @@ class JobBase(object):
         'output path' : '_odir'
     }
 
+    # Time to wait between checks of the running processes or queued jobs
+    __poll_interval__ = 0.01
+
     def __init__( self, path, kill_event = None, registry = None ):
         '''
         Base class to create a directory for a job, holding also an ID and a
@@ -65,17 +87,31 @@ class JobBase(object):
         # Event to determine if the thread terminated without errors
         self._terminated_event = threading.Event()
 
+        # Whether the job was killed for exceeding its time limit
+        self._timed_out = False
+
+        # Identical job whose execution this job is attached to
+        self._leader = None
+
         # Register the object
         if registry is None:
             registry = ContextManager()
 
+        # The watchdog of the registry holds the timers of the job
+        self._watchdog = registry.watchdog
+
         self.jid = registry.register(self)
 
     def __del__( self ):
         '''
         Kill running processes on deletion.
+        Objects whose construction failed have nothing to kill, and neither
+        do finished jobs. These are not killed, since the finalizer can run
+        in any thread, including one being started while the status lock
+        of another job is held.
         '''
-        self.kill()
+        if hasattr(self, '_kill_event') and getattr(self, '_status', None) in (StatusCode.queued, StatusCode.running):
+            self.kill()
 
     def __repr__( self ):
         '''
@@ -107,6 +143,128 @@ class JobBase(object):
 
         return '\n'.join([' {}: ('.format(self.full_jid())] + out + [' )'])
 
+    def _attach( self, leader ):
+        '''
+        Attach this job to the execution of an identical job, which is
+        queued or running, instead of running it (see
+        :class:`JobRegistry`). This job takes the output directory and the
+        result of the other job.
+        This method is reserved to be used by the class :class:`JobRegistry`.
+
+        :param leader: job to attach to.
+        :type leader: JobBase
+        :returns: whether the job has been attached. Jobs which are \
+        already queued or running are not attached.
+        :rtype: bool
+        '''
+        if not compare_and_set(self, (StatusCode.new, StatusCode.terminated, StatusCode.killed, StatusCode.timed_out), StatusCode.queued):
+            return False
+
+        # The output directory of this job is not used
+        if self._odir != leader._odir:
+            try:
+                os.rmdir(self._odir)
+            except OSError:
+                pass
+
+        self._odir   = leader._odir
+        self._leader = leader
+
+        self._sync_leader()
+
+        return True
+
+    def _fingerprint( self ):
+        '''
+        Return the fingerprint of the execution of this job, which is equal
+        for identical jobs (see :class:`JobRegistry`).
+        By default jobs are not compared.
+
+        :returns: fingerprint, or None if the job can not be compared.
+        :rtype: str or None
+        '''
+        return None
+
+    def _sync_leader( self ):
+        '''
+        Copy the status and the result of the job this job is attached to,
+        detaching it once the other job finishes.
+
+        :returns: whether the other job has finished.
+        :rtype: bool
+        '''
+        with status_lock(self):
+
+            leader = self._leader
+
+            if leader is None:
+                return True
+
+            status = leader.status()
+
+            for attr in ('attempts', 'exit_code', 'start_time', 'end_time'):
+                if hasattr(leader, attr):
+                    setattr(self, attr, getattr(leader, attr))
+
+            self._status = status
+
+            if status in (StatusCode.queued, StatusCode.running):
+                return False
+
+            self._leader = None
+
+            return True
+
+    def _wait_queued( self ):
+        '''
+        Wait till the job is started by the scheduler, if it is queued.
+        If the job is attached to an identical job, wait till the latter
+        finishes.
+        '''
+        leader = self._leader
+
+        if leader is not None:
+            leader.wait()
+            self._sync_leader()
+
+        while self._status == StatusCode.queued:
+            time.sleep(self.__poll_interval__)
+
+    def _restore( self, record ):
+        '''
+        Restore the state of the job from a compact record, creating again
+        the synchronization primitives.
+
+        :param record: record to restore the job from.
+        :type record: JobRecord
+        '''
+        self.jid   = record.jid
+        self._odir = record._odir
+
+        self._status = record._status
+
+        self._kill_event       = threading.Event()
+        self._terminated_event = threading.Event()
+
+        self._timed_out = record._status == StatusCode.timed_out
+
+        self._leader = None
+
+        self._watchdog = record._registry().watchdog
+
+    def compact( self, registry ):
+        '''
+        Build a compact record of this job, to replace it in the given
+        registry once it has finished.
+        By default jobs can not be compacted.
+
+        :param registry: registry owning the job.
+        :type registry: JobRegistry
+        :returns: compact record or None if the job can not be compacted.
+        :rtype: JobRecord or None
+        '''
+        return None
+
     def full_jid( self ):
         '''
         Return the full job ID for this job.
@@ -121,7 +279,19 @@ class JobBase(object):
     def kill( self ):
         '''
         Kill the job.
+        If it is queued, it will not be started.
+        If it is attached to an identical job, it is detached from it, and
+        the other job is not affected.
         '''
+        with status_lock(self):
+            if getattr(self, '_leader', None) is not None:
+                self._leader = None
+                self._status = StatusCode.killed
+                return
+
+        if getattr(self, '_status', None) == StatusCode.queued:
+            compare_and_set(self, (StatusCode.queued,), StatusCode.killed)
+
         self._kill_event.set()
         self.wait()
 
@@ -155,7 +325,19 @@ class Job(JobBase):
 
     __str_attrs__ = utils.merge_dicts(JobBase.__str_attrs__, {'command': 'command'})
 
-    def __init__( self, executable, opts, odir, kill_event = None, registry = None ):
+    # Directory to run speculative copies of the process
+    __speculative_dir__ = '.speculative'
+
+    # Time between evaluations of the runtime from which the job is a straggler
+    __speculation_interval__ = 0.5
+
+    # Time between updates of the indices of the log files
+    __index_interval__ = 1.
+
+    # Ways to empty the output directory
+    __cleanup_modes__ = ('wipe', 'trash')
+
+    def __init__( self, executable, opts, odir, kill_event = None, registry = None, retry = None, speculation = None, cleanup = 'wipe', index_logs = False, scratch = None, timeout = None ):
         '''
         Represent a step on a generation process.
 
@@ -176,10 +358,61 @@ class Job(JobBase):
         :func:`ContextManager.close` or setting your execution withing a \
         context.
         :type registry: JobRegistry or None
+        :param retry: policy to retry the process if it fails. By default \
+        failed processes are not retried.
+        :type retry: RetryPolicy or None
+        :param speculation: detector of stragglers. If provided, a \
+        speculative copy of the process is launched when it runs for \
+        longer than expected. The runtime statistics are shared among the \
+        jobs with the same executable.
+        :type speculation: StragglerDetector or None
+        :param cleanup: how to empty the output directory before running the \
+        process. If "wipe", its elements are removed one by one. If "trash", \
+        the directory is atomically moved to a trash location and deleted \
+        in a background thread, so the process starts immediately.
+        :type cleanup: str
+        :param index_logs: whether to build an index of the "stdout" and \
+        "stderr" files (see :class:`LogIndex`), so they can be searched \
+        quickly through :func:`JobRegistry.search`. The index is updated \
+        while the process runs, so little work remains once it finishes.
+        :type index_logs: bool
+        :param scratch: directory in a local file system (e.g. a tmpfs or a \
+        local disk) where the process is run, in a new subdirectory, \
+        instead of in the output directory. The log files are still \
+        written in the output directory. Once the process finishes \
+        successfully, its output files are moved to the output directory \
+        (all of them in this class; only the output data for steps, see \
+        :class:`Step`). If it fails, all the files are moved.
+        :type scratch: str or None
+        :param timeout: maximum time (in seconds) each attempt to run the \
+        process can take. If it is exceeded, the process is killed, it is \
+        not retried and the status of the job is set to \
+        :attr:`StatusCode.timed_out`. The timer is handled by the \
+        :class:`Watchdog` of the registry.
+        :type timeout: float or None
+        :raises ValueError: if the cleanup mode is unknown.
 
         :ivar executable: Command to be executed.
         :ivar jid: Job ID, determined by the subdirectories in the output path.
+        :ivar retry: Policy to retry the process if it fails.
+        :ivar speculation: Detector of stragglers.
+        :ivar cleanup: How to empty the output directory.
+        :ivar index_logs: Whether to build an index of the log files.
+        :ivar scratch: Directory to run the process in a local file system.
+        :ivar timeout: Maximum time each attempt to run the process can take.
+        :ivar attempts: Number of attempts made to run the last process.
+        :ivar exit_code: Exit code of the last process (None if it has not \
+        finished yet).
+        :ivar pid: ID of the last process.
+        :ivar stalled: Whether the last process has been found to be stalled \
+        (see :class:`StallDetector`).
+        :ivar start_time: Time when the last process was started.
+        :ivar end_time: Time when the last process finished.
         '''
+        if cleanup not in self.__cleanup_modes__:
+            raise ValueError('Unknown cleanup mode "{}"; choose between {}'.format(
+                cleanup, self.__cleanup_modes__))
+
         super(Job, self).__init__(odir, kill_event, registry)
 
         self._status = StatusCode.new
@@ -187,9 +420,30 @@ class Job(JobBase):
         # Build the command to execute
         self.command = [executable] + opts
 
+        self.retry       = retry
+        self.speculation = speculation
+        self.cleanup     = cleanup
+        self.index_logs  = index_logs
+        self.scratch     = scratch
+        self.timeout     = timeout
+
+        # Information about the last execution
+        self.attempts   = 0
+        self.exit_code  = None
+        self.pid        = None
+        self.stalled    = False
+        self.start_time = None
+        self.end_time   = None
+
+        # Working directory of the last process
+        self._wdir = None
+
         # To hold the task
         self._task = None
 
+        # Record replacing this job in its registry, if it has been compacted
+        self._record = None
+
     def _execute( self ):
         '''
         Function to be sent to a new thread, and execute the step process.
@@ -199,312 +453,1937 @@ class Job(JobBase):
         if not self._kill_event.is_set():
             self._terminated_event.set()
 
-    def _run_process( self, extra_opts = None ):
+    def _fingerprint( self ):
         '''
-        Create and run the process associated to this job.
-        '''
-        extra_opts = extra_opts if extra_opts is not None else []
-
-        # Create the working directory if it does not exist. If it does,
-        # remove the elements inside it but DO NOT remove the directory itself,
-        # since it may lead to conflicts between jobs.
-        if os.path.exists(self._odir):
-            logging.info('Removing all files in "{}"'.format(self._odir))
+        Return the fingerprint of the execution of this job, which is equal
+        for identical jobs (see :class:`JobRegistry`).
+        It is built from the class and the command of the job, the size and
+        modification time of the files given in the command (relative paths
+        are evaluated in the output directory) and the environment.
 
-            for e in os.listdir(self._odir):
-
-                fp = os.path.join(self._odir, e)
-
-                if os.path.isdir(fp):
-                    shutil.rmtree(fp)
-                else:
-                    os.remove(fp)
-        else:
-            os.makedirs(self._odir)
+        :returns: fingerprint.
+        :rtype: str
+        '''
+        files = []
+        for a in self.command:
 
-        # Initialize the process
-        proc = subprocess.Popen(self.command + extra_opts,
-                                cwd=self._odir,
-                                stdout=open(os.path.join(self._odir, 'stdout'), 'wt'),
-                                stderr=open(os.path.join(self._odir, 'stderr'), 'wt')
-        )
+            path = os.path.join(self._odir, a)
 
-        # Check whether the thread is asked to be killed
-        while proc.poll() == None:
-            if self._kill_event.is_set():
+            if os.path.isfile(path):
+                st = os.stat(path)
+                files.append((os.path.abspath(path), st.st_size, st.st_mtime))
 
-                # Kill the running process
-                logging.getLogger(__name__).warning(
-                    'Killing running process for job "{}"'.format(self.full_jid()))
-                proc.kill()
+        data = json.dumps([self.__class__.__name__, list(self.command), files, sorted(os.environ.items())])
 
-                # Really needed, otherwise it might enter again in the loop
-                proc.wait()
+        return hashlib.sha1(data.encode()).hexdigest()
 
-        # If the process failed, propagate the "kill" signal
-        if proc.poll():
+    def _finish_remote( self, exit_code, start_time, end_time ):
+        '''
+        Set the result of the process run by another manager (see
+        :func:`Job._start_remote`).
+        Called by the :class:`SharedQueue` of the scheduler.
+
+        :param exit_code: exit code of the process (None if it could not \
+        be run).
+        :type exit_code: int or None
+        :param start_time: time when the process was started.
+        :type start_time: float or None
+        :param end_time: time when the process finished.
+        :type end_time: float or None
+        '''
+        if self._kill_event.is_set():
+            # Killed by the user in the meantime
+            return
 
-            logging.getLogger(__name__).error(
-                'Job "{}" has failed; see output in {}'.format(self.full_jid(), self._odir))
+        self.exit_code  = exit_code
+        self.start_time = start_time if start_time is not None else self.start_time
+        self.end_time   = end_time
 
+        if exit_code == 0:
+            self._terminated_event.set()
+        else:
             self._kill_event.set()
 
-    def peek( self, name = 'stdout', editor = None ):
+    def _kill_process( self, proc ):
         '''
-        Open the "stdout" or "stderr" file in terminal mode.
+        Kill the given process and wait for it.
 
-        :param name: log-file to open ("stdout" or "stderr"). The default is \
-        "stdout".
-        :type name: str
-        :param editor: editor to open. If None is provided, then it will \
-        try to use "emacs" or "vi" to open the file. A RuntimeError is \
-        raised if none of them exist in the system, or a ValueError if \
-        the provided editor is not accesible.
-        :raises ValueError: if name is not "stdout" or "stderr", or if \
-        the provided editor is not accesible.
-        :raises RuntimeError: if "editor = None" and neither "emacs" \
-        nor "vi" are accesible.
+        :param proc: process to kill.
+        :type proc: spawn.SpawnedProcess or spawn.GroupPopen or pool.PoolTask
         '''
-        if name not in ('stdout', 'stderr'):
-            raise ValueError('File to peek must be either "stdout" or "stderr"')
-
-        path = os.path.join(self._odir, name)
-
-        if editor is None:
-            if find_executable('emacs'):
-                editor = 'emacs -nw'
-            elif find_executable('vi'):
-                editor = 'vi'
-            else:
-                raise RuntimeError('Unable to find an apropiate text editor. '\
-                                       'You can suggest one using the '\
-                                       'argument "editor"')
-        else:
-            if not find_executable(editor):
-                raise ValueError('Unable to find executable with name "{}"'\
-                                     .format(editor))
+        proc.kill()
 
-        os.system('{} {}'.format(editor, path))
+        # Really needed, otherwise it might enter again in the loop
+        proc.wait()
 
-    def start( self ):
+    def _mark_stalled( self, kill ):
         '''
-        Create the associated task and start the job.
+        Mark the running process as stalled, killing it if requested.
+        Called by the :class:`StallDetector` of the registry.
+
+        :param kill: whether to kill the job.
+        :type kill: bool
         '''
-        self._status = StatusCode.running
+        self.stalled = True
 
-        self._kill_event.clear()
-        self._terminated_event.clear()
+        if kill:
+            self._kill_event.set()
 
-        self._task = threading.Thread(target=self._execute)
-        self._task.start()
+    def _output_files( self, path ):
+        '''
+        Return the files to move to the output directory once the process
+        finishes successfully in the scratch area (see :class:`Job`).
+        In this class, all the files are moved.
 
-    def update_status( self ):
+        :param path: working directory of the process.
+        :type path: str
+        :returns: paths to the files.
+        :rtype: generator(str)
         '''
-        Update the status of the job.
+        return utils.find_files(path, regex='')
 
-        .. warning::
-           This method is reserved to be used by the class :class:`Watchdog`.
-           Using it on your own might cause undefined behaviour.
+    def _remove_scratch( self, dirs ):
         '''
-        if self._terminated_event.is_set():
+        Remove the given working directories from the scratch area.
 
-            self._status = StatusCode.terminated
+        :param dirs: working directories, created by \
+        :func:`Job._scratch_dir`.
+        :type dirs: list(str)
+        '''
+        for d in dirs:
+            shutil.rmtree(os.path.dirname(d), ignore_errors=True)
 
-        elif self._task is not None:
-            if not self._task.is_alive():
-                if self._kill_event.is_set():
-                    self._status = StatusCode.killed
+        del dirs[:]
 
-    def wait( self ):
+    def _run_once( self, command ):
         '''
-        Wait till the task is done.
+        Create and run the process associated to this job once.
+        If a straggler detector is defined and the process runs for too
+        long, a speculative copy is launched in a subdirectory of the
+        output directory. The first copy finishing successfully is kept
+        and the other is killed. The threshold to consider the process a
+        straggler is evaluated periodically, so processes started before
+        the detector has enough samples can also be speculated.
+        If a scratch area is defined, the process runs there and its output
+        is moved to the output directory once it finishes.
+        If a timeout is defined, a timer in the watchdog of the registry
+        sends the "kill" signal once it expires.
+
+        :param command: full command to execute.
+        :type command: list(str)
+        :returns: exit code of the process.
+        :rtype: int
         '''
-        if self._task is not None:
-            self._task.join()
+        # Create the working directory if it does not exist. If it does,
+        # remove the elements inside it but DO NOT remove the directory itself,
+        # since it may lead to conflicts between jobs.
+        if os.path.exists(self._odir):
+            logging.info('Removing all files in "{}"'.format(self._odir))
 
+            if self.cleanup == 'trash':
+                utils.trash_dir(self._odir)
+            else:
+                utils.clear_dir(self._odir)
+        else:
+            os.makedirs(self._odir)
 
-class Step(Job):
+        self.exit_code  = None
+        self.start_time = time.time()
+        self.end_time   = None
 
-    __str_attrs__ = utils.merge_dicts(Job.__str_attrs__, {'data regex': 'data_regex'})
+        # Whether a speculative copy can be launched, the runtime from which
+        # the process is a straggler and the last time it was evaluated
+        speculate = self.speculation is not None
+        threshold = None
+        checked   = None
 
-    def __init__( self, name, executable, opts, parent, data_regex = None, data_builder = None ):
-        '''
-        Represent a step on a generation process.
+        # Working directories in the scratch area, removed at the end
+        scratch = []
 
-        :param name: name of the step.
-        :type name: str
-        :param executable: application/version to run.
-        :type executable: str
-        :param opts: options to be passed to the executable.
-        :type opts: list(str)
-        :param parent: parent job, inheriting from :class:`SteppedJob`.
-        :type parent: SteppedJob
-        :param data_regex: regex representing the output data to send to the \
-        next step.
-        :type data_regex: str
-        :param data_builder: function to define the way how the data is passed \
-        to the executable. It must take a list of strings (paths to the data \
-        files), and return a merged string. The default behaviour is to \
-        return list to be executed as: \
-        <executable> file1 file2 ... \
-        but one can also define the string so the argument is explicitely \
-        specified, like: \
-        <executable> --files file1 file2 ...
-        :type data_builder: function
-        :raises RuntimeError: if the name used for this step is already \
-        being used in another step.
+        try:
+            if self.scratch is not None:
+                wdir, cmd = self._scratch_dir(command, scratch)
+            else:
+                wdir, cmd = self._odir, command
 
-        :ivar executable: Command to be executed. Input data is added when the \
-        process just before execution (once it is defined).
-        :ivar name: Name of the step.
-        :ivar data_builder: Function that modifies the input data to parse it \
-        to the executable.
-        :ivar jid: Job ID, determined by the subdirectories in the output path.
-        '''
-        if any(map(lambda s: s.name == name, parent.steps)):
-            raise RuntimeError('Unable to create step "{}"; another '\
-                               'with the same name already exists'.format(name))
+            proc = self._spawn(cmd, wdir, logdir=self._odir)
+        except Exception as e:
+            # The process can not be launched (e.g. the callable of a
+            # "PyJob" can not be pickled, or the input files can not be
+            # staged), which is not retried
+            logging.getLogger(__name__).error(
+                'Unable to launch the process of job "{}": {}'.format(self.full_jid(), e))
 
-        # Set the previous step queue. Need to do this before the object
-        # is registered
-        if len(parent.steps):
-            self._prev_queue = parent.steps[-1]._queue
-        else:
-            self._prev_queue = None
+            self._remove_scratch(scratch)
 
-        super(Step, self).__init__(executable,
-                                   opts,
-                                   os.path.join(os.path.abspath(parent._odir), name),
-                                   kill_event=parent._kill_event,
-                                   registry=parent.steps)
+            self.exit_code = 1
+            self.end_time  = time.time()
 
-        self.name = name
+            self._kill_event.set()
 
-        # This is the queue associated to this step
-        self._queue = queue.Queue()
+            return self.exit_code
 
-        # Set the command to define how the data is parsed to the executable
-        if data_builder is None:
-            self.data_builder = lambda d, *args, **kwargs: ' '.join(d)
+        # Running copies of the process, with their log and working
+        # directories and start times
+        procs = [(proc, self._odir, wdir, self.start_time)]
+
+        # Indices of the log files, and last time they were updated
+        if self.index_logs:
+            indices = [logs.LogIndex(_log_path(self._odir, n)) for n in ('stdout', 'stderr')]
         else:
-            self.data_builder = data_builder
+            indices = []
 
-        self.data_regex = data_regex
+        indexed = self.start_time
 
-    def _execute( self ):
-        '''
-        Function to be sent to a new thread, and execute the step process.
-        '''
-        if self._prev_queue is not None:
-            # Get data from previous queue if it exists, and prepare input
+        self.pid     = procs[0][0].pid
+        self.stalled = False
 
-            data = self._prev_queue.get()
+        self._wdir = wdir
 
-            extra_opts = self.data_builder(data).split()
+        # The watchdog kills the process once the timeout expires
+        if self.timeout is not None:
+            timer = self._watchdog.add_timer(self.timeout, self._time_out)
         else:
-            # This is the first job, it has no input data
+            timer = None
 
-            data = None
+        sdir = os.path.join(self._odir, self.__speculative_dir__)
 
-            extra_opts = []
+        # Working directory and command of the speculative copy, built once
+        spec = None
 
-        if not self._kill_event.is_set():
-            self._run_process(extra_opts)
+        killed = False
 
-        if self._kill_event.is_set():
-            # This message is displayed if this step is asked to be killed
-            # or if the signal comes from other step. The "kill" signal is
-            # propagated by including "None" as data to the next step.
-            logging.getLogger(__name__).warning(
-                'Step "{}" has been killed'.format(self.name))
+        winner = None
+        while winner is None:
 
-            self._queue.put(None)
-        else:
-            # Notify the previous queue that we have finished
-            if self._prev_queue is not None:
-                self._prev_queue.task_done()
+            for p in list(procs):
 
-            dr = re.compile(self.data_regex)
+                if p[0].poll() is None:
+                    continue
 
-            # Build and store the requested output files
-            matches = filter(lambda s: s is not None,
-                             map(dr.match, os.listdir(self._odir)))
+                if p[0].returncode == 0 or len(procs) == 1:
+                    winner = p
+                    break
 
-            output = [os.path.join(self._odir, m.string) for m in matches]
+                # A failed copy is discarded while the other is running
+                procs.remove(p)
 
-            self._queue.put(output)
+            if winner is not None:
+                break
 
-            self._terminated_event.set()
+            # Check whether the thread is asked to be killed
+            if self._kill_event.is_set():
 
-        if self._prev_queue is not None:
-            self._prev_queue.put(data)
+                # Kill the running process
+                logging.getLogger(__name__).warning(
+                    'Killing running process for job "{}"'.format(self.full_jid()))
 
-    def clear_input_data( self ):
-        '''
-        Remove the input data from this step.
-        '''
-        if self._prev_queue is not None:
-            if not self._prev_queue.empty():
-                self._prev_queue.get()
+                for p in procs:
+                    self._kill_process(p[0])
 
-    def full_jid( self ):
-        '''
-        Return the full job ID for this step.
-        This is the addition of the index on the :class:`JobRegistry` object
-        who owns it and its name.
+                winner = procs[0]
+                killed = True
 
-        :returns: full name of this step.
-        :rtype: str
-        '''
-        return os.path.join(str(self.jid), self.name)
+                break
 
+            if indices and time.time() - indexed >= self.__index_interval__:
+                for idx in indices:
+                    idx.update()
+                indexed = time.time()
 
-class SteppedJob(JobBase):
+            # Launch a speculative copy for stragglers
+            if speculate and (checked is None or time.time() - checked >= self.__speculation_interval__):
+                threshold = self.speculation.threshold(self._runtime_key())
+                checked   = time.time()
 
-    def __init__( self, path = None, registry = None ):
-        '''
-        Instance to handle different steps, linked together. This object
-        creates a new directory under "path" with a job ID. This job ID
-        is expected to be a number, and the next to the greatest in the
-        directory will be associated to the job (0 if none is found).
+            if speculate and threshold is not None and time.time() - self.start_time > threshold:
 
-        :param path: path to the desired directory.
-        :type path: str
-        :param registry: instance to register the object. If "None", the \
-        object will be registered in the main :class:`ContextManager` instance. \
-        Remember to close the :class:`ContextManager` class via \
-        :func:`ContextManager.close` or setting your execution withing a \
-        context.
-        :type registry: JobRegistry or None
+                if not os.path.exists(sdir):
+                    os.mkdir(sdir)
 
-        :ivar steps: Steps managed by this job.
-        :ivar jid: Job ID, determined by the subdirectories in the output path.
-        '''
-        super(SteppedJob, self).__init__(path, registry=registry)
+                # Waiting for resources would block the polling of the
+                # running copy, so the launch is attempted again later
+                try:
+                    if spec is None:
+                        if self.scratch is not None:
+                            spec = self._scratch_dir(command, scratch)
+                        else:
+                            spec = (sdir, command)
 
-        self.steps = JobRegistry()
+                    p = self._spawn(spec[1], spec[0], block=False, logdir=sdir)
+                except Exception as e:
+                    logging.getLogger(__name__).error(
+                        'Unable to launch a speculative copy of job "{}": {}'.format(self.full_jid(), e))
+                    speculate = False
+                else:
+                    if p is not None:
 
-    def __del__( self ):
-        '''
-        Kill running processes on deletion.
-        '''
-        self.kill()
+                        logging.getLogger(__name__).warning(
+                            'Job "{}" is a straggler; launched a speculative '\
+                            'copy'.format(self.full_jid()))
 
-        for s in self.steps:
-            s.wait()
+                        procs.append((p, sdir, spec[0], time.time()))
 
-    def __str__( self ):
-        '''
-        Representation as a string.
+                        speculate = False
 
-        :returns: this class as a string.
-        :rtype: str
+            time.sleep(self.__poll_interval__)
+
+        if timer is not None:
+            self._watchdog.cancel_timer(timer)
+
+        for p in procs:
+            if p is not winner:
+                self._kill_process(p[0])
+
+        proc, ldir, wdir, start = winner
+
+        self.exit_code = proc.returncode
+        self.end_time  = time.time()
+
+        if ldir == sdir:
+            # Replace the output of the original process
+            logging.getLogger(__name__).info(
+                'Speculative copy of job "{}" finished first'.format(self.full_jid()))
+
+            utils.clear_dir(self._odir, exclude=(self.__speculative_dir__,))
+
+            for e in os.listdir(sdir):
+                os.rename(os.path.join(sdir, e), os.path.join(self._odir, e))
+
+            os.rmdir(sdir)
+
+        elif os.path.exists(sdir):
+            shutil.rmtree(sdir)
+
+        if wdir != ldir and not killed:
+            self._stage_out(wdir)
+
+        self._remove_scratch(scratch)
+
+        if self.exit_code == 0 and self.speculation is not None:
+            self.speculation.record(self._runtime_key(), self.end_time - start)
+
+        # If the speculative copy won, the files are indexed again
+        for idx in indices:
+            idx.update()
+            idx.save()
+
+        return self.exit_code
+
+    def _run_process( self, extra_opts = None ):
+        '''
+        Create and run the process associated to this job, retrying it if
+        it fails and the retry policy allows it.
+        '''
+        extra_opts = extra_opts if extra_opts is not None else []
+
+        command = self.command + extra_opts
+
+        self.attempts = 0
+        while True:
+
+            self.attempts += 1
+
+            code = self._run_once(command)
+
+            if code == 0 or self._kill_event.is_set():
+                # Succeeded or killed by the user
+                break
+
+            if self.retry is None or not self.retry.should_retry(self.attempts, code):
+                break
+
+            delay = self.retry.delay(self.attempts)
+
+            logging.getLogger(__name__).warning(
+                'Job "{}" failed with exit code {}; retrying in {} seconds '\
+                '(attempt {})'.format(self.full_jid(), code, delay, self.attempts + 1))
+
+            # A "kill" signal interrupts the waiting
+            if self._kill_event.wait(delay):
+                break
+
+        # If the process failed, propagate the "kill" signal
+        if self.exit_code:
+
+            logging.getLogger(__name__).error(
+                'Job "{}" has failed; see output in {}'.format(self.full_jid(), self._odir))
+
+            self._kill_event.set()
+
+    def _restore( self, record ):
+        '''
+        Restore the state of the job from a compact record.
+
+        :param record: record to restore the job from.
+        :type record: JobRecord
+        '''
+        super(Job, self)._restore(record)
+
+        self.command = list(record.command)
+
+        self.retry       = record.retry
+        self.speculation = record.speculation
+        self.cleanup     = record.cleanup
+        self.index_logs  = record.index_logs
+        self.scratch     = record.scratch
+        self.timeout     = record.timeout
+
+        self.attempts   = record.attempts
+        self.exit_code  = record.exit_code
+        self.pid        = record.pid
+        self.stalled    = record.stalled
+        self.start_time = record.start_time
+        self.end_time   = record.end_time
+
+        self._wdir   = None
+        self._task   = None
+        self._record = None
+
+    def _reregister( self ):
+        '''
+        Put this job back in its registry, if it has been replaced by a
+        compact record (see :func:`JobRegistry.compact`), so it is watched
+        again.
+
+        :raises RuntimeError: if the registry does not exist anymore, or if \
+        the record has been rehydrated in another job.
+        '''
+        record = self._record
+        if record is None:
+            return
+
+        registry = record._registry()
+        if registry is None:
+            raise RuntimeError('Unable to start job "{}"; its registry '\
+                               'does not exist anymore'.format(self.jid))
+
+        try:
+            registry.replace(record, self)
+        except ValueError:
+            raise RuntimeError('Unable to start job "{}"; it has been '\
+                               'replaced in its registry'.format(self.jid))
+
+        self._record = None
+
+        registry.watchdog.watch(self)
+
+    def _runtime_key( self ):
+        '''
+        Return the key used to gather the runtime statistics of this job.
+        In this class it is the name of the executable.
+
+        :returns: key of the job.
+        :rtype: str
+        '''
+        return os.path.basename(self.command[0])
+
+    def _scratch_dir( self, command, dirs ):
+        '''
+        Create a working directory in the scratch area, staging in the
+        input files of the process.
+
+        :param command: full command to execute.
+        :type command: list(str)
+        :param dirs: list where the new directory is added, so it is \
+        removed afterwards even if the input files can not be staged.
+        :type dirs: list(str)
+        :returns: working directory and command to run in it.
+        :rtype: tuple(str, list(str))
+        '''
+        root = tempfile.mkdtemp(prefix='jobmgr-', dir=self.scratch)
+
+        wdir = os.path.join(root, 'work')
+
+        dirs.append(wdir)
+
+        os.mkdir(wdir)
+
+        return wdir, self._stage_in(command, os.path.join(root, 'input'))
+
+    def _start_remote( self ):
+        '''
+        Mark the job as running, while its process is run by another
+        manager of the host (see :class:`SharedQueue`). The task of the job
+        waits till :func:`Job._finish_remote` is called or the job is
+        killed.
+        Called by the :class:`SharedQueue` of the scheduler.
+
+        :returns: whether the job has been started. Jobs which are not \
+        queued (e.g. because they have been killed) are not started.
+        :rtype: bool
+        '''
+        with status_lock(self):
+
+            if self._status != StatusCode.queued:
+                return False
+
+            self._status    = StatusCode.running
+            self._timed_out = False
+
+            self._kill_event.clear()
+            self._terminated_event.clear()
+
+            self.attempts   = 1
+            self.exit_code  = None
+            self.pid        = None
+            self.start_time = time.time()
+            self.end_time   = None
+
+            self._task = threading.Thread(target=self._wait_remote)
+            self._task.start()
+
+            return True
+
+    def _spawn( self, command, cwd, block = True, logdir = None ):
+        '''
+        Launch the given command in the given directory, sending its
+        output to the "stdout" and "stderr" files inside it (or inside
+        "logdir", if provided).
+        The process runs in its own process group (see :func:`spawn.spawn`).
+
+        :param command: full command to execute.
+        :type command: list(str)
+        :param cwd: working directory.
+        :type cwd: str
+        :param block: whether to wait for the resources needed to launch \
+        the process. Processes are always launched immediately in this class.
+        :type block: bool
+        :param logdir: directory for the log files.
+        :type logdir: str or None
+        :returns: launched process.
+        :rtype: spawn.SpawnedProcess or spawn.GroupPopen
+        '''
+        logdir = logdir if logdir is not None else cwd
+
+        return spawn.spawn(command, cwd,
+                           os.path.join(logdir, 'stdout'),
+                           os.path.join(logdir, 'stderr'))
+
+    def _stage_in( self, command, path ):
+        '''
+        Make the input files of the process available in the scratch area.
+        Jobs have no input files, so nothing is done in this class.
+
+        :param command: full command to execute.
+        :type command: list(str)
+        :param path: directory to put the input files in. It does not exist.
+        :type path: str
+        :returns: command to execute in the scratch area.
+        :rtype: list(str)
+        '''
+        return command
+
+    def _stage_out( self, path ):
+        '''
+        Move the output files of a process run in the scratch area to the
+        output directory, in background threads (see \
+        :func:`utils.move_files`), and wait for them.
+        If the process succeeded, only the files returned by \
+        :func:`Job._output_files` are moved. Otherwise, all the files are \
+        moved, to inspect them.
+        If the files can not be moved, the process is considered to have \
+        failed.
+
+        :param path: working directory of the process.
+        :type path: str
+        '''
+        if self.exit_code == 0:
+            files = list(self._output_files(path))
+        else:
+            files = list(utils.find_files(path, regex=''))
+
+        try:
+            for f in utils.move_files(files, path, self._odir):
+                f.result()
+        except (IOError, OSError) as e:
+            logging.getLogger(__name__).error(
+                'Unable to move the output of job "{}" from "{}": {}'.format(self.full_jid(), path, e))
+
+            if self.exit_code == 0:
+                self.exit_code = 1
+
+    def _time_out( self ):
+        '''
+        Kill the process since it has exceeded its timeout.
+        Called by the :class:`Watchdog` of the registry.
+        '''
+        logging.getLogger(__name__).warning(
+            'Job "{}" has exceeded its timeout of {} seconds; killing it'.format(self.full_jid(), self.timeout))
+
+        self._timed_out = True
+
+        self._kill_event.set()
+
+    def _wait_remote( self ):
+        '''
+        Wait till the process run by another manager finishes or the job
+        is killed (see :func:`Job._start_remote`).
+        '''
+        while not self._terminated_event.is_set() and not self._kill_event.is_set():
+            time.sleep(self.__poll_interval__)
+
+    def compact( self, registry ):
+        '''
+        Build a compact record of this job, to replace it in the given
+        registry once it has finished.
+
+        :param registry: registry owning the job.
+        :type registry: JobRegistry
+        :returns: compact record.
+        :rtype: JobRecord
+        '''
+        # If this object is started again, it takes back its place
+        self._record = JobRecord(self, registry)
+
+        return self._record
+
+    def peek( self, name = 'stdout', editor = None ):
+        '''
+        Open the "stdout" or "stderr" file in terminal mode.
+
+        :param name: log-file to open ("stdout" or "stderr"). The default is \
+        "stdout".
+        :type name: str
+        :param editor: editor to open. If None is provided, then it will \
+        try to use "emacs" or "vi" to open the file. A RuntimeError is \
+        raised if none of them exist in the system, or a ValueError if \
+        the provided editor is not accesible.
+        :raises ValueError: if name is not "stdout" or "stderr", or if \
+        the provided editor is not accesible.
+        :raises RuntimeError: if "editor = None" and neither "emacs" \
+        nor "vi" are accesible.
+        '''
+        path = _log_path(self._odir, name)
+
+        if editor is None:
+            if find_executable('emacs'):
+                editor = 'emacs -nw'
+            elif find_executable('vi'):
+                editor = 'vi'
+            else:
+                raise RuntimeError('Unable to find an apropiate text editor. '\
+                                       'You can suggest one using the '\
+                                       'argument "editor"')
+        else:
+            if not find_executable(editor):
+                raise ValueError('Unable to find executable with name "{}"'\
+                                     .format(editor))
+
+        os.system('{} {}'.format(editor, path))
+
+    def follow( self, name = 'stdout', pattern = None, interval = 0.1 ):
+        '''
+        Follow the lines written to the "stdout" or "stderr" file, till the
+        job finishes. Only the lines written after calling this function are
+        returned.
+
+        :param name: log file to follow ("stdout" or "stderr").
+        :type name: str
+        :param pattern: if provided, only the lines matching this regular \
+        expression are returned.
+        :type pattern: str or None
+        :param interval: time to wait between checks of the file.
+        :type interval: float
+        :returns: new lines.
+        :rtype: generator(str)
+        :raises ValueError: if name is not "stdout" or "stderr".
+        '''
+        f = logs.LogFollower(pattern)
+        f.add(name, _log_path(self._odir, name))
+
+        while self.status() in (StatusCode.queued, StatusCode.running):
+
+            for _, l in f.poll():
+                yield l
+
+            time.sleep(interval)
+
+        for _, l in f.remove(name):
+            yield l
+
+    def tail( self, n = 10, name = 'stdout', pattern = None ):
+        '''
+        Return the last lines of the "stdout" or "stderr" file.
+        The file is read backwards from the end, so the cost does not depend
+        on its size.
+
+        :param n: number of lines.
+        :type n: int
+        :param name: log file to read ("stdout" or "stderr").
+        :type name: str
+        :param pattern: if provided, only the lines matching this regular \
+        expression are returned.
+        :type pattern: str or None
+        :returns: last lines.
+        :rtype: list(str)
+        :raises ValueError: if name is not "stdout" or "stderr".
+        '''
+        return logs.tail(_log_path(self._odir, name), n, pattern)
+
+    def start( self ):
+        '''
+        Create the associated task and start the job.
+        If the job has been compacted, it replaces its record in the
+        registry.
+        '''
+        self._reregister()
+
+        with status_lock(self):
+
+            self._status    = StatusCode.running
+            self._timed_out = False
+
+            self._kill_event.clear()
+            self._terminated_event.clear()
+
+            self._task = threading.Thread(target=self._execute)
+            self._task.start()
+
+    def update_status( self ):
+        '''
+        Update the status of the job.
+
+        .. warning::
+           This method is reserved to be used by the class :class:`Watchdog`.
+           Using it on your own might cause undefined behaviour.
+        '''
+        # The lock prevents overwriting the status if the job is restarted
+        with status_lock(self):
+            if self._terminated_event.is_set():
+
+                self._status = StatusCode.terminated
+
+            elif self._task is not None:
+                if not self._task.is_alive():
+                    if self._timed_out:
+                        self._status = StatusCode.timed_out
+                    elif self._kill_event.is_set():
+                        self._status = StatusCode.killed
+
+    def wait( self ):
+        '''
+        Wait till the task is done.
+        If the job is queued, wait also till it is started.
+        '''
+        self._wait_queued()
+
+        if self._task is not None:
+            self._task.join()
+
+
+class JobRecord(object):
+
+    __slots__ = ('jid', 'command', 'retry', 'speculation', 'cleanup',
+                 'index_logs', 'scratch', 'timeout', 'attempts', 'exit_code', 'pid', 'stalled', 'start_time', 'end_time', '_status',
+                 '_odir', '_cls', '_registry')
+
+    def __init__( self, job, registry ):
+        '''
+        Compact representation of a finished :class:`Job`.
+        It only holds the job ID, the command, the status, the exit code,
+        the execution times and the output directory, dropping the
+        threads and synchronization primitives.
+        The full job is rehydrated (and put back in the registry) when it
+        is started again or its output is peeked.
+
+        :param job: job to compact.
+        :type job: Job
+        :param registry: registry owning the job.
+        :type registry: JobRegistry
+        '''
+        self.jid         = job.jid
+        self.command     = tuple(job.command)
+        self.retry       = job.retry
+        self.speculation = job.speculation
+        self.cleanup     = job.cleanup
+        self.index_logs  = job.index_logs
+        self.scratch     = job.scratch
+        self.timeout     = job.timeout
+        self.attempts    = job.attempts
+        self.exit_code   = job.exit_code
+        self.pid         = job.pid
+        self.stalled     = job.stalled
+        self.start_time  = job.start_time
+        self.end_time    = job.end_time
+
+        self._status = job.status()
+        self._odir   = job._odir
+        self._cls    = job.__class__
+
+        self._registry = weakref.ref(registry)
+
+    def __repr__( self ):
+        '''
+        Representation as a string.
+
+        :returns: this class as a string.
+        :rtype: str
+        '''
+        return self.__str__()
+
+    def __str__( self ):
+        '''
+        Representation as a string.
+
+        :returns: this class as a string.
+        :rtype: str
+        '''
+        attrs = {
+            'command'     : list(self.command),
+            'exit code'   : self.exit_code,
+            'output path' : self._odir,
+            'status'      : self._status,
+            }
+
+        maxl = max(map(len, attrs.keys()))
+
+        out = [' {:<{}} = {}'.format(k, maxl, v) for k, v in sorted(attrs.items())]
+
+        return '\n'.join([' {}: ('.format(self.full_jid())] + out + [' )'])
+
+    def compact( self, registry ):
+        '''
+        The record is already compact.
+
+        :param registry: registry owning the record.
+        :type registry: JobRegistry
+        :returns: None.
+        :rtype: None
+        '''
+        return None
+
+    def full_jid( self ):
+        '''
+        Return the full job ID for this job.
+
+        :returns: full name of this job.
+        :rtype: str
+        '''
+        return str(self.jid)
+
+    def kill( self ):
+        '''
+        The job has already finished, so this does nothing.
+        '''
+        pass
+
+    def peek( self, *args, **kwargs ):
+        '''
+        Rehydrate the job and peek its output.
+        See :func:`Job.peek` for the available arguments.
+        '''
+        self.rehydrate().peek(*args, **kwargs)
+
+    def rehydrate( self ):
+        '''
+        Build again the full job, replacing this record in the registry.
+
+        :returns: rehydrated job.
+        :rtype: Job
+        :raises RuntimeError: if the registry owning the record has been \
+        deleted.
+        '''
+        registry = self._registry()
+        if registry is None:
+            raise RuntimeError('Unable to rehydrate job "{}"; its registry '\
+                               'does not exist anymore'.format(self.jid))
+
+        job = self._cls.__new__(self._cls)
+        job._restore(self)
+
+        registry.replace(self, job)
+
+        registry.watchdog.watch(job)
+
+        return job
+
+    def start( self, *args, **kwargs ):
+        '''
+        Rehydrate the job and start it.
+        See :func:`Job.start` for the available arguments.
+        '''
+        self.rehydrate().start(*args, **kwargs)
+
+    def status( self ):
+        '''
+        Return the status of this job.
+
+        :returns: status of this job.
+        :rtype: str
+        '''
+        return self._status
+
+    def tail( self, n = 10, name = 'stdout', pattern = None ):
+        '''
+        Return the last lines of the "stdout" or "stderr" file, without
+        rehydrating the job.
+        See :func:`Job.tail` for the description of the arguments.
+
+        :returns: last lines.
+        :rtype: list(str)
+        '''
+        return logs.tail(_log_path(self._odir, name), n, pattern)
+
+    def update_status( self ):
+        '''
+        Records are not watched, so this does nothing.
+        '''
+        pass
+
+    def wait( self ):
+        '''
+        The job has already finished, so this does nothing.
+        '''
+        pass
+
+
+class JobArray(JobBase):
+
+    __str_attrs__ = utils.merge_dicts(JobBase.__str_attrs__, {'command': 'command', 'size': 'size'})
+
+    # Placeholder replaced by the index of each task in the command
+    __index_placeholder__ = '{index}'
+
+    # Status of the tasks, stored by their position in this tuple
+    __task_states__ = (StatusCode.new, StatusCode.queued, StatusCode.running, StatusCode.terminated, StatusCode.killed)
+
+    # Exit code stored for the tasks which have not finished
+    __no_exit_code__ = -2**31
+
+    def __init__( self, executable, opts, odir, size, registry = None, max_running = None, retry = None ):
+        '''
+        Represent many homogeneous tasks, which only differ by an index,
+        as a single job.
+        The index of each task replaces the "{index}" placeholder in the
+        executable and the options. Tasks run in subdirectories of the
+        output directory, named after their index, which are created when
+        the tasks are launched.
+        The status and the exit codes of the tasks are stored in compact
+        arrays, and a single thread launches and polls the processes, so
+        the cost of monitoring the array only depends on the number of
+        running tasks. The array is handled by the :class:`Scheduler` and
+        the :class:`Watchdog` as a single job.
+
+        :param executable: application/version to run.
+        :type executable: str
+        :param opts: options to be passed to the executable.
+        :type opts: list(str)
+        :param odir: where to create the output directory.
+        :type odir: str
+        :param size: number of tasks.
+        :type size: int
+        :param registry: instance to register the object (see :class:`Job`).
+        :type registry: JobRegistry or None
+        :param max_running: maximum number of tasks running at the same \
+        time. By default, the number of CPUs.
+        :type max_running: int or None
+        :param retry: policy to retry the tasks which fail.
+        :type retry: RetryPolicy or None
+
+        :ivar command: Command to be executed, with the index placeholder.
+        :ivar size: Number of tasks.
+        :ivar max_running: Maximum number of tasks running at the same time.
+        :ivar retry: Policy to retry the tasks which fail.
+        :ivar start_time: Time when the array was started.
+        :ivar end_time: Time when the last task finished.
+        '''
+        super(JobArray, self).__init__(odir, registry=registry)
+
+        self.command     = [executable] + opts
+        self.size        = size
+        self.max_running = max_running if max_running is not None else multiprocessing.cpu_count()
+        self.retry       = retry
+
+        self.start_time = None
+        self.end_time   = None
+
+        self._states     = array.array('B', [0]) * size
+        self._exit_codes = array.array('i', [self.__no_exit_code__]) * size
+        self._attempts   = array.array('H', [0]) * size
+        self._counts     = [size] + [0] * (len(self.__task_states__) - 1)
+
+        self._pending = iter(())
+        self._task    = None
+
+    def __len__( self ):
+        '''
+        Return the number of tasks.
+
+        :returns: number of tasks.
+        :rtype: int
+        '''
+        return self.size
+
+    def _execute( self ):
+        '''
+        Function to be sent to a new thread, launching and polling the
+        processes of the tasks.
+        '''
+        # Running tasks, and failed tasks waiting to be retried (heap with the
+        # time to launch them again)
+        running = {}
+        retries = []
+
+        while True:
+
+            if self._kill_event.is_set():
+
+                logging.getLogger(__name__).warning(
+                    'Killing running tasks of job array "{}"'.format(self.full_jid()))
+
+                for i, p in running.items():
+                    self._kill_process(p)
+                    self._set_task(i, StatusCode.killed, p.returncode)
+
+                for _, i in retries:
+                    self._set_task(i, StatusCode.killed)
+
+                for i in self._pending:
+                    self._set_task(i, StatusCode.killed)
+
+                break
+
+            # Launch the tasks while there are free slots
+            while len(running) < self.max_running:
+
+                if retries and retries[0][0] <= time.time():
+                    i = heapq.heappop(retries)[1]
+                else:
+                    i = next(self._pending, None)
+                    if i is None:
+                        break
+
+                p = self._launch(i)
+
+                if p is not None:
+                    running[i] = p
+
+            for i, p in list(running.items()):
+
+                code = p.poll()
+
+                if code is None:
+                    continue
+
+                del running[i]
+
+                if code != 0 and self.retry is not None and self.retry.should_retry(self._attempts[i], code):
+                    heapq.heappush(retries, (time.time() + self.retry.delay(self._attempts[i]), i))
+                    self._set_task(i, StatusCode.queued, code)
+                elif code == 0:
+                    self._set_task(i, StatusCode.terminated, code)
+                else:
+                    self._set_task(i, StatusCode.killed, code)
+
+            if not running and not retries and self._counts[1] == 0:
+                break
+
+            time.sleep(self.__poll_interval__)
+
+        self.end_time = time.time()
+
+        if self._counts[self.__task_states__.index(StatusCode.killed)]:
+
+            logging.getLogger(__name__).error(
+                'Some tasks of job array "{}" have failed; see output in {}'.format(self.full_jid(), self._odir))
+
+            self._kill_event.set()
+        else:
+            self._terminated_event.set()
+
+    def _kill_process( self, proc ):
+        '''
+        Kill the given process and wait for it.
+
+        :param proc: process to kill.
+        :type proc: spawn.SpawnedProcess or spawn.GroupPopen
+        '''
+        proc.kill()
+        proc.wait()
+
+    def _launch( self, index ):
+        '''
+        Launch the process of a task, creating its directory if needed.
+
+        :param index: index of the task.
+        :type index: int
+        :returns: launched process, or None if it can not be launched.
+        :rtype: spawn.SpawnedProcess or spawn.GroupPopen or None
+        '''
+        tdir = self.task_dir(index)
+
+        if os.path.exists(tdir):
+            utils.clear_dir(tdir)
+        else:
+            os.mkdir(tdir)
+
+        self._attempts[index] += 1
+
+        try:
+            p = spawn.spawn(self.task_command(index), tdir,
+                            os.path.join(tdir, 'stdout'),
+                            os.path.join(tdir, 'stderr'))
+        except Exception as e:
+            logging.getLogger(__name__).error(
+                'Unable to launch task {} of job array "{}": {}'.format(index, self.full_jid(), e))
+            self._set_task(index, StatusCode.killed, 1)
+            return None
+
+        self._set_task(index, StatusCode.running)
+
+        return p
+
+    def _set_task( self, index, status, exit_code = None ):
+        '''
+        Set the status and the exit code of a task, updating the number of
+        tasks with each status.
+
+        :param index: index of the task.
+        :type index: int
+        :param status: status of the task.
+        :type status: str
+        :param exit_code: exit code of the task.
+        :type exit_code: int or None
+        '''
+        s = self.__task_states__.index(status)
+
+        self._counts[self._states[index]] -= 1
+        self._counts[s] += 1
+
+        self._states[index]     = s
+        self._exit_codes[index] = exit_code if exit_code is not None else self.__no_exit_code__
+
+    def counts( self ):
+        '''
+        Return the number of tasks with each status.
+
+        :returns: number of tasks per status.
+        :rtype: dict(str, int)
+        '''
+        return dict(zip(self.__task_states__, self._counts))
+
+    def start( self, indices = None ):
+        '''
+        Start the tasks of the array.
+
+        :param indices: indices of the tasks to run. By default, all the \
+        tasks are run.
+        :type indices: iterable(int) or None
+        '''
+        if self._task is not None and self._task.is_alive():
+            logging.getLogger(__name__).warning(
+                'Restarting unfinished job array {}'.format(self.jid))
+            self.kill()
+
+        indices = range(self.size) if indices is None else array.array('L', indices)
+
+        for i in indices:
+            self._set_task(i, StatusCode.queued)
+
+        self._pending = iter(indices)
+
+        with status_lock(self):
+
+            self._status = StatusCode.running
+
+            self._kill_event.clear()
+            self._terminated_event.clear()
+
+            self.start_time = time.time()
+            self.end_time   = None
+
+            self._task = threading.Thread(target=self._execute)
+            self._task.start()
+
+    def task_command( self, index ):
+        '''
+        Return the command executed by a task.
+
+        :param index: index of the task.
+        :type index: int
+        :returns: command of the task.
+        :rtype: list(str)
+        '''
+        return [c.replace(self.__index_placeholder__, str(index)) for c in self.command]
+
+    def task_dir( self, index ):
+        '''
+        Return the directory of a task.
+        It is only created once the task is launched.
+
+        :param index: index of the task.
+        :type index: int
+        :returns: path to the directory.
+        :rtype: str
+        '''
+        return os.path.join(self._odir, str(index))
+
+    def task_exit_code( self, index ):
+        '''
+        Return the exit code of the last process of a task.
+
+        :param index: index of the task.
+        :type index: int
+        :returns: exit code, or None if the task has not finished.
+        :rtype: int or None
+        '''
+        c = self._exit_codes[index]
+
+        return c if c != self.__no_exit_code__ else None
+
+    def task_status( self, index ):
+        '''
+        Return the status of a task.
+
+        :param index: index of the task.
+        :type index: int
+        :returns: status of the task.
+        :rtype: str
+        '''
+        return self.__task_states__[self._states[index]]
+
+    def update_status( self ):
+        '''
+        Update the status of the job array. Its cost does not depend on the
+        number of tasks.
+
+        .. warning::
+           This method is reserved to be used by the class :class:`Watchdog`.
+           Using it on your own might cause undefined behaviour.
+        '''
+        # The lock prevents overwriting the status if the job is restarted
+        with status_lock(self):
+            if self._terminated_event.is_set():
+
+                self._status = StatusCode.terminated
+
+            elif self._task is not None:
+                if not self._task.is_alive():
+                    if self._kill_event.is_set():
+                        self._status = StatusCode.killed
+
+    def wait( self ):
+        '''
+        Wait till all the tasks are done.
+        If the job array is queued, wait also till it is started.
+        '''
+        self._wait_queued()
+
+        if getattr(self, '_task', None) is not None:
+            self._task.join()
+
+
+class PyJob(Job):
+
+    def __init__( self, func, args, odir, kwargs = None, pool = None, registry = None, retry = None, speculation = None, cleanup = 'wipe', index_logs = False, scratch = None, timeout = None ):
+        '''
+        Represent a job running a Python callable in a pool of persistent
+        worker processes, avoiding the start-up time of the interpreter.
+        The status, kill and registry semantics are the same as those of
+        :class:`Job`. A job succeeds if the callable returns without raising
+        an exception; calls to :func:`sys.exit` define the exit code.
+        The callable and its arguments must be picklable.
+
+        :param func: callable to run.
+        :type func: function
+        :param args: positional arguments to the callable.
+        :type args: tuple
+        :param odir: where to create the output directory.
+        :type odir: str
+        :param kwargs: keyword arguments to the callable.
+        :type kwargs: dict or None
+        :param pool: pool to run the callable. By default, a pool shared \
+        among all the jobs of this kind is used.
+        :type pool: WorkerPool or None
+        :param registry: instance to register the object. If "None", the \
+        object will be registered in the main :class:`ContextManager` instance.
+        :type registry: JobRegistry or None
+        :param retry: policy to retry the job if it fails.
+        :type retry: RetryPolicy or None
+        :param speculation: detector of stragglers.
+        :type speculation: StragglerDetector or None
+        :param cleanup: how to empty the output directory (see :class:`Job`).
+        :type cleanup: str
+        :param index_logs: whether to build an index of the log files (see \
+        :class:`Job`).
+        :type index_logs: bool
+        :param scratch: directory in a local file system to run the callable \
+        (see :class:`Job`).
+        :type scratch: str or None
+        :param timeout: maximum time (in seconds) each attempt to run the \
+        callable can take (see :class:`Job`).
+        :type timeout: float or None
+
+        :ivar func: Callable to run.
+        :ivar args: Positional arguments to the callable.
+        :ivar kwargs: Keyword arguments to the callable.
+        :ivar pool: Pool to run the callable.
+        '''
+        name = '{}.{}'.format(getattr(func, '__module__', None), getattr(func, '__name__', repr(func)))
+
+        super(PyJob, self).__init__(name, [], odir, registry=registry, retry=retry,
+                                    speculation=speculation, cleanup=cleanup,
+                                    index_logs=index_logs, scratch=scratch,
+                                    timeout=timeout)
+
+        self.func   = func
+        self.args   = tuple(args)
+        self.kwargs = dict(kwargs) if kwargs is not None else {}
+        self.pool   = pool
+
+    def _fingerprint( self ):
+        '''
+        The arguments of the callables can not be compared reliably, so
+        these jobs are never considered identical.
+
+        :returns: None.
+        :rtype: None
+        '''
+        return None
+
+    def _runtime_key( self ):
+        '''
+        Return the key used to gather the runtime statistics of this job,
+        which is the name of the callable.
+
+        :returns: key of the job.
+        :rtype: str
+        '''
+        return self.command[0]
+
+    def _spawn( self, command, cwd, block = True, logdir = None ):
+        '''
+        Run the callable in the pool, in the given directory.
+
+        :param command: ignored.
+        :type command: list(str)
+        :param cwd: working directory.
+        :type cwd: str
+        :param block: whether to wait for a worker to be free.
+        :type block: bool
+        :param logdir: directory for the log files.
+        :type logdir: str or None
+        :returns: running task, or None if "block" is False and all the \
+        workers are busy.
+        :rtype: PoolTask or None
+        '''
+        p = self.pool if self.pool is not None else pool.default_pool()
+
+        return p.submit(self.func, self.args, self.kwargs, cwd, block=block, logdir=logdir)
+
+    def compact( self, registry ):
+        '''
+        Jobs running Python callables are not compacted, since records do not
+        hold the callable and its arguments.
+
+        :param registry: registry owning the job.
+        :type registry: JobRegistry
+        :returns: None.
+        :rtype: None
+        '''
+        return None
+
+
+class Step(Job):
+
+    __str_attrs__ = utils.merge_dicts(Job.__str_attrs__, {'data regex': 'data_regex'})
+
+    # File storing the fingerprints of the last successful run
+    __fingerprint_file__ = '.fingerprint'
+
+    # Ways to decide whether the files have changed
+    __incremental_modes__ = ('stat', 'hash')
+
+    def __init__( self, name, executable, opts, parent, data_regex = None, data_builder = None, retry = None, data_glob = None, data_recursive = False, data_manifest = False, speculation = None, cleanup = None, source = None, capacity = None, index_logs = None, incremental = None, scratch = None, timeout = None ):
+        '''
+        Represent a step on a generation process.
+
+        :param name: name of the step.
+        :type name: str
+        :param executable: application/version to run.
+        :type executable: str
+        :param opts: options to be passed to the executable.
+        :type opts: list(str)
+        :param parent: parent job, inheriting from :class:`SteppedJob`.
+        :type parent: SteppedJob
+        :param data_regex: regex representing the output data to send to the \
+        next step. It is matched against the paths relative to the output \
+        directory. If neither this nor "data_glob" are provided, no data is \
+        sent to the next step.
+        :type data_regex: str or None
+        :param data_builder: function to define the way how the data is passed \
+        to the executable. It must take a list of strings (paths to the data \
+        files), and return a merged string. The default behaviour is to \
+        return list to be executed as: \
+        <executable> file1 file2 ... \
+        but one can also define the string so the argument is explicitely \
+        specified, like: \
+        <executable> --files file1 file2 ...
+        :type data_builder: function
+        :param retry: policy to retry the step if it fails. Only this step \
+        is run again, using the same input data. By default, the policy of \
+        the parent job is used.
+        :type retry: RetryPolicy or None
+        :param data_glob: glob pattern representing the output data to send \
+        to the next step. If "data_regex" is also provided, the files must \
+        match both.
+        :type data_glob: str or None
+        :param data_recursive: whether to look for the output data also in \
+        the subdirectories of the output directory.
+        :type data_recursive: bool
+        :param data_manifest: if set to True, the output files are written \
+        to a file called "manifest" in the output directory (one path per \
+        line), and the path to it is the only data sent to the next step. \
+        This avoids building long argument lists for the next step.
+        :type data_manifest: bool
+        :param speculation: detector of stragglers. The runtime statistics \
+        are shared among the steps with the same name. By default, the \
+        detector of the parent job is used.
+        :type speculation: StragglerDetector or None
+        :param cleanup: how to empty the output directory before running the \
+        process (see :class:`Job`). By default, the mode of the parent job \
+        is used.
+        :type cleanup: str or None
+        :param source: name of the step whose output data is used as input \
+        for this step. By default, the previous step is used. If many steps \
+        take the same source, the data is split in contiguous batches, one \
+        per step, which can run in parallel.
+        :type source: str or None
+        :param capacity: maximum number of messages sent by this step which \
+        can be pending to be processed by the consumers (see :class:`Channel`).
+        :type capacity: int or None
+        :param index_logs: whether to build an index of the log files (see \
+        :class:`Job`). By default, the value of the parent job is used.
+        :type index_logs: bool or None
+        :param incremental: if "stat" or "hash", the step is not run again \
+        if its command and the fingerprints of its input and output files \
+        have not changed since its last successful run (see \
+        :func:`SteppedJob.start`). With "stat", files are compared by size \
+        and modification time. With "hash", the digest of the content is \
+        also stored, so files written again with the same content do not \
+        trigger the next steps. If False, the step is always run. By \
+        default, the value of the parent job is used.
+        :type incremental: str or bool or None
+        :param scratch: directory in a local file system to run the step \
+        (see :class:`Job`). The input files are hard-linked (or copied, if \
+        it is not possible) to the scratch area, so they must not be \
+        modified. If the step succeeds, only the output data is moved to \
+        the output directory. By default, the value of the parent job is \
+        used.
+        :type scratch: str or None
+        :param timeout: maximum time (in seconds) each attempt to run the \
+        step can take (see :class:`Job`). Since the steps share the "kill" \
+        signal, the rest of the steps are killed too. By default, the \
+        value of the parent job is used.
+        :type timeout: float or None
+        :raises RuntimeError: if the name used for this step is already \
+        being used in another step.
+        :raises LookupError: if the source step does not exist.
+        :raises ValueError: if the incremental mode is unknown.
+
+        :ivar executable: Command to be executed. Input data is added when the \
+        process just before execution (once it is defined).
+        :ivar name: Name of the step.
+        :ivar data_builder: Function that modifies the input data to parse it \
+        to the executable.
+        :ivar data_regex: Regex representing the output data.
+        :ivar data_glob: Glob pattern representing the output data.
+        :ivar data_recursive: Whether to look for output data recursively.
+        :ivar data_manifest: Whether to send the output data through a manifest.
+        :ivar incremental: Way to decide whether the step is up to date.
+        :ivar skipped: Whether the last start of the step did not run the \
+        process, since the step was up to date.
+        :ivar jid: Job ID, determined by the subdirectories in the output path.
+        '''
+        incremental = incremental if incremental is not None else parent.incremental
+
+        if incremental and incremental not in self.__incremental_modes__:
+            raise ValueError('Unknown incremental mode "{}"; choose between {}'.format(
+                incremental, self.__incremental_modes__))
+
+        if any(map(lambda s: s.name == name, parent.steps)):
+            raise RuntimeError('Unable to create step "{}"; another '\
+                               'with the same name already exists'.format(name))
+
+        # Set the input channel. Need to do this before the object is
+        # registered
+        if source is not None:
+            for s in parent.steps:
+                if s.name == source:
+                    break
+            else:
+                raise LookupError('Unable to find step with name "{}"'.format(source))
+        elif len(parent.steps):
+            s = parent.steps[-1]
+        else:
+            s = None
+
+        if s is not None:
+            self._input          = s._channel
+            self._input_manifest = s.data_manifest
+            self._consumer       = s._channel.subscribe()
+        else:
+            self._input          = None
+            self._input_manifest = False
+            self._consumer       = None
+
+        super(Step, self).__init__(executable,
+                                   opts,
+                                   os.path.join(os.path.abspath(parent._odir), name),
+                                   kill_event=parent._kill_event,
+                                   registry=parent.steps,
+                                   retry=retry if retry is not None else parent.retry,
+                                   speculation=speculation if speculation is not None else parent.speculation,
+                                   cleanup=cleanup if cleanup is not None else parent.cleanup,
+                                   index_logs=index_logs if index_logs is not None else parent.index_logs,
+                                   scratch=scratch if scratch is not None else parent.scratch,
+                                   timeout=timeout if timeout is not None else parent.timeout)
+
+        self.name = name
+
+        # This is the channel to send the output data
+        self._channel = Channel(capacity)
+
+        # Set the command to define how the data is parsed to the executable
+        if data_builder is None:
+            self.data_builder = lambda d, *args, **kwargs: ' '.join(d)
+        else:
+            self.data_builder = data_builder
+
+        self.data_regex     = data_regex
+        self.data_glob      = data_glob
+        self.data_recursive = data_recursive
+        self.data_manifest  = data_manifest
+        self.incremental    = incremental
+        self.skipped        = False
+
+        # Input data of the last run
+        self._data = None
+
+    def _check_fingerprint( self, command, data ):
+        '''
+        Compare the command and the input data with those of the last
+        successful run of this step, checking also that its output files
+        have not changed.
+
+        :param command: full command to execute.
+        :type command: list(str)
+        :param data: input data.
+        :type data: list(str)
+        :returns: output data of the last run if the step is up to date \
+        (None otherwise), and fingerprints of the input files (None if \
+        they do not exist).
+        :rtype: tuple(list(str) or None, dict or None)
+        '''
+        try:
+            with open(os.path.join(self._odir, self.__fingerprint_file__), 'rt') as f:
+                last = json.load(f)
+        except (IOError, OSError, ValueError):
+            last = None
+
+        try:
+            inputs = self._fingerprint(data, self._input_manifest, last['inputs'] if last else None)
+        except (IOError, OSError):
+            return None, None
+
+        if last is None or last['command'] != command or not self._same_fingerprints(inputs, last['inputs']):
+            return None, inputs
+
+        try:
+            outputs = self._fingerprint(last['data'], self.data_manifest, last['outputs'])
+        except (IOError, OSError):
+            return None, inputs
+
+        if not self._same_fingerprints(outputs, last['outputs']):
+            return None, inputs
+
+        return last['data'], inputs
+
+    def _collect_output( self ):
+        '''
+        Collect the output data of this step.
+
+        :returns: output data to send to the next step.
+        :rtype: list(str)
+        '''
+        files = utils.find_files(self._odir, self.data_regex, self.data_glob, self.data_recursive)
+
+        if self.data_manifest:
+
+            path = os.path.join(self._odir, 'manifest')
+
+            utils.write_manifest(path, files)
+
+            return [path]
+        else:
+            return list(files)
+
+    def _execute( self ):
+        '''
+        Function to be sent to a new thread, and execute the step process.
+        '''
+        if self._input is not None:
+            # Get data from the input channel if it exists, and prepare input
+
+            data = self._input.get(self._consumer)
+
+            self._data = data
+
+            if data is not None:
+                extra_opts = self.data_builder(data).split()
+            else:
+                # The previous step has been killed, so this step can not run
+                # and the "kill" signal is propagated
+                extra_opts = None
+                self._kill_event.set()
+        else:
+            # This is the first job, it has no input data
+
+            extra_opts = []
+
+        self.skipped = False
+
+        output = inputs = None
+
+        if self.incremental and extra_opts is not None and not self._kill_event.is_set():
+
+            output, inputs = self._check_fingerprint(self.command + extra_opts, data if self._input is not None else [])
+
+            if output is not None:
+
+                logging.getLogger(__name__).info(
+                    'Step "{}" is up to date; skipping'.format(self.name))
+
+                self.skipped   = True
+                self.attempts  = 0
+                self.exit_code = 0
+
+        if not self.skipped and not self._kill_event.is_set():
+            self._run_process(extra_opts)
+
+        if self._kill_event.is_set():
+            # This message is displayed if this step is asked to be killed
+            # or if the signal comes from other step. The "kill" signal is
+            # propagated by aborting the channel to the next steps.
+            logging.getLogger(__name__).warning(
+                'Step "{}" has been killed'.format(self.name))
+
+            self._channel.abort()
+        else:
+            # Notify the input channel that we have finished. The data is
+            # kept by the channel in case the step is restarted.
+            if self._input is not None:
+                self._input.ack(self._consumer)
+
+            # Build and store the requested output files
+            if not self.skipped:
+
+                output = self._collect_output()
+
+                if self.incremental and inputs is not None:
+                    self._write_fingerprint(self.command + extra_opts, inputs, output)
+
+            self._channel.put(output)
+
+            self._terminated_event.set()
+
+    def _fingerprint( self, paths, manifest, previous = None ):
+        '''
+        Return the fingerprints of the given files (see
+        :func:`utils.file_fingerprint`).
+
+        :param paths: paths to the files.
+        :type paths: list(str)
+        :param manifest: whether the files are manifests, so the \
+        fingerprints of the files listed in them are also computed.
+        :type manifest: bool
+        :param previous: previous fingerprints, to avoid computing again \
+        the digests of the files which have not been modified.
+        :type previous: dict or None
+        :returns: fingerprints of the files.
+        :rtype: dict
+        :raises OSError: if any of the files does not exist.
+        '''
+        paths = list(paths)
+
+        if manifest:
+            for p in list(paths):
+                paths += utils.read_manifest(p)
+
+        previous = previous if previous is not None else {}
+
+        return {p: utils.file_fingerprint(p, self.incremental, previous.get(p)) for p in paths}
+
+    def _same_fingerprints( self, first, second ):
+        '''
+        Check whether two sets of fingerprints correspond to the same files
+        (see :func:`utils.same_fingerprint`).
+
+        :param first: first set of fingerprints.
+        :type first: dict
+        :param second: second set of fingerprints.
+        :type second: dict
+        :returns: whether the fingerprints are equivalent.
+        :rtype: bool
+        '''
+        if set(first) != set(second):
+            return False
+
+        return all(utils.same_fingerprint(first[p], second[p], self.incremental) for p in first)
+
+    def _stage_in( self, command, path ):
+        '''
+        Hard-link (or copy) the input data of the step to the scratch area,
+        building the command with the new paths. If the input data are
+        manifests, the files listed in them are staged too, and new
+        manifests are written.
+
+        :param command: full command to execute, which is ignored if there \
+        is input data.
+        :type command: list(str)
+        :param path: directory to put the input files in. It does not exist.
+        :type path: str
+        :returns: command to execute in the scratch area.
+        :rtype: list(str)
+        '''
+        if self._input is None or not self._data:
+            return command
+
+        os.mkdir(path)
+
+        data = []
+        for i, p in enumerate(self._data):
+
+            # Files with the same name might come from different directories
+            d = os.path.join(path, str(i))
+            os.mkdir(d)
+
+            local = os.path.join(d, os.path.basename(p))
+
+            if self._input_manifest:
+
+                files = []
+                for j, f in enumerate(utils.read_manifest(p)):
+
+                    os.mkdir(os.path.join(d, str(j)))
+
+                    files.append(os.path.join(d, str(j), os.path.basename(f)))
+
+                    utils.link_or_copy(f, files[-1])
+
+                utils.write_manifest(local, files)
+            else:
+                utils.link_or_copy(p, local)
+
+            data.append(local)
+
+        return self.command + self.data_builder(data).split()
+
+    def _write_fingerprint( self, command, inputs, output ):
+        '''
+        Store the fingerprints of the last successful run of this step in
+        its output directory.
+
+        :param command: full command executed.
+        :type command: list(str)
+        :param inputs: fingerprints of the input files.
+        :type inputs: dict
+        :param output: output data sent to the next steps.
+        :type output: list(str)
+        '''
+        try:
+            outputs = self._fingerprint(output, self.data_manifest)
+        except (IOError, OSError):
+            # The output can not be tracked, so the step will be run again
+            return
+
+        with open(os.path.join(self._odir, self.__fingerprint_file__), 'wt') as f:
+            json.dump({'command': command, 'inputs': inputs, 'data': output, 'outputs': outputs}, f)
+
+    def _output_files( self, path ):
+        '''
+        Return the output data files of the step, to move them to the
+        output directory once the process finishes successfully in the
+        scratch area.
+
+        :param path: working directory of the process.
+        :type path: str
+        :returns: paths to the files.
+        :rtype: generator(str)
+        '''
+        return utils.find_files(path, self.data_regex, self.data_glob, self.data_recursive)
+
+    def _runtime_key( self ):
+        '''
+        Return the key used to gather the runtime statistics of this step,
+        which is its name.
+
+        :returns: key of the step.
+        :rtype: str
+        '''
+        return self.name
+
+    def compact( self, registry ):
+        '''
+        Steps can not be compacted, since they are linked to the other steps
+        of the parent job.
+
+        :param registry: registry owning the step.
+        :type registry: JobRegistry
+        :returns: None.
+        :rtype: None
+        '''
+        return None
+
+    def clear_output_data( self ):
+        '''
+        Remove the output data from this step.
+        '''
+        self._channel.clear()
+
+    def full_jid( self ):
+        '''
+        Return the full job ID for this step.
+        This is the addition of the index on the :class:`JobRegistry` object
+        who owns it and its name.
+
+        :returns: full name of this step.
+        :rtype: str
+        '''
+        return os.path.join(str(self.jid), self.name)
+
+
+class SteppedJob(JobBase):
+
+    def __init__( self, path = None, registry = None, retry = None, speculation = None, cleanup = 'wipe', index_logs = False, incremental = False, scratch = None, timeout = None, deadline = None ):
+        '''
+        Instance to handle different steps, linked together. This object
+        creates a new directory under "path" with a job ID. This job ID
+        is expected to be a number, and the next to the greatest in the
+        directory will be associated to the job (0 if none is found).
+
+        :param path: path to the desired directory.
+        :type path: str
+        :param registry: instance to register the object. If "None", the \
+        object will be registered in the main :class:`ContextManager` instance. \
+        Remember to close the :class:`ContextManager` class via \
+        :func:`ContextManager.close` or setting your execution withing a \
+        context.
+        :type registry: JobRegistry or None
+        :param retry: default policy to retry the steps if they fail.
+        :type retry: RetryPolicy or None
+        :param speculation: default detector of stragglers for the steps.
+        :type speculation: StragglerDetector or None
+        :param cleanup: default way to empty the output directories of the \
+        steps (see :class:`Job`).
+        :type cleanup: str
+        :param index_logs: default value to decide whether to build an index \
+        of the log files of the steps (see :class:`Job`).
+        :type index_logs: bool
+        :param incremental: default way to decide whether the steps are up \
+        to date, so they are not run again (see :class:`Step`).
+        :type incremental: str or bool
+        :param scratch: default directory in a local file system to run the \
+        steps (see :class:`Step`).
+        :type scratch: str or None
+        :param timeout: default maximum time (in seconds) each attempt to \
+        run a step can take (see :class:`Step`).
+        :type timeout: float or None
+        :param deadline: maximum time (in seconds) the whole job can take \
+        since it is started. If it is exceeded, the running steps are \
+        killed and the status of the job is set to \
+        :attr:`StatusCode.timed_out`.
+        :type deadline: float or None
+
+        :ivar steps: Steps managed by this job.
+        :ivar jid: Job ID, determined by the subdirectories in the output path.
+        :ivar retry: Default policy to retry the steps if they fail.
+        :ivar speculation: Default detector of stragglers for the steps.
+        :ivar cleanup: Default way to empty the output directories of the steps.
+        :ivar index_logs: Default value to decide whether to index the logs \
+        of the steps.
+        :ivar incremental: Default way to decide whether the steps are up \
+        to date.
+        :ivar scratch: Default directory to run the steps in a local file \
+        system.
+        :ivar timeout: Default maximum time each attempt to run a step can \
+        take.
+        :ivar deadline: Maximum time the whole job can take.
+        '''
+        # The watchdog of the registry might access these attributes as soon
+        # as the job is registered
+        self._starting = False
+
+        self.steps = JobRegistry()
+
+        super(SteppedJob, self).__init__(path, registry=registry)
+
+        self.retry       = retry
+        self.speculation = speculation
+        self.cleanup     = cleanup
+        self.index_logs  = index_logs
+        self.incremental = incremental
+        self.scratch     = scratch
+        self.timeout     = timeout
+        self.deadline    = deadline
+
+        # Timer of the deadline
+        self._timer = None
+
+    def __del__( self ):
+        '''
+        Kill running processes on deletion.
+        '''
+        super(SteppedJob, self).__del__()
+
+        for s in getattr(self, 'steps', ()):
+            s.wait()
+
+    def __str__( self ):
+        '''
+        Representation as a string.
+
+        :returns: this class as a string.
+        :rtype: str
         '''
         return 'Job {} with steps:\n'.format(self.jid) + '\n'.join(map(str, self.steps))
 
+    def _time_out( self ):
+        '''
+        Kill the running steps since the job has exceeded its deadline.
+        Called by the :class:`Watchdog` of the registry.
+        '''
+        with status_lock(self):
+
+            if self._status != StatusCode.running:
+                return
+
+            logging.getLogger(__name__).warning(
+                'Job {} has exceeded its deadline of {} seconds; killing it'.format(self.jid, self.deadline))
+
+            self._timed_out = True
+
+            self._kill_event.set()
+
+    def resume( self ):
+        '''
+        Start again the job from the first step which did not terminate,
+        reusing the output of the previous steps.
+        If all the steps are terminated, nothing is done.
+        '''
+        for i, s in enumerate(self.steps):
+            if s.status() != StatusCode.terminated:
+                self.start(i)
+                break
+
     def start( self, first = 0 ):
         '''
         Start the job from the given step ID.
+        Incremental steps (see :class:`Step`) whose command, input and output
+        files have not changed since their last successful run are not run
+        again, and their previous output is sent to the next steps. Hence
+        only the steps depending on modified data are executed.
 
         :param first: step ID to start processing.
         :type first: int or str
@@ -514,35 +2393,54 @@ class SteppedJob(JobBase):
                 'Restarting unfinished job {}'.format(self.jid))
             self.kill()
 
-        self._status = StatusCode.running
+        # The watchdog must not consider the job finished due to the status
+        # of the previous execution of the steps
+        with status_lock(self):
 
-        self._kill_event.clear()
-        self._terminated_event.clear()
+            self._status    = StatusCode.running
+            self._starting  = True
+            self._timed_out = False
 
-        logging.getLogger(__name__).info(
-            'Job {} with steps: {}'.format(self.jid, [s.name for s in self.steps]))
+            self._kill_event.clear()
+            self._terminated_event.clear()
 
-        if isinstance(first, str):
+            if self._timer is not None:
+                self._watchdog.cancel_timer(self._timer)
 
-            error = True
-            for i, s in enumerate(self.steps):
-                if s.name == first:
-                    error = False
-                    break
-            if error:
-                raise LookupError('Unable to find step with name "{}"'.format(first))
+            if self.deadline is not None:
+                self._timer = self._watchdog.add_timer(self.deadline, self._time_out)
+            else:
+                self._timer = None
 
-        else:
-            i = first
+        try:
+            logging.getLogger(__name__).info(
+                'Job {} with steps: {}'.format(self.jid, [s.name for s in self.steps]))
+
+            if isinstance(first, str):
+
+                error = True
+                for i, s in enumerate(self.steps):
+                    if s.name == first:
+                        error = False
+                        break
+                if error:
+                    raise LookupError('Unable to find step with name "{}"'.format(first))
+
+            else:
+                i = first
 
-        logging.getLogger(__name__).info(
-            'Starting job {} from step "{}"'.format(self.jid, self.steps[i].name))
+            logging.getLogger(__name__).info(
+                'Starting job {} from step "{}"'.format(self.jid, self.steps[i].name))
 
-        for s in reversed(self.steps[i + 1:]):
-            s.clear_input_data()
+            # Remove the data produced by the steps to run again. The input data
+            # of the first step is kept.
+            for s in reversed(self.steps[i:]):
+                s.clear_output_data()
 
-        for s in self.steps[i:]:
-            s.start()
+            for s in self.steps[i:]:
+                s.start()
+        finally:
+            self._starting = False
 
     def update_status( self ):
         '''
@@ -552,24 +2450,43 @@ class SteppedJob(JobBase):
            This method is reserved to be used by the class :class:`Watchdog`.
            Using it on your own might cause undefined behaviour.
         '''
-        if self._status not in (StatusCode.terminated, StatusCode.killed):
+        with status_lock(self):
+            if not self._starting and self._status not in (StatusCode.terminated, StatusCode.killed, StatusCode.timed_out):
 
-            if all(map(lambda t: t.status() == StatusCode.terminated, self.steps)):
+                if all(map(lambda t: t.status() == StatusCode.terminated, self.steps)):
 
-                logging.getLogger(__name__).info('Job terminated')
+                    logging.getLogger(__name__).info('Job terminated')
 
-                self._status = StatusCode.terminated
+                    self._status = StatusCode.terminated
 
-            elif any(map(lambda t: t.status() == StatusCode.killed, self.steps)):
+                elif any(map(lambda t: t.status() in (StatusCode.killed, StatusCode.timed_out), self.steps)):
 
-                logging.getLogger(__name__).warning(
-                    'Job {} has been killed'.format(self.jid))
+                    # The job is considered to time out if any of its steps
+                    # exceeded its timeout
+                    if self._timed_out or any(map(lambda t: t.status() == StatusCode.timed_out, self.steps)):
 
-                self._status = StatusCode.killed
+                        logging.getLogger(__name__).warning(
+                            'Job {} has timed out'.format(self.jid))
+
+                        self._status = StatusCode.timed_out
+                    else:
+                        logging.getLogger(__name__).warning(
+                            'Job {} has been killed'.format(self.jid))
+
+                        self._status = StatusCode.killed
+                else:
+                    return
+
+                if self._timer is not None:
+                    self._watchdog.cancel_timer(self._timer)
+                    self._timer = None
 
     def wait( self ):
         '''
         Wait for the steps for completion.
+        If the job is queued, wait also till it is started.
         '''
+        self._wait_queued()
+
         for s in self.steps:
             s.wait()
@@ -0,0 +1,671 @@
+'''
+Functions and classes to read the log files of the jobs.
+'''
+
+__author__  = ['Miguel Ramos Pernas']
+__email__   = ['miguel.ramos.pernas@cern.ch']
+
+# Python
+import array
+import binascii
+import json
+import mmap
+import os
+import re
+
+__all__ = ['LogFollower', 'LogIndex']
+
+# Regular expression to mark lines with errors or warnings
+__marker_regex__ = br'(?i)\b(error|warning|fatal|exception|traceback)\b'
+
+# Characters making the previous character optional in regular expressions
+__regex_optional__ = '?*{'
+
+
+def _literals( pattern ):
+    '''
+    Extract the literal strings which must be present in any string matching
+    the given regular expression.
+    The parsing is conservative: if the expression contains alternatives,
+    no literal is returned, and the content of groups is ignored.
+
+    :param pattern: regular expression.
+    :type pattern: str
+    :returns: literal strings, or None if they can not be determined.
+    :rtype: list(str) or None
+    '''
+    if '|' in pattern:
+        return None
+
+    out   = []
+    run   = ''
+    depth = 0
+
+    i = 0
+    while i < len(pattern):
+
+        c = pattern[i]
+
+        if c.isalnum() or c in ' _-:/=,;\'"<>!@#%&~`':
+            run += c
+            i += 1
+            continue
+
+        if c in __regex_optional__:
+            # The last character is optional
+            run = run[:-1]
+
+        # Groups might be optional, so their content is not used
+        if depth == 0:
+            out.append(run)
+
+        run = ''
+
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == '\\':
+            i += 1
+        elif c in '[{':
+            # Skip the character class or the repetition
+            i = pattern.find(']' if c == '[' else '}', i + 2)
+            if i < 0:
+                return None
+
+        i += 1
+
+    if depth == 0:
+        out.append(run)
+
+    # Inline flags, like "(?i)", are also skipped
+    return [l for l in out if len(l) >= 3]
+
+
+def _decode( line ):
+    '''
+    Decode a line read from a log file.
+
+    :param line: line to decode.
+    :type line: bytes
+    :returns: decoded line.
+    :rtype: str
+    '''
+    return line.decode('utf-8', 'replace')
+
+
+def search( path, pattern = None, markers_only = False ):
+    '''
+    Search for the lines matching a regular expression in a file without an
+    index (see :class:`LogIndex`), scanning it through :mod:`mmap`.
+
+    :param path: path to the file.
+    :type path: str
+    :param pattern: regular expression (using :func:`re.search`). If \
+    None, all the lines are considered to match.
+    :type pattern: str or None
+    :param markers_only: whether to consider only the lines with errors \
+    or warnings.
+    :type markers_only: bool
+    :returns: line numbers (starting from zero) and matching lines.
+    :rtype: list(tuple(int, str))
+    '''
+    match  = re.compile(pattern).search if pattern is not None else None
+    marker = re.compile(__marker_regex__).search if markers_only else None
+
+    out = []
+
+    with open(path, 'rb') as f:
+
+        if os.fstat(f.fileno()).st_size == 0:
+            return out
+
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            for n, l in enumerate(iter(mm.readline, b'')):
+
+                l = l.rstrip(b'\n')
+
+                if marker is not None and not marker(l):
+                    continue
+
+                l = _decode(l)
+
+                if match is None or match(l):
+                    out.append((n, l))
+        finally:
+            mm.close()
+
+    return out
+
+
+def tail( path, n = 10, pattern = None, block = 8192 ):
+    '''
+    Return the last lines of a file, reading it backwards from the end so
+    the cost does not depend on the size of the file.
+
+    :param path: path to the file.
+    :type path: str
+    :param n: number of lines to return.
+    :type n: int
+    :param pattern: if provided, only the lines matching this regular \
+    expression (using :func:`re.search`) are returned.
+    :type pattern: str or None
+    :param block: size of the blocks to read.
+    :type block: int
+    :returns: last lines of the file, without the end-of-line character.
+    :rtype: list(str)
+    '''
+    match = re.compile(pattern).search if pattern is not None else None
+
+    lines = []
+
+    with open(path, 'rb') as f:
+
+        f.seek(0, os.SEEK_END)
+
+        pos   = f.tell()
+        data  = b''
+        first = True
+
+        while pos > 0 and len(lines) < n:
+
+            size = min(block, pos)
+            pos -= size
+
+            f.seek(pos)
+
+            parts = (f.read(size) + data).split(b'\n')
+
+            if first:
+                # Ignore the end-of-line at the end of the file
+                if parts[-1] == b'':
+                    parts.pop()
+                first = False
+
+            # The first part might be incomplete
+            data = parts.pop(0) if pos > 0 else b''
+
+            for l in reversed(parts):
+
+                l = _decode(l)
+
+                if match is None or match(l):
+                    lines.append(l)
+
+                    if len(lines) == n:
+                        break
+
+    return list(reversed(lines))
+
+
+class LogFollower(object):
+
+    def __init__( self, pattern = None ):
+        '''
+        Object to follow the lines appended to many files.
+        Files are checked through :func:`os.stat`, and only the new bytes are
+        read, so the cost of following inactive files is negligible.
+        If a file is truncated or replaced (e.g. because the job is
+        restarted) it is read again from the beginning.
+
+        :param pattern: if provided, only the lines matching this regular \
+        expression (using :func:`re.search`) are returned.
+        :type pattern: str or None
+        '''
+        super(LogFollower, self).__init__()
+
+        self._match = re.compile(pattern).search if pattern is not None else None
+
+        # Path, inode, offset and incomplete last line for each key
+        self._files = {}
+
+    def __contains__( self, key ):
+        '''
+        Check whether a file is being followed.
+
+        :param key: key of the file.
+        :type key: object
+        :returns: whether the file is followed.
+        :rtype: bool
+        '''
+        return key in self._files
+
+    def __len__( self ):
+        '''
+        Return the number of followed files.
+
+        :returns: number of files.
+        :rtype: int
+        '''
+        return len(self._files)
+
+    def _read( self, key, out ):
+        '''
+        Read the new lines of a followed file.
+
+        :param key: key of the file.
+        :type key: object
+        :param out: list to append the keys and the new lines.
+        :type out: list(tuple(object, str))
+        '''
+        entry = self._files[key]
+
+        path, ino, offset, partial = entry
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+
+        if st.st_ino != ino or st.st_size < offset:
+            # New or truncated file
+            ino, offset, partial = st.st_ino, 0, b''
+
+        if st.st_size > offset:
+
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(st.st_size - offset)
+
+            offset += len(data)
+
+            parts = (partial + data).split(b'\n')
+
+            partial = parts.pop()
+
+            for l in parts:
+
+                l = _decode(l)
+
+                if self._match is None or self._match(l):
+                    out.append((key, l))
+
+        entry[1:] = [ino, offset, partial]
+
+    def add( self, key, path, from_start = False ):
+        '''
+        Start following a file.
+
+        :param key: key to identify the file.
+        :type key: object
+        :param path: path to the file.
+        :type path: str
+        :param from_start: whether to return also the current content of \
+        the file. Otherwise only the new lines are returned.
+        :type from_start: bool
+        '''
+        ino, offset = None, 0
+
+        if not from_start:
+            try:
+                st = os.stat(path)
+                ino, offset = st.st_ino, st.st_size
+            except OSError:
+                pass
+
+        self._files[key] = [path, ino, offset, b'']
+
+    def keys( self ):
+        '''
+        Return the keys of the followed files.
+
+        :returns: keys of the files.
+        :rtype: list
+        '''
+        return list(self._files.keys())
+
+    def poll( self ):
+        '''
+        Read the new lines of the followed files.
+        Incomplete lines are kept till the end-of-line is written.
+
+        :returns: keys of the files and new lines.
+        :rtype: list(tuple(object, str))
+        '''
+        out = []
+        for key in self._files:
+            self._read(key, out)
+
+        return out
+
+    def remove( self, key ):
+        '''
+        Stop following a file, returning its last lines (including the
+        incomplete last line, if any).
+
+        :param key: key of the file.
+        :type key: object
+        :returns: keys of the files and new lines.
+        :rtype: list(tuple(object, str))
+        '''
+        out = []
+
+        self._read(key, out)
+
+        partial = self._files.pop(key)[3]
+
+        if partial:
+
+            l = _decode(partial)
+
+            if self._match is None or self._match(l):
+                out.append((key, l))
+
+        return out
+
+
+class LogIndex(object):
+
+    # Number of lines per block
+    __block_size__ = 128
+
+    # Version of the format of the stored indices
+    __version__ = 1
+
+    def __init__( self, path ):
+        '''
+        Compact index of a log file, to search in it without reading it
+        completely.
+        The lines are grouped in blocks, storing the offset of each block,
+        the lines with errors or warnings and, for each trigram of bytes
+        (lower-cased), the blocks where it appears. Searching for a regular
+        expression only reads the blocks containing all the trigrams of its
+        literal strings, through :mod:`mmap`.
+        The index is updated incrementally and it is stored next to the log
+        file, in JSON format (see :func:`LogIndex.build`).
+
+        :param path: path to the log file.
+        :type path: str
+
+        :ivar path: Path to the log file.
+        :ivar size: Number of bytes indexed.
+        :ivar lines: Number of lines indexed.
+        :ivar markers: Lines (starting from zero) with errors or warnings.
+        '''
+        super(LogIndex, self).__init__()
+
+        self.path    = path
+        self.size    = 0
+        self.lines   = 0
+        self.markers = array.array('L')
+
+        self._ino      = None
+        self._offsets  = array.array('L')
+        self._trigrams = {}
+
+    @classmethod
+    def build( cls, path ):
+        '''
+        Load the index of a log file, updating it if the file has changed,
+        and save it.
+
+        :param path: path to the log file.
+        :type path: str
+        :returns: index of the file.
+        :rtype: LogIndex
+        '''
+        ipath = cls.index_path(path)
+
+        idx = None
+        if os.path.exists(ipath):
+            try:
+                idx = cls._load(path, ipath)
+            except Exception:
+                # Corrupted or from another version, it is rebuilt
+                pass
+
+        if idx is None:
+            idx = cls(path)
+
+        if idx.update():
+            idx.save()
+
+        return idx
+
+    @staticmethod
+    def index_path( path ):
+        '''
+        Return the path to the index of a log file.
+
+        :param path: path to the log file.
+        :type path: str
+        :returns: path to the index.
+        :rtype: str
+        '''
+        d, n = os.path.split(path)
+
+        return os.path.join(d, '.{}.idx'.format(n))
+
+    def _index_block( self, block, data ):
+        '''
+        Add the trigrams of a block to the index.
+
+        :param block: block ID.
+        :type block: int
+        :param data: lower-cased content of the block.
+        :type data: bytes
+        '''
+        # Building the trigrams as tuples of integers is much faster
+        for g in map(bytes, set(zip(data, data[1:], data[2:]))):
+
+            b = self._trigrams.get(g)
+
+            if b is None:
+                self._trigrams[g] = array.array('L', [block])
+            elif b[-1] != block:
+                b.append(block)
+
+    @classmethod
+    def _load( cls, path, ipath ):
+        '''
+        Load the index of a log file from the file where it is stored.
+
+        :param path: path to the log file.
+        :type path: str
+        :param ipath: path to the index.
+        :type ipath: str
+        :returns: index of the file.
+        :rtype: LogIndex
+        :raises ValueError: if the content of the file is not valid.
+        '''
+        with open(ipath, 'rt') as f:
+            data = json.load(f)
+
+        if not isinstance(data, dict) or data.get('version') != cls.__version__:
+            raise ValueError('Unknown format of the index "{}"'.format(ipath))
+
+        idx = cls(path)
+
+        idx.size  = int(data['size'])
+        idx.lines = int(data['lines'])
+        idx._ino  = int(data['ino']) if data['ino'] is not None else None
+
+        idx.markers  = array.array('L', data['markers'])
+        idx._offsets = array.array('L', data['offsets'])
+
+        for g, b in data['trigrams'].items():
+
+            g = binascii.unhexlify(g.encode())
+
+            if len(g) != 3:
+                raise ValueError('Invalid trigram in the index "{}"'.format(ipath))
+
+            idx._trigrams[g] = array.array('L', b)
+
+        return idx
+
+    def _lines( self, mm, block ):
+        '''
+        Return the lines in a block.
+
+        :param mm: content of the log file.
+        :type mm: mmap.mmap
+        :param block: block ID.
+        :type block: int
+        :returns: lines of the block.
+        :rtype: list(bytes)
+        '''
+        start = self._offsets[block]
+
+        if block + 1 < len(self._offsets):
+            end = self._offsets[block + 1]
+        else:
+            end = self.size
+
+        return mm[start:end].split(b'\n')[:-1]
+
+    def save( self ):
+        '''
+        Store the index next to the log file, replacing it atomically.
+        '''
+        ipath = self.index_path(self.path)
+
+        # Trigrams are arbitrary bytes, so they are stored in hexadecimal
+        data = {
+            'version': self.__version__,
+            'size': self.size,
+            'lines': self.lines,
+            'ino': self._ino,
+            'markers': self.markers.tolist(),
+            'offsets': self._offsets.tolist(),
+            'trigrams': {binascii.hexlify(g).decode(): b.tolist() for g, b in self._trigrams.items()},
+        }
+
+        tmp = '{}.{}.tmp'.format(ipath, os.getpid())
+
+        with open(tmp, 'wt') as f:
+            json.dump(data, f)
+
+        os.rename(tmp, ipath)
+
+    def search( self, pattern = None, markers_only = False ):
+        '''
+        Search for the lines matching a regular expression.
+
+        :param pattern: regular expression (using :func:`re.search`). If \
+        None, all the lines are considered to match.
+        :type pattern: str or None
+        :param markers_only: whether to consider only the lines with errors \
+        or warnings.
+        :type markers_only: bool
+        :returns: line numbers (starting from zero) and matching lines.
+        :rtype: list(tuple(int, str))
+        '''
+        if self.size == 0:
+            return []
+
+        match = re.compile(pattern).search if pattern is not None else None
+
+        literals = _literals(pattern) if pattern is not None else None
+
+        if literals:
+
+            blocks = None
+            for l in literals:
+
+                # Lower-cased like the indexed data, as bytes
+                l = l.encode('utf-8').lower()
+
+                for i in range(len(l) - 2):
+
+                    b = set(self._trigrams.get(l[i:i + 3], ()))
+
+                    blocks = b if blocks is None else blocks & b
+
+            blocks = sorted(blocks)
+        else:
+            blocks = range(len(self._offsets))
+
+        if markers_only:
+            marked = set(m // self.__block_size__ for m in self.markers)
+            blocks = [b for b in blocks if b in marked]
+            markers = set(self.markers)
+
+        out = []
+
+        with open(self.path, 'rb') as f:
+
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            try:
+                for b in blocks:
+                    for i, l in enumerate(self._lines(mm, b)):
+
+                        n = b * self.__block_size__ + i
+
+                        if markers_only and n not in markers:
+                            continue
+
+                        l = _decode(l)
+
+                        if match is None or match(l):
+                            out.append((n, l))
+            finally:
+                mm.close()
+
+        return out
+
+    def update( self ):
+        '''
+        Index the lines appended to the log file since the last update.
+        Only complete lines are indexed. If the file has been replaced or
+        truncated, it is indexed again.
+
+        :returns: whether the index has changed.
+        :rtype: bool
+        '''
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+
+        if st.st_ino != self._ino or st.st_size < self.size:
+            self.__init__(self.path)
+            self._ino = st.st_ino
+
+        if st.st_size == self.size:
+            return False
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.size)
+            data = f.read(st.st_size - self.size)
+
+        end = data.rfind(b'\n') + 1
+
+        if end == 0:
+            return False
+
+        marker = re.compile(__marker_regex__).search
+
+        bs = self.__block_size__
+
+        lines = data[:end].split(b'\n')[:-1]
+
+        offset = self.size
+        i = 0
+        while i < len(lines):
+
+            block = self.lines // bs
+
+            if self.lines % bs == 0:
+                self._offsets.append(offset)
+
+            chunk = lines[i:i + bs - self.lines % bs]
+
+            for j, l in enumerate(chunk):
+                if marker(l):
+                    self.markers.append(self.lines + j)
+
+            data = b'\n'.join(chunk) + b'\n'
+
+            self._index_block(block, data.lower())
+
+            offset     += len(data)
+            self.lines += len(chunk)
+            i          += len(chunk)
+
+        self.size = offset
+
+        return True
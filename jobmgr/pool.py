@@ -0,0 +1,327 @@
+'''
+Pool of persistent worker processes to run Python callables.
+'''
+
+__author__  = ['Miguel Ramos Pernas']
+__email__   = ['miguel.ramos.pernas@cern.ch']
+
+# Python
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import traceback
+
+__all__ = ['WorkerPool']
+
+# Pool used by default by the jobs running Python callables
+__default_pool__ = None
+__default_lock__ = threading.Lock()
+
+
+def _run_task( func, args, kwargs, cwd, logdir = None ):
+    '''
+    Run a callable in the given directory, redirecting the standard output
+    and error to the "stdout" and "stderr" files inside it (or inside
+    "logdir", if provided).
+
+    :param func: callable to run.
+    :type func: function
+    :param args: positional arguments to the callable.
+    :type args: tuple
+    :param kwargs: keyword arguments to the callable.
+    :type kwargs: dict
+    :param cwd: working directory.
+    :type cwd: str
+    :param logdir: directory for the "stdout" and "stderr" files.
+    :type logdir: str or None
+    :returns: exit code (0 on success, 1 if an exception is raised, or the \
+    code passed to :func:`sys.exit`).
+    :rtype: int
+    '''
+    prev = os.getcwd()
+
+    logdir = logdir if logdir is not None else cwd
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    saved = (os.dup(1), os.dup(2))
+
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+
+    for fd, name in ((1, 'stdout'), (2, 'stderr')):
+        f = os.open(os.path.join(logdir, name), flags, 0o644)
+        os.dup2(f, fd)
+        os.close(f)
+
+    try:
+        os.chdir(cwd)
+        func(*args, **kwargs)
+        code = 0
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            sys.stderr.write('{}\n'.format(e.code))
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        for fd, s in zip((1, 2), saved):
+            os.dup2(s, fd)
+            os.close(s)
+
+        os.chdir(prev)
+
+    return code
+
+
+def _worker( conn ):
+    '''
+    Main function of the worker processes.
+    It receives tasks from the given connection and sends back their exit
+    codes, till the connection is closed.
+
+    :param conn: connection to the pool.
+    :type conn: multiprocessing.Connection
+    '''
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+
+        if task is None:
+            break
+
+        conn.send(_run_task(*task))
+
+
+class PoolTask(object):
+
+    def __init__( self, pool, worker ):
+        '''
+        Task running in a worker process of a :class:`WorkerPool`.
+        It provides the same interface as :class:`subprocess.Popen`
+        regarding the status of the process.
+
+        :param pool: pool owning the worker.
+        :type pool: WorkerPool
+        :param worker: worker process and connection.
+        :type worker: tuple(multiprocessing.Process, multiprocessing.Connection)
+
+        :ivar pid: ID of the worker process.
+        :ivar returncode: exit code of the task, None if it is running.
+        '''
+        super(PoolTask, self).__init__()
+
+        self.pid        = worker[0].pid
+        self.returncode = None
+
+        self._pool   = pool
+        self._worker = worker
+
+    def kill( self ):
+        '''
+        Kill the task, terminating the worker process.
+        '''
+        if self.returncode is None:
+
+            self._pool._discard(self._worker)
+
+            self.returncode = -signal.SIGKILL
+
+    def poll( self ):
+        '''
+        Check whether the task has finished.
+
+        :returns: exit code of the task, None if it is running.
+        :rtype: int or None
+        '''
+        if self.returncode is None and self._worker[1].poll():
+            try:
+                self.returncode = self._worker[1].recv()
+                self._pool._release(self._worker)
+            except EOFError:
+                # The worker died
+                self._pool._discard(self._worker)
+                self.returncode = self._worker[0].exitcode
+
+        return self.returncode
+
+    def wait( self ):
+        '''
+        Wait till the task finishes.
+
+        :returns: exit code of the task.
+        :rtype: int
+        '''
+        while self.poll() is None:
+            self._worker[1].poll(None)
+
+        return self.returncode
+
+
+class WorkerPool(object):
+
+    def __init__( self, processes = None, context = 'forkserver' ):
+        '''
+        Pool of persistent worker processes to run Python callables,
+        avoiding the start-up time of the interpreter on each task.
+        Workers are created on demand, up to the given number of processes.
+        Killing a task terminates its worker, which is replaced when needed.
+        Callables and arguments must be picklable.
+
+        :param processes: maximum number of worker processes. By default, \
+        the number of CPUs.
+        :type processes: int or None
+        :param context: start method of the worker processes. If it is not \
+        available, the default method is used.
+        :type context: str
+
+        :ivar processes: Maximum number of worker processes.
+        '''
+        super(WorkerPool, self).__init__()
+
+        self.processes = processes if processes is not None else multiprocessing.cpu_count()
+
+        try:
+            self._ctx = multiprocessing.get_context(context)
+        except (AttributeError, ValueError):
+            self._ctx = multiprocessing
+
+        self._cond    = threading.Condition()
+        self._idle    = []
+        self._workers = []
+
+    def __del__( self ):
+        '''
+        Terminate the worker processes.
+        '''
+        self.close()
+
+    def _discard( self, worker ):
+        '''
+        Terminate a worker and remove it from the pool.
+
+        :param worker: worker process and connection.
+        :type worker: tuple(multiprocessing.Process, multiprocessing.Connection)
+        '''
+        proc, conn = worker
+
+        if proc.is_alive():
+            os.kill(proc.pid, signal.SIGKILL)
+
+        proc.join()
+        conn.close()
+
+        with self._cond:
+            if worker in self._workers:
+                self._workers.remove(worker)
+            if worker in self._idle:
+                self._idle.remove(worker)
+            self._cond.notify()
+
+    def _release( self, worker ):
+        '''
+        Mark a worker as idle.
+
+        :param worker: worker process and connection.
+        :type worker: tuple(multiprocessing.Process, multiprocessing.Connection)
+        '''
+        with self._cond:
+            self._idle.append(worker)
+            self._cond.notify()
+
+    def close( self ):
+        '''
+        Terminate all the worker processes.
+        Running tasks are killed.
+        '''
+        with self._cond:
+            workers = list(self._workers)
+
+        for w in workers:
+            self._discard(w)
+
+    def submit( self, func, args, kwargs, cwd, block = True, logdir = None ):
+        '''
+        Run a callable in a worker process, waiting for one to be free
+        if all of them are busy (unless "block" is False).
+        The standard output and error are sent to the "stdout" and "stderr"
+        files in the working directory, or in "logdir" if provided.
+
+        :param func: callable to run.
+        :type func: function
+        :param args: positional arguments to the callable.
+        :type args: tuple
+        :param kwargs: keyword arguments to the callable.
+        :type kwargs: dict
+        :param cwd: working directory.
+        :type cwd: str
+        :param block: whether to wait for a worker to be free.
+        :type block: bool
+        :param logdir: directory for the "stdout" and "stderr" files.
+        :type logdir: str or None
+        :returns: running task, or None if "block" is False and all the \
+        workers are busy.
+        :rtype: PoolTask or None
+        '''
+        cwd    = os.path.abspath(cwd)
+        logdir = os.path.abspath(logdir) if logdir is not None else None
+
+        with self._cond:
+
+            while not self._idle and len(self._workers) >= self.processes:
+                if not block:
+                    return None
+                self._cond.wait()
+
+            if self._idle:
+                worker = self._idle.pop()
+            else:
+                conn, child = self._ctx.Pipe()
+
+                proc = self._ctx.Process(target=_worker, args=(child,))
+                proc.daemon = True
+                proc.start()
+
+                child.close()
+
+                worker = (proc, conn)
+
+                self._workers.append(worker)
+
+        try:
+            worker[1].send((func, args, kwargs, cwd, logdir))
+        except Exception:
+            # The task could not be sent (e.g. it is not picklable)
+            self._release(worker)
+            raise
+
+        return PoolTask(self, worker)
+
+
+def default_pool():
+    '''
+    Return the pool used by default by the jobs running Python callables,
+    creating it if needed.
+
+    :returns: default pool.
+    :rtype: WorkerPool
+    '''
+    global __default_pool__
+
+    with __default_lock__:
+        if __default_pool__ is None:
+            __default_pool__ = WorkerPool()
+
+    return __default_pool__
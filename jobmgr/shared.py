@@ -0,0 +1,482 @@
+'''
+Queue shared among the processes managing jobs in the same host.
+'''
+
+__author__  = ['Miguel Ramos Pernas']
+__email__   = ['miguel.ramos.pernas@cern.ch']
+
+# Python
+import contextlib
+import errno
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Local
+from . import spawn, utils
+from .core import StatusCode
+from .jobs import Job
+
+__all__ = ['SharedQueue']
+
+# Tables of the database: the managers, with the number of jobs they run;
+# the published jobs, with the manager owning them, the manager running them
+# and their absolute output directories and environments; and the settings of
+# the queue
+__schema__ = (
+    'CREATE TABLE IF NOT EXISTS managers (id TEXT PRIMARY KEY, pid INTEGER, heartbeat REAL, running INTEGER)',
+    'CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, owner TEXT, runner TEXT, command TEXT, cwd TEXT, env TEXT, priority REAL, state TEXT, cancel INTEGER DEFAULT 0, exit_code INTEGER, start_time REAL, end_time REAL)',
+    'CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value REAL)',
+    )
+
+# Time to wait for the database to be unlocked by other processes
+__db_timeout__ = 60.
+
+
+def _alive( pid ):
+    '''
+    Return whether a process of the host exists.
+
+    :param pid: process ID.
+    :type pid: int
+    :returns: whether the process exists.
+    :rtype: bool
+    '''
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+
+    return True
+
+
+class SharedQueue(object):
+
+    def __init__( self, path, slots = None, lease = 30. ):
+        '''
+        Queue shared among the managers of the jobs (processes with a
+        :class:`Scheduler`) in the same host, through a SQLite database.
+        It limits the number of jobs running at the same time in all the
+        managers, and lets idle managers run (steal) the queued jobs of
+        busy managers.
+        Each scheduler using the queue asks for a slot before starting a
+        job, and publishes its queued jobs in the database. A manager
+        without queued jobs and with free slots takes the queued jobs of
+        other managers, running their processes in their output
+        directories and with the environments of their managers. The manager owning the job sees it running and gets
+        its result, so it can be waited for, killed or used as a
+        dependency like any other job.
+        Only jobs of the class :class:`Job` without retries, speculative
+        copies, log indices, scratch area nor timeout are published; the
+        rest still need a slot, but they are always run by their manager.
+        Managers which exit or do not update their state for longer than
+        the lease are removed, together with their queued jobs. The jobs
+        they had taken from other managers are reported as failed.
+
+        :param path: path to the database.
+        :type path: str
+        :param slots: maximum number of jobs running at the same time in \
+        all the managers. If None, the value already stored in the \
+        database is used or, if there is none, the number of CPUs.
+        :type slots: int or None
+        :param lease: time (in seconds) after which managers which have not \
+        updated their state are removed.
+        :type lease: float
+
+        :ivar path: Path to the database.
+        :ivar lease: Time after which managers which have not updated their \
+        state are removed.
+        :ivar manager: Identifier of this manager.
+        '''
+        super(SharedQueue, self).__init__()
+
+        self.path    = path
+        self.lease   = lease
+        self.manager = uuid.uuid4().hex
+
+        self._lock = threading.RLock()
+
+        self._conn = sqlite3.connect(path, timeout=__db_timeout__, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+
+        # Published jobs, with the identifiers of their rows, and processes of
+        # the jobs taken from other managers
+        self._published = {}
+        self._rows      = {}
+        self._stolen    = {}
+
+        # Last heartbeat and number of running jobs written in the database
+        self._heartbeat = time.time()
+        self._running   = 0
+
+        with self._transaction() as c:
+
+            for s in __schema__:
+                c.execute(s)
+
+            if slots is not None:
+                c.execute('INSERT OR REPLACE INTO settings VALUES (?, ?)', ('slots', slots))
+            else:
+                c.execute('INSERT OR IGNORE INTO settings VALUES (?, ?)', ('slots', multiprocessing.cpu_count()))
+
+            c.execute('INSERT INTO managers VALUES (?, ?, ?, 0)', (self.manager, os.getpid(), self._heartbeat))
+
+    def __del__( self ):
+        '''
+        Remove this manager from the queue.
+        '''
+        self.close()
+
+    def _free( self, c, running ):
+        '''
+        Return the number of free slots.
+
+        :param c: cursor of the current transaction.
+        :type c: sqlite3.Cursor
+        :param running: number of jobs run by this manager.
+        :type running: int
+        :returns: number of free slots.
+        :rtype: int
+        '''
+        slots = c.execute('SELECT value FROM settings WHERE key = ?', ('slots',)).fetchone()[0]
+
+        others = c.execute('SELECT COALESCE(SUM(running), 0) FROM managers WHERE id != ?', (self.manager,)).fetchone()[0]
+
+        return int(slots) - others - running
+
+    def _reap( self, c ):
+        '''
+        Remove the managers which do not exist anymore or which have not
+        updated their state for longer than the lease.
+
+        :param c: cursor of the current transaction.
+        :type c: sqlite3.Cursor
+        '''
+        now = time.time()
+
+        for m, pid, heartbeat in c.execute('SELECT id, pid, heartbeat FROM managers WHERE id != ?', (self.manager,)).fetchall():
+
+            if now - heartbeat < self.lease and _alive(pid):
+                continue
+
+            logging.getLogger(__name__).warning(
+                'Manager with process ID {} does not exist anymore; removing it from the queue'.format(pid))
+
+            c.execute('DELETE FROM managers WHERE id = ?', (m,))
+
+            # Nobody waits for its jobs
+            c.execute('DELETE FROM jobs WHERE owner = ?', (m,))
+
+            # The jobs it was running are reported as failed
+            c.execute('UPDATE jobs SET state = ?, exit_code = NULL, end_time = ? WHERE runner = ? AND state = ?', ('done', now, m, 'running'))
+
+    def _launch( self, rows ):
+        '''
+        Start the processes of the jobs taken from other managers, in their
+        output directories and with their environments.
+        This is done out of the transactions, so other managers are not
+        blocked meanwhile.
+
+        :param rows: identifiers, commands, output directories and \
+        environments of the jobs.
+        :type rows: list(tuple)
+        '''
+        failed = []
+        for row, command, cwd, env in rows:
+
+            try:
+                # Like in the jobs, the output directory is emptied first
+                if os.path.exists(cwd):
+                    utils.clear_dir(cwd)
+                else:
+                    os.makedirs(cwd)
+
+                self._stolen[row] = spawn.spawn(json.loads(command), cwd,
+                                                os.path.join(cwd, 'stdout'),
+                                                os.path.join(cwd, 'stderr'),
+                                                json.loads(env))
+            except OSError as e:
+
+                logging.getLogger(__name__).error(
+                    'Unable to run job taken from another manager: {}'.format(e))
+
+                failed.append(row)
+
+        if failed:
+            with self._transaction() as c:
+                for row in failed:
+                    c.execute('UPDATE jobs SET state = ?, end_time = ? WHERE id = ?', ('done', time.time(), row))
+
+    def _steal( self, c, n ):
+        '''
+        Take queued jobs of other managers, marking them as run by this
+        manager. Their processes must be started through
+        :func:`SharedQueue._launch` once the transaction finishes.
+
+        :param c: cursor of the current transaction.
+        :type c: sqlite3.Cursor
+        :param n: maximum number of jobs to take.
+        :type n: int
+        :returns: identifiers, commands, output directories and \
+        environments of the jobs.
+        :rtype: list(tuple)
+        '''
+        rows = c.execute('SELECT id, command, cwd, env FROM jobs WHERE state = ? AND owner != ? ORDER BY priority DESC, id LIMIT ?', ('pending', self.manager, n)).fetchall()
+
+        for r in rows:
+            c.execute('UPDATE jobs SET state = ?, runner = ?, start_time = ? WHERE id = ?', ('running', self.manager, time.time(), r[0]))
+
+        c.execute('UPDATE managers SET running = running + ? WHERE id = ?', (len(rows), self.manager))
+
+        return rows
+
+    @contextlib.contextmanager
+    def _transaction( self ):
+        '''
+        Run a transaction, holding the lock of the database.
+
+        :returns: cursor of the transaction.
+        :rtype: generator(sqlite3.Cursor)
+        '''
+        with self._lock:
+
+            c = self._conn.cursor()
+
+            c.execute('BEGIN IMMEDIATE')
+
+            try:
+                yield c
+            except:
+                c.execute('ROLLBACK')
+                raise
+            else:
+                c.execute('COMMIT')
+
+    def claim( self, job ):
+        '''
+        Take a slot to start a job.
+        This method is reserved to be used by the class :class:`Scheduler`.
+
+        :param job: job to start.
+        :type job: JobBase
+        :returns: whether the slot has been taken. If there are no free \
+        slots, None is returned. If the job has been taken by another \
+        manager, False is returned.
+        :rtype: bool or None
+        '''
+        with self._transaction() as c:
+
+            row = self._rows.get(id(job))
+
+            if row is not None:
+
+                state = c.execute('SELECT state FROM jobs WHERE id = ?', (row,)).fetchone()
+
+                if state is None or state[0] != 'pending':
+                    return False
+
+            running = c.execute('SELECT running FROM managers WHERE id = ?', (self.manager,)).fetchone()[0]
+
+            if self._free(c, running) <= 0:
+                return None
+
+            c.execute('UPDATE managers SET running = running + 1 WHERE id = ?', (self.manager,))
+
+            self._running = running + 1
+
+            if row is not None:
+
+                c.execute('DELETE FROM jobs WHERE id = ?', (row,))
+
+                del self._rows[id(job)]
+                del self._published[row]
+
+            return True
+
+    def close( self ):
+        '''
+        Remove this manager and its jobs from the queue, killing the
+        processes of the jobs taken from other managers.
+        The scheduler must not be used afterwards.
+        '''
+        if getattr(self, '_conn', None) is None:
+            return
+
+        with self._transaction() as c:
+
+            for row, proc in self._stolen.items():
+
+                proc.kill()
+                proc.wait()
+
+                c.execute('UPDATE jobs SET state = ?, end_time = ? WHERE id = ?', ('done', time.time(), row))
+
+            c.execute('DELETE FROM jobs WHERE owner = ?', (self.manager,))
+            c.execute('DELETE FROM managers WHERE id = ?', (self.manager,))
+
+        self._stolen.clear()
+
+        self._conn.close()
+        self._conn = None
+
+    def publish( self, job, priority = 0 ):
+        '''
+        Publish a queued job, so other managers can run it.
+        Jobs which can not be run by other managers are ignored.
+        This method is reserved to be used by the class :class:`Scheduler`.
+
+        :param job: queued job.
+        :type job: JobBase
+        :param priority: priority of the job.
+        :type priority: float
+        '''
+        if type(job) is not Job or job.retry is not None or job.speculation is not None or \
+           job.index_logs or job.scratch is not None or job.timeout is not None:
+            return
+
+        with self._transaction() as c:
+
+            # Other managers might run in other directories and environments
+            c.execute('INSERT INTO jobs (owner, command, cwd, env, priority, state) VALUES (?, ?, ?, ?, ?, ?)',
+                      (self.manager, json.dumps(list(job.command)), os.path.abspath(job._odir), json.dumps(dict(os.environ)), priority, 'pending'))
+
+            self._published[c.lastrowid] = job
+            self._rows[id(job)] = c.lastrowid
+
+    def update( self, running, pending ):
+        '''
+        Update the state of this manager: check the processes of the jobs
+        taken from other managers, follow the jobs taken by other managers
+        and, if there are no queued jobs and there are free slots, take jobs
+        from other managers.
+        The database is only written if something has changed, if jobs can
+        be taken or if the heartbeat of this manager must be renewed (every
+        third of the lease), so idle managers do not compete for it.
+        This method is reserved to be used by the class :class:`Scheduler`.
+
+        :param running: number of jobs started by the scheduler which are \
+        running.
+        :type running: int
+        :param pending: number of queued jobs of the scheduler.
+        :type pending: int
+        :returns: maximum number of jobs the scheduler can run.
+        :rtype: int
+        '''
+        with self._lock:
+
+            c = self._conn.cursor()
+
+            # Changes to write in the database
+            writes   = []
+            finished = []
+
+            # Processes of the jobs taken from other managers
+            for row, proc in list(self._stolen.items()):
+
+                code = proc.poll()
+
+                if code is None:
+
+                    cancel = c.execute('SELECT cancel FROM jobs WHERE id = ?', (row,)).fetchone()
+
+                    if cancel is None or cancel[0]:
+                        # Killed by its manager, or the manager does not exist
+                        proc.kill()
+                        code = proc.wait()
+                    else:
+                        continue
+
+                writes.append(('UPDATE jobs SET state = ?, exit_code = ?, end_time = ? WHERE id = ?', ('done', code, time.time(), row)))
+
+                del self._stolen[row]
+
+            # Jobs of this manager taken by other managers
+            if self._published:
+                rows = {r[0]: r[1:] for r in c.execute('SELECT id, state, cancel, exit_code, start_time, end_time FROM jobs WHERE owner = ?', (self.manager,))}
+            else:
+                rows = {}
+
+            for row, job in list(self._published.items()):
+
+                state, cancel, code, start, end = rows.get(row, ('done', 0, None, None, time.time()))
+
+                if state == 'pending':
+
+                    if job.status() == StatusCode.queued:
+                        continue
+
+                    # Killed while queued
+                    writes.append(('DELETE FROM jobs WHERE id = ?', (row,)))
+
+                elif state == 'running':
+
+                    if job.status() == StatusCode.queued:
+                        if job._start_remote():
+                            continue
+                    elif job.status() == StatusCode.running and not job._kill_event.is_set():
+                        continue
+
+                    if not cancel:
+                        writes.append(('UPDATE jobs SET cancel = 1 WHERE id = ?', (row,)))
+
+                    continue
+
+                else:
+                    writes.append(('DELETE FROM jobs WHERE id = ?', (row,)))
+
+                    finished.append((job, code, start, end))
+
+                del self._rows[id(job)]
+                del self._published[row]
+
+            running += len(self._stolen)
+
+            now = time.time()
+
+            heartbeat = now - self._heartbeat >= self.lease / 3.
+
+            free = self._free(c, running)
+
+            steal = pending == 0 and free > 0 and c.execute(
+                'SELECT 1 FROM jobs WHERE state = ? AND owner != ? LIMIT 1', ('pending', self.manager)).fetchone() is not None
+
+            stolen = []
+
+            if writes or heartbeat or steal or running != self._running:
+
+                with self._transaction() as c:
+
+                    for w in writes:
+                        c.execute(*w)
+
+                    if heartbeat:
+                        self._reap(c)
+                        self._heartbeat = now
+
+                    c.execute('UPDATE managers SET heartbeat = ?, running = ? WHERE id = ?', (self._heartbeat, running, self.manager))
+
+                    if steal:
+                        # Other managers might have taken the slots meanwhile
+                        free = self._free(c, running)
+
+                        if free > 0:
+                            stolen = self._steal(c, free)
+
+                    self._running = running + len(stolen)
+
+                    # The jobs started by the scheduler are not counted
+                    limit = self._free(c, len(self._stolen) + len(stolen))
+            else:
+                limit = free + running - len(self._stolen)
+
+            self._launch(stolen)
+
+        for job, code, start, end in finished:
+            job._finish_remote(code, start, end)
+
+        return max(limit, 0)
@@ -0,0 +1,426 @@
+'''
+Simulation of the execution of jobs on a virtual clock, to plan the
+capacity needed by large sets of jobs.
+'''
+
+__author__  = ['Miguel Ramos Pernas']
+__email__   = ['miguel.ramos.pernas@cern.ch']
+
+# Python
+import collections
+import heapq
+import itertools
+import json
+import os
+
+# Local
+from .core import Scheduler, StatusCode, compare_and_set
+
+__all__ = ['SimulatedJob', 'Simulator', 'Trace']
+
+# Result of a simulation
+SimulationReport = collections.namedtuple('SimulationReport', ['makespan', 'utilisation', 'mean_wait', 'max_wait', 'terminated', 'killed'])
+
+
+class Trace(list):
+
+    def __init__( self, entries = None ):
+        '''
+        Record of the jobs to simulate (see :class:`Simulator`).
+        Each entry is a dictionary with the following keys:
+
+        * name: name of the job (optional).
+        * submit: time when the job is submitted (in seconds).
+        * priority: priority of the job (optional, see :class:`Scheduler`).
+        * user: user submitting the job (optional).
+        * steps: list with the steps of the job, which run one after the \
+        other. Each step is a dictionary with its name and a list of \
+        attempts, each of them made of its duration and its exit code. \
+        If a step is retried more times than attempts are recorded, the \
+        last attempt is repeated.
+
+        :param entries: entries of the trace.
+        :type entries: iterable(dict) or None
+        '''
+        super(Trace, self).__init__(entries if entries is not None else ())
+
+    @classmethod
+    def from_registry( cls, registry ):
+        '''
+        Build a trace from the jobs of a registry which have been run.
+        The time when the jobs are submitted is approximated by the time
+        when their first process started. The durations of the failed
+        attempts are not stored by the jobs, so they are taken from the
+        last attempt.
+
+        :param registry: registry with the jobs.
+        :type registry: JobRegistry
+        :returns: trace of the jobs.
+        :rtype: Trace
+        '''
+        entries = []
+        for j in registry:
+
+            steps = []
+            for s in getattr(j, 'steps', (j,)):
+
+                start, end = getattr(s, 'start_time', None), getattr(s, 'end_time', None)
+
+                if start is None or end is None or not s.attempts:
+                    continue
+
+                name = getattr(s, 'name', os.path.basename(s.command[0]))
+
+                code = s.exit_code if s.exit_code is not None else 1
+
+                attempts = [[end - start, 1]] * (s.attempts - 1) + [[end - start, code]]
+
+                steps.append({'name': name, 'start': start, 'attempts': attempts})
+
+            if steps:
+                entries.append({'name': j.full_jid(), 'submit': min(s.pop('start') for s in steps), 'steps': steps})
+
+        # Times are relative to the first submission
+        if entries:
+
+            origin = min(e['submit'] for e in entries)
+
+            for e in entries:
+                e['submit'] -= origin
+
+        return cls(sorted(entries, key=lambda e: e['submit']))
+
+    @classmethod
+    def load( cls, path ):
+        '''
+        Load a trace from a file.
+
+        :param path: path to the file.
+        :type path: str
+        :returns: loaded trace.
+        :rtype: Trace
+        '''
+        with open(path, 'rt') as f:
+            return cls(json.load(f))
+
+    def save( self, path ):
+        '''
+        Save the trace in a file.
+
+        :param path: path to the file.
+        :type path: str
+        '''
+        with open(path, 'wt') as f:
+            json.dump(list(self), f)
+
+
+class SimulatedJob(object):
+
+    def __init__( self, jid, entry ):
+        '''
+        Job whose execution is simulated from an entry of a :class:`Trace`.
+        It provides the interface of the jobs needed by the
+        :class:`Scheduler`.
+
+        :param jid: job ID.
+        :type jid: int
+        :param entry: entry of the trace.
+        :type entry: dict
+        :raises ValueError: if the entry has no steps, or if a step has no \
+        attempts.
+
+        :ivar jid: Job ID.
+        :ivar name: Name of the job.
+        :ivar command: Command of the job, which is just its name.
+        :ivar priority: Priority of the job.
+        :ivar user: User submitting the job.
+        :ivar submit_time: Time when the job is submitted.
+        :ivar attempts: Number of attempts made to run the current step.
+        :ivar exit_code: Exit code of the last step.
+        :ivar start_time: Time when the job was started.
+        :ivar end_time: Time when the job finished.
+        '''
+        super(SimulatedJob, self).__init__()
+
+        self.jid      = jid
+        self.name     = entry.get('name', str(jid))
+        self.command  = [self.name]
+        self.priority = entry.get('priority', 0)
+        self.user     = entry.get('user', None)
+
+        self.submit_time = float(entry.get('submit', 0.))
+
+        self.attempts   = 0
+        self.exit_code  = None
+        self.start_time = None
+        self.end_time   = None
+
+        self._status = StatusCode.new
+
+        self._steps = [[tuple(a) for a in s.get('attempts', ())] for s in entry.get('steps', ())]
+        self._step  = 0
+
+        if not self._steps:
+            raise ValueError('Job "{}" of the trace has no steps'.format(self.name))
+
+        if not all(self._steps):
+            raise ValueError('Job "{}" of the trace has steps without attempts'.format(self.name))
+
+        # Identifies the events of the current execution, so those of
+        # killed executions are ignored
+        self._token = 0
+
+        self._simulator = None
+
+    def _runtime_key( self ):
+        '''
+        Return the key used to gather the runtime statistics of this job,
+        which is its name.
+
+        :returns: key of the job.
+        :rtype: str
+        '''
+        return self.name
+
+    def full_jid( self ):
+        '''
+        Return the full job ID for this job.
+
+        :returns: job ID.
+        :rtype: str
+        '''
+        return str(self.jid)
+
+    def kill( self ):
+        '''
+        Kill the job. Its pending events are ignored.
+        '''
+        if not compare_and_set(self, (StatusCode.queued, StatusCode.running), StatusCode.killed):
+            return
+
+        self._token += 1
+
+        if self.start_time is not None:
+            self.end_time = self._simulator.now
+            self._simulator._running -= 1
+
+    def start( self ):
+        '''
+        Start the job at the current time of the simulation.
+        '''
+        self._status = StatusCode.running
+
+        self.start_time = self._simulator.now
+        self.end_time   = None
+        self.exit_code  = None
+        self.attempts   = 0
+
+        self._step   = 0
+        self._token += 1
+
+        self._simulator._running += 1
+        self._simulator._peak = max(self._simulator._peak, self._simulator._running)
+
+        self._simulator._launch(self)
+
+    def status( self ):
+        '''
+        Return the status of this job.
+
+        :returns: status of this job.
+        :rtype: str
+        '''
+        return self._status
+
+    def update_status( self ):
+        '''
+        The status is set by the simulator.
+        '''
+        pass
+
+    def wait( self ):
+        '''
+        Jobs do not need to be waited for.
+        '''
+        pass
+
+
+class Simulator(object):
+
+    def __init__( self, scheduler = None, retry = None ):
+        '''
+        Simulate the execution of the jobs of a :class:`Trace` on a virtual
+        clock, without running any process.
+        The jobs are started by the given :class:`Scheduler` and retried
+        following the given :class:`RetryPolicy`, the same objects used to
+        run real jobs. Hence different limits, priorities and retry
+        policies can be evaluated before running the jobs.
+        While the simulation runs, the clock of the scheduler is replaced
+        by the virtual clock. The scheduler must not be used by other jobs
+        in the meantime. Schedulers with an admission controller or a
+        shared queue can not be simulated, since they depend on the real
+        load of the machine.
+
+        :param scheduler: scheduler to start the jobs. By default, a \
+        scheduler without limit on the number of running jobs is used.
+        :type scheduler: Scheduler or None
+        :param retry: policy to retry the steps if they fail.
+        :type retry: RetryPolicy or None
+
+        :ivar scheduler: Scheduler to start the jobs.
+        :ivar retry: Policy to retry the steps if they fail.
+        :ivar now: Current time of the simulation.
+        '''
+        super(Simulator, self).__init__()
+
+        self.scheduler = scheduler if scheduler is not None else Scheduler()
+        self.retry     = retry
+        self.now       = 0.
+
+        self._events  = []
+        self._counter = itertools.count()
+
+        # Number of running jobs and maximum number of them
+        self._running = 0
+        self._peak    = 0
+
+    def _finish( self, job ):
+        '''
+        Process the end of the current attempt of a job.
+
+        :param job: job whose attempt has finished.
+        :type job: SimulatedJob
+        '''
+        steps = job._steps[job._step]
+
+        _, code = steps[min(job.attempts, len(steps)) - 1]
+
+        job.exit_code = code
+
+        if code == 0:
+
+            job._step += 1
+
+            if job._step < len(job._steps):
+                job.attempts = 0
+                self._launch(job)
+                return
+
+            job._status = StatusCode.terminated
+
+        elif self.retry is not None and self.retry.should_retry(job.attempts, code):
+
+            # The job keeps its slot while waiting, like real jobs
+            self._push(self.now + self.retry.delay(job.attempts), 'retry', job)
+            return
+
+        else:
+            job._status = StatusCode.killed
+
+        job.end_time = self.now
+
+        self._running -= 1
+
+        self.scheduler.dispatch()
+
+    def _launch( self, job ):
+        '''
+        Start a new attempt of the current step of a job.
+
+        :param job: job to run.
+        :type job: SimulatedJob
+        '''
+        steps = job._steps[job._step]
+
+        job.attempts += 1
+
+        duration, _ = steps[min(job.attempts, len(steps)) - 1]
+
+        self._push(self.now + duration, 'end', job)
+
+    def _push( self, time, kind, job ):
+        '''
+        Add an event to the simulation.
+
+        :param time: time of the event.
+        :type time: float
+        :param kind: type of event ("submit", "end" or "retry").
+        :type kind: str
+        :param job: job associated to the event.
+        :type job: SimulatedJob
+        '''
+        heapq.heappush(self._events, (time, next(self._counter), kind, job, job._token))
+
+    def run( self, trace ):
+        '''
+        Simulate the execution of the jobs of a trace.
+
+        :param trace: trace of the jobs.
+        :type trace: Trace or list(dict)
+        :returns: report with the time since the first submission till the \
+        last job finishes ("makespan"), the fraction of the available slots \
+        used during that time ("utilisation"; the slots are the maximum \
+        number of running jobs of the scheduler or, if it is not limited, \
+        the maximum number of jobs running at the same time), the average \
+        and maximum time the jobs wait to be started ("mean_wait" and \
+        "max_wait"), and the number of jobs which terminated \
+        successfully ("terminated") and failed ("killed").
+        :rtype: SimulationReport
+        :raises ValueError: if the scheduler has an admission controller or \
+        a shared queue, or if an entry of the trace is not valid (see \
+        :class:`SimulatedJob`).
+        '''
+        if self.scheduler.admission is not None or self.scheduler.shared is not None:
+            raise ValueError('Unable to simulate schedulers with an admission controller or a shared queue')
+
+        jobs = [SimulatedJob(i, e) for i, e in enumerate(trace)]
+
+        for j in jobs:
+            j._simulator = self
+            self._push(j.submit_time, 'submit', j)
+
+        self.now = min(j.submit_time for j in jobs) if jobs else 0.
+
+        clock = self.scheduler.clock
+
+        self.scheduler.clock = lambda: self.now
+
+        self._running = self._peak = 0
+
+        try:
+            while self._events:
+
+                self.now, _, kind, job, token = heapq.heappop(self._events)
+
+                if kind == 'submit':
+
+                    self.scheduler.submit(job, job.priority, job.user)
+
+                elif token == job._token and job._status == StatusCode.running:
+
+                    if kind == 'end':
+                        self._finish(job)
+                    else:
+                        self._launch(job)
+        finally:
+            self.scheduler.clock = clock
+
+        started = [j for j in jobs if j.start_time is not None]
+
+        if not started:
+            return SimulationReport(0., 0., 0., 0., 0, 0)
+
+        makespan = max(j.end_time for j in started) - min(j.submit_time for j in jobs)
+
+        waits = [j.start_time - j.submit_time for j in started]
+
+        busy = sum(j.end_time - j.start_time for j in started)
+
+        slots = self.scheduler.max_running if self.scheduler.max_running is not None else self._peak
+
+        return SimulationReport(makespan,
+                                busy / (slots * makespan) if makespan > 0 else 0.,
+                                sum(waits) / len(waits),
+                                max(waits),
+                                sum(1 for j in jobs if j._status == StatusCode.terminated),
+                                sum(1 for j in jobs if j._status == StatusCode.killed))
@@ -0,0 +1,152 @@
+'''
+Functions and classes to launch the processes of the jobs.
+'''
+
+__author__  = ['Miguel Ramos Pernas']
+__email__   = ['miguel.ramos.pernas@cern.ch']
+
+# Python
+import os
+import signal
+import subprocess
+
+__all__ = []
+
+# Script to change the working directory before executing the command, since
+# "posix_spawn" does not allow to do it
+__chdir_script__ = 'cd "$0" && exec "$@"'
+
+
+class GroupPopen(subprocess.Popen):
+    '''
+    Process launched with :class:`subprocess.Popen` in its own process group.
+    Killing it also kills its children.
+    '''
+    def kill( self ):
+        '''
+        Kill the process group.
+        '''
+        if self.poll() is None:
+            try:
+                os.killpg(self.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+
+class SpawnedProcess(object):
+
+    def __init__( self, pid ):
+        '''
+        Process launched with :func:`os.posix_spawn`, in its own process
+        group. It provides the same interface as :class:`subprocess.Popen`
+        regarding the status of the process.
+
+        :param pid: ID of the process.
+        :type pid: int
+
+        :ivar pid: ID of the process.
+        :ivar returncode: exit code of the process, None if it is running. \
+        Negative values correspond to processes terminated by a signal.
+        '''
+        super(SpawnedProcess, self).__init__()
+
+        self.pid        = pid
+        self.returncode = None
+
+    def _set_status( self, status ):
+        '''
+        Set the return code from the status returned by :func:`os.waitpid`.
+
+        :param status: status of the process.
+        :type status: int
+        '''
+        if os.WIFSIGNALED(status):
+            self.returncode = -os.WTERMSIG(status)
+        else:
+            self.returncode = os.WEXITSTATUS(status)
+
+    def kill( self ):
+        '''
+        Kill the process group.
+        '''
+        if self.poll() is None:
+            try:
+                os.killpg(self.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def poll( self ):
+        '''
+        Check whether the process has finished.
+
+        :returns: exit code of the process, None if it is running.
+        :rtype: int or None
+        '''
+        if self.returncode is None:
+
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+
+            if pid != 0:
+                self._set_status(status)
+
+        return self.returncode
+
+    def wait( self ):
+        '''
+        Wait till the process finishes.
+
+        :returns: exit code of the process.
+        :rtype: int
+        '''
+        if self.returncode is None:
+
+            _, status = os.waitpid(self.pid, 0)
+
+            self._set_status(status)
+
+        return self.returncode
+
+
+def spawn( command, cwd, stdout, stderr, env = None ):
+    '''
+    Launch a command in its own process group, in the given directory.
+    If :func:`os.posix_spawn` is available, it is used to launch the
+    process, so the cost does not depend on the memory used by this
+    process and no Python code runs in the child. Otherwise
+    :class:`subprocess.Popen` is used.
+
+    :param command: command to execute.
+    :type command: list(str)
+    :param cwd: working directory.
+    :type cwd: str
+    :param stdout: path to the file to write the standard output.
+    :type stdout: str
+    :param stderr: path to the file to write the standard error.
+    :type stderr: str
+    :param env: environment of the process. By default, the environment \
+    of this process is used.
+    :type env: dict or None
+    :returns: launched process.
+    :rtype: SpawnedProcess or GroupPopen
+    '''
+    if hasattr(os, 'posix_spawn'):
+
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+
+        actions = [
+            (os.POSIX_SPAWN_OPEN, 1, os.path.abspath(stdout), flags, 0o644),
+            (os.POSIX_SPAWN_OPEN, 2, os.path.abspath(stderr), flags, 0o644),
+        ]
+
+        argv = ['/bin/sh', '-c', __chdir_script__, os.path.abspath(cwd)] + list(command)
+
+        pid = os.posix_spawn(argv[0], argv, env if env is not None else os.environ, file_actions=actions, setpgroup=0)
+
+        return SpawnedProcess(pid)
+
+    with open(stdout, 'wt') as out, open(stderr, 'wt') as err:
+        try:
+            return GroupPopen(command, cwd=cwd, env=env, stdout=out, stderr=err, start_new_session=True)
+        except TypeError:
+            # Python 2 does not support "start_new_session"
+            return GroupPopen(command, cwd=cwd, env=env, stdout=out, stderr=err, preexec_fn=os.setpgrp)
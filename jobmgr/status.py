@@ -0,0 +1,350 @@
+'''
+Shared table with the status of the jobs, to monitor them from other
+processes.
+'''
+
+__author__  = ['Miguel Ramos Pernas']
+__email__   = ['miguel.ramos.pernas@cern.ch']
+
+# Python
+import collections
+import math
+import mmap
+import os
+import struct
+import time
+
+__all__ = ['StatusReader', 'StatusTable']
+
+# Header of the table: magic string, version, size of the records, capacity
+# and number of records
+__header__ = struct.Struct('<4sHHII')
+
+__magic__   = b'JMST'
+__version__ = 1
+
+# Records: sequence number, status, process ID, exit code, job ID, start time
+# and end time
+__record__ = struct.Struct('<IB3xiiqdd')
+
+# Status codes, stored by their position in this tuple
+__states__ = ('new', 'queued', 'running', 'terminated', 'killed', 'timed out')
+
+# Maximum number of attempts to read a record being written
+__read_attempts__ = 1000
+
+# Exit code stored when the process has not finished
+__no_exit_code__ = -2**31
+
+# Status of a job, as read from the table
+StatusRecord = collections.namedtuple('StatusRecord', ['jid', 'pid', 'status', 'start_time', 'end_time', 'exit_code'])
+
+
+def _offset( jid ):
+    '''
+    Return the position of the record of a job in the table.
+
+    :param jid: job ID.
+    :type jid: int
+    :returns: offset (in bytes).
+    :rtype: int
+    '''
+    return __header__.size + jid * __record__.size
+
+
+def _size( capacity ):
+    '''
+    Return the size of a table.
+
+    :param capacity: number of records.
+    :type capacity: int
+    :returns: size (in bytes).
+    :rtype: int
+    '''
+    return _offset(capacity)
+
+
+class StatusTable(object):
+
+    def __init__( self, path, capacity = 1024 ):
+        '''
+        Table with fixed-width records holding the status of the jobs, in a
+        memory-mapped file which can be read from any process (see
+        :class:`StatusReader`).
+        Each record is protected by a sequence number (seqlock): it is odd
+        while the record is being written, and it is increased again once
+        the write finishes. Readers never block the writer; they just read
+        again the records modified in the meantime.
+        The table grows automatically when a job ID exceeds its capacity.
+        Only one process must write to the table. If a table already exists
+        in the given path it is replaced by a new file, so the readers
+        holding the old one are not affected.
+
+        :param path: path to the file.
+        :type path: str
+        :param capacity: initial number of records.
+        :type capacity: int
+
+        :ivar path: Path to the file.
+        :ivar capacity: Number of records which fit in the table.
+        '''
+        super(StatusTable, self).__init__()
+
+        self.path     = path
+        self.capacity = max(capacity, 1)
+
+        self._count = 0
+        self._last  = {}
+
+        # Build the table in a new file, so existing files are not truncated
+        # while readers have them mapped
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+
+        self._file = open(tmp, 'w+b')
+        self._file.truncate(_size(self.capacity))
+
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+
+        self._write_header()
+
+        os.rename(tmp, path)
+
+    def __del__( self ):
+        '''
+        Close the file.
+        '''
+        self.close()
+
+    def _grow( self, jid ):
+        '''
+        Increase the capacity of the table so it can hold the given job ID.
+
+        :param jid: job ID.
+        :type jid: int
+        '''
+        capacity = self.capacity
+        while jid >= capacity:
+            capacity *= 2
+
+        # Readers holding the old mapping can still read the first records
+        self._file.truncate(_size(capacity))
+
+        self._mm.close()
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+
+        self.capacity = capacity
+
+        self._write_header()
+
+    def _write_header( self ):
+        '''
+        Write the header of the table.
+        '''
+        self._mm[:__header__.size] = __header__.pack(__magic__, __version__, __record__.size, self.capacity, self._count)
+
+    def close( self ):
+        '''
+        Close the file. The file is not removed, so readers can still
+        access the last status of the jobs.
+        '''
+        if getattr(self, '_mm', None) is not None:
+            self._mm.close()
+            self._file.close()
+            self._mm = None
+
+    def publish( self, job ):
+        '''
+        Write the status of a job, if it has changed since the last time it
+        was published.
+
+        :param job: job to publish.
+        :type job: JobBase
+        :returns: whether the record has been written.
+        :rtype: bool
+        '''
+        values = (job.status(),
+                  getattr(job, 'pid', None),
+                  getattr(job, 'start_time', None),
+                  getattr(job, 'end_time', None),
+                  getattr(job, 'exit_code', None))
+
+        if self._last.get(job.jid) == values:
+            return False
+
+        self.write(job.jid, *values)
+
+        self._last[job.jid] = values
+
+        return True
+
+    def write( self, jid, status, pid = None, start_time = None, end_time = None, exit_code = None ):
+        '''
+        Write the record of a job.
+
+        :param jid: job ID.
+        :type jid: int
+        :param status: status of the job.
+        :type status: str
+        :param pid: ID of the process of the job.
+        :type pid: int or None
+        :param start_time: time when the process was started.
+        :type start_time: float or None
+        :param end_time: time when the process finished.
+        :type end_time: float or None
+        :param exit_code: exit code of the process.
+        :type exit_code: int or None
+        '''
+        if jid >= self.capacity:
+            self._grow(jid)
+
+        off = _offset(jid)
+
+        seq = struct.unpack_from('<I', self._mm, off)[0]
+
+        # Mark the record as being written
+        seq = (seq + 1) | 1
+        struct.pack_into('<I', self._mm, off, seq)
+
+        self._mm[off + 4:off + __record__.size] = __record__.pack(
+            seq,
+            __states__.index(status),
+            pid if pid is not None else 0,
+            exit_code if exit_code is not None else __no_exit_code__,
+            jid,
+            start_time if start_time is not None else float('nan'),
+            end_time if end_time is not None else float('nan'))[4:]
+
+        struct.pack_into('<I', self._mm, off, seq + 1)
+
+        if jid >= self._count:
+            self._count = jid + 1
+            self._write_header()
+
+
+class StatusReader(object):
+
+    def __init__( self, path ):
+        '''
+        Read the status of the jobs from a table written by a
+        :class:`StatusTable`, possibly in another process.
+        Reading does not involve any communication with the writer.
+
+        :param path: path to the file.
+        :type path: str
+        :raises ValueError: if the file is not a status table.
+
+        :ivar path: Path to the file.
+        '''
+        super(StatusReader, self).__init__()
+
+        self.path = path
+
+        self._file = open(path, 'rb')
+        self._mm   = None
+
+        self._map()
+
+        magic, version, size, _, _ = __header__.unpack_from(self._mm, 0)
+
+        if magic != __magic__ or version != __version__ or size != __record__.size:
+            self.close()
+            raise ValueError('File "{}" is not a valid status table'.format(path))
+
+    def __del__( self ):
+        '''
+        Close the file.
+        '''
+        self.close()
+
+    def __iter__( self ):
+        '''
+        Iterate over the records of the jobs which have been published.
+
+        :returns: records of the jobs.
+        :rtype: generator(StatusRecord)
+        '''
+        for jid in range(len(self)):
+
+            r = self.read(jid)
+
+            if r is not None:
+                yield r
+
+    def __len__( self ):
+        '''
+        Return the number of records in the table, including those of the
+        job IDs which have not been published.
+
+        :returns: number of records.
+        :rtype: int
+        '''
+        return __header__.unpack_from(self._mm, 0)[4]
+
+    def _map( self ):
+        '''
+        Map the file in memory, so it includes all the records.
+        '''
+        if self._mm is not None:
+            self._mm.close()
+
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close( self ):
+        '''
+        Close the file.
+        '''
+        if getattr(self, '_mm', None) is not None:
+            self._mm.close()
+            self._file.close()
+            self._mm = None
+
+    def read( self, jid ):
+        '''
+        Read the record of a job.
+        If the record is being written, it is read again till a consistent
+        copy is obtained. If this is not possible after many attempts (e.g.
+        because the writer died in the middle of a write), None is returned.
+
+        :param jid: job ID.
+        :type jid: int
+        :returns: record of the job, or None if it has not been published \
+        or it can not be read.
+        :rtype: StatusRecord or None
+        '''
+        off = _offset(jid)
+
+        if off + __record__.size > len(self._mm):
+            # The table has grown
+            self._map()
+            if off + __record__.size > len(self._mm):
+                return None
+
+        for i in range(__read_attempts__):
+
+            # The sequence number must be read before and after copying the
+            # record, since the copy is not done in order
+            seq = struct.unpack_from('<I', self._mm, off)[0]
+
+            if seq % 2 == 0:
+
+                data = self._mm[off:off + __record__.size]
+
+                if struct.unpack_from('<I', self._mm, off)[0] == seq:
+                    break
+
+            # Let the writer finish
+            time.sleep(0 if i < 100 else 1e-4)
+        else:
+            return None
+
+        _, state, pid, code, rjid, start, end = __record__.unpack(data)
+
+        if seq == 0:
+            return None
+
+        return StatusRecord(rjid,
+                            pid if pid != 0 else None,
+                            __states__[state],
+                            start if not math.isnan(start) else None,
+                            end if not math.isnan(end) else None,
+                            code if code != __no_exit_code__ else None)
@@ -0,0 +1,308 @@
+'''
+Functions and classes to react to the arrival of files.
+'''
+
+__author__  = ['Miguel Ramos Pernas']
+__email__   = ['miguel.ramos.pernas@cern.ch']
+
+# Python
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import glob
+import itertools
+import logging
+import os
+import select
+import struct
+import threading
+
+__all__ = ['FileWatcher']
+
+# Events of inotify: a file opened for writing has been closed, a file has
+# been moved into the directory and the queue of events has overflowed
+__in_close_write__ = 0x00000008
+__in_moved_to__    = 0x00000080
+__in_q_overflow__  = 0x00004000
+
+# Header of the inotify events: watch descriptor, mask, cookie and length of
+# the name
+__in_event__ = struct.Struct('iIII')
+
+# Size of the buffer to read the inotify events
+__in_buffer__ = 64 * 1024
+
+
+def _inotify():
+    '''
+    Return the C library if it provides inotify.
+
+    :returns: C library, or None if inotify is not available.
+    :rtype: ctypes.CDLL or None
+    '''
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        libc.inotify_rm_watch
+    except (OSError, AttributeError):
+        return None
+
+    return libc
+
+
+class FileWatcher(object):
+
+    def __init__( self, poll_interval = 1. ):
+        '''
+        Call functions when files matching a pattern appear.
+        Files are considered to appear once they are closed after being
+        written, or once they are moved into the directory, so incomplete
+        files are not reported. Files which already exist when they start
+        to be watched are reported too.
+        The directories are watched using inotify. If it is not available,
+        they are scanned periodically.
+        The callbacks are called from the thread of the watcher, so they
+        must not block.
+
+        :param poll_interval: time between scans of the directories if \
+        inotify is not available (in seconds).
+        :type poll_interval: float
+
+        :ivar poll_interval: Time between scans of the directories if \
+        inotify is not available.
+        '''
+        super(FileWatcher, self).__init__()
+
+        self.poll_interval = poll_interval
+
+        self._lock    = threading.Lock()
+        self._counter = itertools.count()
+
+        # Watched patterns, with the files already reported and the callbacks
+        self._watches = {}
+
+        # Watch descriptors of the directories, and the opposite
+        self._dirs = {}
+        self._wds  = {}
+
+        self._libc = _inotify()
+
+        if self._libc is not None:
+            self._fd = self._libc.inotify_init1(os.O_NONBLOCK | getattr(os, 'O_CLOEXEC', 0))
+            if self._fd < 0:
+                self._libc = None
+
+        # Pipe to wake up the thread of the watcher
+        self._wake_r, self._wake_w = os.pipe()
+
+        self._stop_event = threading.Event()
+        self._task       = threading.Thread(target=self._watch)
+        self._task.daemon = True
+        self._task.start()
+
+    def __del__( self ):
+        '''
+        Stop watching the files.
+        '''
+        self.stop()
+
+    def _add_dir( self, path ):
+        '''
+        Watch a directory through inotify, if it is not already watched.
+
+        :param path: path to the directory.
+        :type path: str
+        :raises OSError: if the directory can not be watched.
+        '''
+        if path in self._dirs:
+            return
+
+        wd = self._libc.inotify_add_watch(self._fd, path.encode(), __in_close_write__ | __in_moved_to__)
+
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), path)
+
+        self._dirs[path] = wd
+        self._wds[wd]    = path
+
+    def _notify( self, path, handles = None ):
+        '''
+        Call the functions of the patterns matching a file.
+
+        :param path: path to the file.
+        :type path: str
+        :param handles: watches to consider. By default, all of them.
+        :type handles: collection(int) or None
+        '''
+        calls = []
+        with self._lock:
+            for h, (pattern, seen, callback) in self._watches.items():
+
+                if handles is not None and h not in handles:
+                    continue
+
+                if path in seen or not fnmatch.fnmatch(path, pattern):
+                    continue
+
+                seen.add(path)
+
+                calls.append(callback)
+
+        for c in calls:
+            try:
+                c(path)
+            except Exception as e:
+                logging.getLogger(__name__).error(
+                    'Error processing the arrival of file "{}": {}'.format(path, e))
+
+    def _read_events( self ):
+        '''
+        Read the pending inotify events and notify the files.
+        '''
+        try:
+            data = os.read(self._fd, __in_buffer__)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+
+        off = 0
+        while off < len(data):
+
+            wd, mask, _, size = __in_event__.unpack_from(data, off)
+
+            off += __in_event__.size
+
+            name = data[off:off + size].rstrip(b'\0').decode()
+
+            off += size
+
+            if mask & __in_q_overflow__:
+                # Events have been lost
+                self._scan()
+                continue
+
+            with self._lock:
+                path = self._wds.get(wd)
+
+            if path is not None and name:
+                self._notify(os.path.join(path, name))
+
+    def _scan( self, handles = None ):
+        '''
+        Look for the files matching the patterns.
+
+        :param handles: watches to consider. By default, all of them.
+        :type handles: collection(int) or None
+        '''
+        with self._lock:
+            patterns = set(p for h, (p, _, _) in self._watches.items() if handles is None or h in handles)
+
+        for p in patterns:
+            for f in glob.glob(p):
+                self._notify(f, handles)
+
+    def _watch( self ):
+        '''
+        Main function of the thread of the watcher.
+        '''
+        while not self._stop_event.is_set():
+
+            if self._libc is None:
+                self._scan()
+                self._stop_event.wait(self.poll_interval)
+                continue
+
+            ready, _, _ = select.select([self._fd, self._wake_r], [], [])
+
+            if self._wake_r in ready:
+                os.read(self._wake_r, __in_buffer__)
+
+            if self._fd in ready:
+                self._read_events()
+
+    def add( self, pattern, callback ):
+        '''
+        Call a function for each file matching a pattern once it appears.
+        Only the file names can contain wildcards (see :mod:`fnmatch`); the
+        directory must exist.
+
+        :param pattern: pattern of the paths to the files.
+        :type pattern: str
+        :param callback: function to call, taking the path to the file.
+        :type callback: function
+        :returns: handle of the watch, to remove it through \
+        :func:`FileWatcher.remove`.
+        :rtype: int
+        :raises ValueError: if the directory contains wildcards.
+        :raises OSError: if the directory can not be watched.
+        '''
+        path = os.path.dirname(os.path.abspath(pattern))
+
+        if glob.has_magic(path):
+            raise ValueError('Only the file names can contain wildcards; found "{}"'.format(pattern))
+
+        pattern = os.path.join(path, os.path.basename(pattern))
+
+        with self._lock:
+
+            if self._libc is not None:
+                self._add_dir(path)
+
+            handle = next(self._counter)
+
+            self._watches[handle] = (pattern, set(), callback)
+
+        # The directory is watched before looking for the existing files, so
+        # no file is missed
+        self._scan((handle,))
+
+        return handle
+
+    def remove( self, handle ):
+        '''
+        Stop watching a pattern added with :func:`FileWatcher.add`.
+        Handles which have already been removed are ignored.
+
+        :param handle: handle of the watch.
+        :type handle: int
+        '''
+        with self._lock:
+
+            w = self._watches.pop(handle, None)
+
+            if w is None or self._libc is None:
+                return
+
+            path = os.path.dirname(w[0])
+
+            if not any(os.path.dirname(p) == path for p, _, _ in self._watches.values()):
+
+                wd = self._dirs.pop(path)
+
+                del self._wds[wd]
+
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+    def stop( self ):
+        '''
+        Stop watching the files, closing the inotify instance.
+        '''
+        if getattr(self, '_task', None) is None:
+            return
+
+        self._stop_event.set()
+
+        os.write(self._wake_w, b'\0')
+
+        self._task.join()
+        self._task = None
+
+        for fd in (self._wake_r, self._wake_w):
+            os.close(fd)
+
+        if self._libc is not None:
+            os.close(self._fd)
@@ -2,12 +2,64 @@
 Auxiliar functions.
 '''
 
+import concurrent.futures
+import fnmatch
+import hashlib
 import os
+import re
+import shutil
+import threading
+import uuid
+
+# For python2 and python3 compatibility
+try:
+    import Queue as queue
+except:
+    import queue
 
 __all__ = []
 
 __default_dir__ = 'output'
 
+# Name of the directory holding the trashed directories
+__trash_dir__ = '.trash'
+
+# Lock to create and trash directories
+__dir_lock__ = threading.Lock()
+
+# Queue with the trashed directories to delete and thread deleting them
+__trash_queue__  = queue.Queue()
+__trash_thread__ = None
+
+# Maximum number of threads moving files out of the scratch directories, and
+# pool of threads doing it
+__stage_threads__ = 4
+__stage_pool__    = None
+
+
+def clear_dir( path, exclude = None ):
+    '''
+    Remove all the elements inside a directory, but not the directory itself.
+
+    :param path: path to the directory.
+    :type path: str
+    :param exclude: names of the elements to keep.
+    :type exclude: collection(str) or None
+    '''
+    exclude = exclude if exclude is not None else ()
+
+    for n, isdir in _iter_entries(path):
+
+        if n in exclude:
+            continue
+
+        fp = os.path.join(path, n)
+
+        if isdir:
+            shutil.rmtree(fp)
+        else:
+            os.remove(fp)
+
 
 def create_dir( path = None ):
     '''
@@ -18,23 +70,313 @@ def create_dir( path = None ):
     '''
     path = path if path is not None else __default_dir__
 
+    with __dir_lock__:
+
+        try:
+            os.mkdir(path)
+        except OSError:
+            pass
+
+        # Only the numeric entries correspond to jobs
+        files = [int(s) for s in os.listdir(path) if s.isdigit()]
+
+        if files:
+            pid = max(files) + 1
+        else:
+            pid = 0
+
+        cdir = os.path.join(path, str(pid))
+
+        os.mkdir(cdir)
+
+    return cdir
+
+
+def _empty_trash():
+    '''
+    Delete the trashed directories. Function to be run in a separate thread.
+    '''
+    while True:
+
+        path = __trash_queue__.get()
+
+        shutil.rmtree(path, ignore_errors=True)
+
+        __trash_queue__.task_done()
+
+
+def _iter_entries( path ):
+    '''
+    Iterate over the entries of a directory, yielding their names and
+    whether they are directories.
+    Uses :func:`os.scandir` if available, which avoids calling
+    :func:`os.stat` on each entry.
+
+    :param path: path to the directory.
+    :type path: str
+    :returns: name of the entries and whether they are directories.
+    :rtype: generator(tuple(str, bool))
+    '''
+    if hasattr(os, 'scandir'):
+        it = os.scandir(path)
+        try:
+            for e in it:
+                yield e.name, e.is_dir()
+        finally:
+            # The iteration might be interrupted
+            if hasattr(it, 'close'):
+                it.close()
+    else:
+        for n in os.listdir(path):
+            yield n, os.path.isdir(os.path.join(path, n))
+
+
+def file_fingerprint( path, mode = 'stat', previous = None ):
+    '''
+    Return the fingerprint of a file, made of its size, its modification
+    time and, if mode is "hash", the digest of its content.
+    If the size and the modification time have not changed with respect to
+    the previous fingerprint, its digest is reused.
+
+    :param path: path to the file.
+    :type path: str
+    :param mode: "stat" or "hash".
+    :type mode: str
+    :param previous: previous fingerprint of the file.
+    :type previous: list or None
+    :returns: size, modification time and digest (None if mode is "stat").
+    :rtype: list
+    :raises OSError: if the file does not exist.
+    '''
+    st = os.stat(path)
+
+    fp = [st.st_size, st.st_mtime, None]
+
+    if mode == 'hash':
+
+        if previous is not None and list(previous[:2]) == fp[:2] and previous[2] is not None:
+            fp[2] = previous[2]
+        else:
+            h = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+            fp[2] = h.hexdigest()
+
+    return fp
+
+
+def find_files( path, regex = None, glob = None, recursive = False ):
+    '''
+    Find the files in a directory matching a regular expression and/or a
+    glob pattern.
+    The patterns are matched against the path of the files relative to
+    "path" (using "/" as separator).
+    If the search is not recursive, directories are treated as files.
+
+    :param path: path to the directory.
+    :type path: str
+    :param regex: regular expression to match (using :func:`re.match`).
+    :type regex: str or None
+    :param glob: glob pattern to match.
+    :type glob: str or None
+    :param recursive: whether to look also in subdirectories.
+    :type recursive: bool
+    :returns: paths to the matching files. If no pattern is provided, no \
+    file is returned.
+    :rtype: generator(str)
+    '''
+    if regex is None and glob is None:
+        return
+
+    rm = re.compile(regex).match if regex is not None else None
+    gm = re.compile(fnmatch.translate(glob)).match if glob is not None else None
+
+    dirs = ['']
+    while dirs:
+
+        rel = dirs.pop()
+
+        for n, isdir in _iter_entries(os.path.join(path, rel)):
+
+            r = rel + n
+
+            if isdir and recursive:
+                dirs.append(r + '/')
+                continue
+
+            if rm is not None and rm(r) is None:
+                continue
+
+            if gm is not None and gm(r) is None:
+                continue
+
+            yield os.path.join(path, r)
+
+
+def same_fingerprint( first, second, mode = 'stat' ):
+    '''
+    Check whether two fingerprints of a file (see :func:`file_fingerprint`)
+    correspond to the same content.
+    If mode is "stat", the sizes and the modification times are compared.
+    If mode is "hash", the sizes and the digests are compared, so files
+    written again with the same content are considered equal.
+
+    :param first: first fingerprint.
+    :type first: list
+    :param second: second fingerprint.
+    :type second: list
+    :param mode: "stat" or "hash".
+    :type mode: str
+    :returns: whether the fingerprints are equivalent.
+    :rtype: bool
+    '''
+    if mode == 'hash':
+        return first[0] == second[0] and first[2] is not None and first[2] == second[2]
+    else:
+        return list(first[:2]) == list(second[:2])
+
+
+def trash_dir( path ):
+    '''
+    Empty a directory, moving it to a trash location and creating it again.
+    The trash location is a directory inside the parent directory, so the
+    move is an atomic rename. The old content is deleted in a background
+    thread.
+
+    :param path: path to the directory.
+    :type path: str
+    '''
+    global __trash_thread__
+
+    entries = _iter_entries(path)
     try:
+        empty = next(entries, None) is None
+    finally:
+        entries.close()
+
+    if empty:
+        # Nothing to do, the directory is empty
+        return
+
+    trash = os.path.join(os.path.dirname(os.path.abspath(path)), __trash_dir__)
+
+    target = os.path.join(trash, '{}.{}'.format(os.path.basename(path), uuid.uuid4().hex))
+
+    # The lock prevents "create_dir" from taking the name in the meantime
+    with __dir_lock__:
+
+        try:
+            os.mkdir(trash)
+        except OSError:
+            pass
+
+        os.rename(path, target)
         os.mkdir(path)
+
+        if __trash_thread__ is None:
+            __trash_thread__ = threading.Thread(target=_empty_trash)
+            __trash_thread__.daemon = True
+            __trash_thread__.start()
+
+    __trash_queue__.put(target)
+
+
+def wait_trash():
+    '''
+    Wait till all the trashed directories are deleted.
+    '''
+    __trash_queue__.join()
+
+
+def write_manifest( path, files ):
+    '''
+    Write the given files into a manifest, one per line.
+
+    :param path: path to the manifest.
+    :type path: str
+    :param files: paths to the files.
+    :type files: iterable(str)
+    :returns: number of files written.
+    :rtype: int
+    '''
+    n = 0
+    with open(path, 'wt') as f:
+        for p in files:
+            f.write(p + '\n')
+            n += 1
+
+    return n
+
+
+def read_manifest( path ):
+    '''
+    Read the files stored in a manifest.
+
+    :param path: path to the manifest.
+    :type path: str
+    :returns: paths to the files.
+    :rtype: list(str)
+    '''
+    with open(path, 'rt') as f:
+        return [l.rstrip('\n') for l in f if l != '\n']
+
+
+def link_or_copy( src, dst ):
+    '''
+    Make a file available in another path, creating a hard link to it or,
+    if not possible (e.g. the paths are in different file systems), copying
+    it. Hard-linked files share their content, so they must not be modified.
+
+    :param src: path to the file.
+    :type src: str
+    :param dst: new path to the file.
+    :type dst: str
+    '''
+    try:
+        os.link(src, dst)
     except OSError:
-        pass
+        if os.path.isdir(src):
+            shutil.copytree(src, dst)
+        else:
+            shutil.copy2(src, dst)
 
-    files = os.listdir(path)
 
-    if files:
-        pid = max(map(lambda s: int(s), files)) + 1
-    else:
-        pid = 0
+def move_files( files, src, dst ):
+    '''
+    Move files from a directory to another in background threads, keeping
+    their paths relative to the directories.
+    The number of threads moving files is bounded (see
+    "__stage_threads__"), so shared file systems are not flooded with
+    copies.
+
+    :param files: paths to the files, inside "src".
+    :type files: iterable(str)
+    :param src: source directory.
+    :type src: str
+    :param dst: destination directory.
+    :type dst: str
+    :returns: objects to wait for the files to be moved.
+    :rtype: list(concurrent.futures.Future)
+    '''
+    global __stage_pool__
 
-    cdir = os.path.join(path, str(pid))
+    with __dir_lock__:
+        if __stage_pool__ is None:
+            __stage_pool__ = concurrent.futures.ThreadPoolExecutor(__stage_threads__)
 
-    os.mkdir(cdir)
+    futures = []
+    for f in files:
 
-    return cdir
+        target = os.path.join(dst, os.path.relpath(f, src))
+
+        d = os.path.dirname(target)
+        if not os.path.isdir(d):
+            os.makedirs(d)
+
+        futures.append(__stage_pool__.submit(shutil.move, f, target))
+
+    return futures
 
 
 def merge_dicts( *dicts ):
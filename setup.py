@@ -60,7 +60,9 @@ setup(
     scripts = ['scripts/{}'.format(f) for f in os.listdir('scripts')],
 
     # Requisites
-    install_requires = ['ipython', 'pytest'],
+    install_requires = ['ipython', 'pytest',
+                        # Backport of "concurrent.futures" for python2
+                        'futures; python_version < "3"'],
 
     # Test requirements
     setup_requires = ['pytest-runner'],
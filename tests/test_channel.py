@@ -0,0 +1,66 @@
+'''
+Test functions for the "channel" module.
+'''
+
+__author__  = ['Miguel Ramos Pernas']
+__email__   = ['miguel.ramos.pernas@cern.ch']
+
+# Python
+import threading
+
+# Local
+import jobmgr
+
+
+def test_channel():
+    '''
+    Test the delivery of batches to many consumers.
+    '''
+    c = jobmgr.Channel()
+
+    c0 = c.subscribe()
+    c1 = c.subscribe()
+
+    # Nothing has been sent
+    assert c.get(c0, timeout=0.01) is None
+
+    c.put(range(5))
+
+    assert c.get(c0) == [0, 1]
+    assert c.get(c1) == [2, 3, 4]
+
+    # Data is kept after acknowledging it
+    c.ack(c0)
+
+    assert c.get(c0) == [0, 1]
+
+    c.abort()
+
+    assert c.get(c1) is None
+
+    c.clear()
+
+    assert c.get(c0, timeout=0.01) is None
+
+
+def test_channel_capacity():
+    '''
+    Test that the producer blocks when the channel is full.
+    '''
+    c = jobmgr.Channel(capacity=1)
+
+    c0 = c.subscribe()
+
+    assert c.put([0])
+    assert not c.put([1], timeout=0.01)
+
+    t = threading.Thread(target=c.put, args=([1],))
+    t.start()
+
+    assert c.get(c0) == [0]
+
+    c.ack(c0)
+
+    t.join()
+
+    assert c.get(c0) == [1]
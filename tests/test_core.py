@@ -5,6 +5,13 @@ Test functions for the "core" module.
 __author__  = ['Miguel Ramos Pernas']
 __email__   = ['miguel.ramos.pernas@cern.ch']
 
+# Python
+import gc
+import pytest
+import threading
+import time
+import weakref
+
 # Local
 import jobmgr
 
@@ -66,3 +73,609 @@ def test_watchdog( tmpdir ):
     assert all(
         map(lambda j: j._status == jobmgr.StatusCode.terminated,jobs)
         )
+
+
+def test_watchdog_timers():
+    '''
+    Test the timers of the Watchdog class.
+    '''
+    w = jobmgr.Watchdog()
+
+    fired = []
+
+    try:
+        w.add_timer(0.2, lambda: fired.append(1))
+        w.add_timer(0.05, lambda: fired.append(0))
+
+        t = w.add_timer(0.1, lambda: fired.append(2))
+        w.cancel_timer(t)
+
+        time.sleep(0.5)
+    finally:
+        w.stop()
+
+    assert fired == [0, 1]
+
+
+def test_watchdog_listeners( monkeypatch ):
+    '''
+    Test that the Watchdog class only keeps weak references to methods.
+    '''
+    class Listener(object):
+        def __init__( self ):
+            self.calls = 0
+        def __call__( self, jobs ):
+            self.calls += 1
+
+    for weak_method in (True, False):
+
+        if not weak_method:
+            # Like in python2
+            monkeypatch.delattr(weakref, 'WeakMethod')
+
+        w = jobmgr.Watchdog()
+        try:
+            l = Listener()
+
+            w.add_listener(l.__call__)
+
+            time.sleep(0.3)
+
+            assert l.calls > 0
+
+            del l
+            gc.collect()
+
+            time.sleep(0.3)
+
+            assert w._listeners == []
+        finally:
+            w.stop()
+
+
+def test_retry_policy():
+    '''
+    Test the behaviour of the RetryPolicy class.
+    '''
+    p = jobmgr.RetryPolicy(max_attempts=4, backoff=1., factor=2., max_backoff=3.)
+
+    assert [p.delay(i) for i in range(1, 4)] == [1., 2., 3.]
+
+    assert p.should_retry(1, 1)
+    assert p.should_retry(3, -9)
+    assert not p.should_retry(4, 1)
+    assert not p.should_retry(1, 0)
+
+    p = jobmgr.RetryPolicy(exit_codes=(2,), signals=(9,))
+
+    assert p.should_retry(1, 2)
+    assert not p.should_retry(1, 1)
+    assert p.should_retry(1, -9)
+    assert not p.should_retry(1, -15)
+
+
+def test_straggler_detector():
+    '''
+    Test the behaviour of the StragglerDetector class.
+    '''
+    d = jobmgr.StragglerDetector(percentile=50., multiple=2., min_samples=3)
+
+    d.record('a', 1.)
+    d.record('a', 3.)
+
+    assert d.threshold('a') is None
+    assert d.threshold('b') is None
+
+    d.record('a', 2.)
+
+    assert d.threshold('a') == 4.
+
+
+class _FakeJob(object):
+    '''
+    Job-like object storing the order in which jobs are started.
+    '''
+    def __init__( self, name, started ):
+        self.name     = name
+        self._status  = jobmgr.StatusCode.new
+        self._started = started
+
+    def start( self ):
+        self._status = jobmgr.StatusCode.running
+        self._started.append(self.name)
+
+    def status( self ):
+        return self._status
+
+    def kill( self ):
+        jobmgr.core.compare_and_set(self, (jobmgr.StatusCode.queued,), jobmgr.StatusCode.killed)
+
+    def update_status( self ):
+        pass
+
+    def wait( self ):
+        pass
+
+
+def test_scheduler_priority():
+    '''
+    Test that the Scheduler starts the jobs by priority.
+    '''
+    started = []
+
+    s = jobmgr.Scheduler(max_running=1)
+
+    jobs = [_FakeJob(n, started) for n in 'abcd']
+
+    for j, p in zip(jobs, (0, 1, 5, 1)):
+        s.submit(j, priority=p)
+
+    # The first job starts immediately
+    assert started == ['a'] and len(s) == 3
+
+    byname = {j.name: j for j in jobs}
+
+    while len(s):
+        byname[started[-1]]._status = jobmgr.StatusCode.terminated
+        s.dispatch()
+
+    assert started == ['a', 'c', 'b', 'd']
+    assert s.running() == 1
+
+
+def test_scheduler_fair_share():
+    '''
+    Test the fair-share policy of the Scheduler.
+    '''
+    started = []
+
+    s = jobmgr.Scheduler(max_running=3, weights={'b': 2})
+
+    for i in range(4):
+        s.submit(_FakeJob('a{}'.format(i), started), user='a')
+
+    # All the slots are taken
+    assert started == ['a0', 'a1', 'a2']
+
+    s.submit(_FakeJob('b0', started), user='b')
+    s.submit(_FakeJob('b1', started), user='b')
+    s.submit(_FakeJob('c0', started), user='c')
+
+    s.max_running = 6
+    s.dispatch()
+
+    # Users with less running jobs relative to their weights go first
+    assert started[3:] == ['b0', 'c0', 'b1']
+
+
+def test_admission_controller():
+    '''
+    Test that the AdmissionController converges to the capacity of a
+    simulated system.
+    '''
+    cpus = 8
+
+    s = jobmgr.Scheduler()
+
+    # Each running job loads one CPU
+    probe = lambda: {'load': s.running() / float(cpus), 'memory': 1.}
+
+    s.admission = jobmgr.AdmissionController(start=1, interval=0, probe=probe)
+
+    started = []
+
+    jobs = [_FakeJob(i, started) for i in range(2000)]
+
+    for j in jobs:
+        s.submit(j)
+
+    # Jobs last three rounds
+    limits  = []
+    running = []
+    for r in range(300):
+
+        n = len(started)
+
+        s.dispatch()
+
+        for i in started[n:]:
+            jobs[i].round = r
+
+        for j in jobs:
+            if j.status() == jobmgr.StatusCode.running and r - getattr(j, 'round', 0) >= 3:
+                j._status = jobmgr.StatusCode.terminated
+
+        limits.append(s.admission.limit)
+        running.append(s.running())
+
+    # The number of running jobs oscillates around the capacity, since the
+    # load is seen with some delay
+    assert all(1 <= l <= 2 * cpus for l in limits[100:])
+    assert max(running[100:]) <= 2 * cpus
+    assert 0.6 * cpus <= sum(running[100:]) / 200. <= 1.25 * cpus
+
+    # Memory-heavy jobs: starts are paused before running out of memory
+    used = {'n': 0}
+
+    # The limit on the available memory is disabled, so only the reserve
+    # stops the start of jobs
+    c = jobmgr.AdmissionController(start=1, interval=0, memory=0., probe=lambda: {'memory': 1. - 0.15 * used['n']})
+
+    # One job is started per probe, and running jobs finish if the limit
+    # drops below their number
+    paused = False
+    for i in range(50):
+        used['n'] = min(c.update(used['n'], 10), used['n'] + 1)
+        paused = paused or c.paused
+        assert used['n'] <= 7
+
+    assert paused
+
+    used['n'] = 7
+    assert c.update(7, 10) == 0 and c.paused
+
+    used['n'] = 2
+    assert c.update(2, 10) >= 1 and not c.paused
+
+    # The values of the real system can be read, if available
+    values = jobmgr.core.system_pressure()
+
+    assert set(values) == {'load', 'memory', 'cpu_pressure', 'memory_pressure', 'io_pressure'}
+
+
+class _TimedJob(_FakeJob):
+    '''
+    Job-like object with a command and execution times.
+    '''
+    def __init__( self, name, started, status = jobmgr.StatusCode.new, start_time = None, end_time = None ):
+        super(_TimedJob, self).__init__(name, started)
+        self.command    = ['sleep', name]
+        self._status    = status
+        self.start_time = start_time
+        self.end_time   = end_time
+
+    def _runtime_key( self ):
+        return 'sleep'
+
+
+def test_runtime_history( tmpdir ):
+    '''
+    Test the RuntimeHistory class, the longest-job-first ordering of the
+    Scheduler and the estimation of the time to finish the jobs.
+    '''
+    path = tmpdir.join('history.json').strpath
+
+    h = jobmgr.RuntimeHistory(path)
+
+    started = []
+
+    # Runtimes are recorded once for each execution
+    done = [_TimedJob(str(t), started, jobmgr.StatusCode.terminated, 0., t) for t in (1, 2, 3, 4, 1)]
+
+    h.update(done)
+    h.update(done)
+
+    assert len(h) == 4
+    assert h.predict(done[0]) == 1. and h.predict(done[3]) == 4.
+    assert h.predict(_TimedJob('5', started)) is None
+
+    h.record(h.key(done[0]), 4.)
+    assert h.predict(done[0]) == 2.
+
+    # The history is persistent
+    h = jobmgr.RuntimeHistory(path)
+
+    assert len(h) == 4 and h.predict(done[1]) == 2.
+
+    # Longest jobs first, unknown jobs before them
+    s = jobmgr.Scheduler(max_running=0, history=h)
+
+    jobs = [_TimedJob(n, started) for n in ('2', '4', '5', '3')]
+
+    for j in jobs:
+        s.submit(j)
+
+    s.max_running = 4
+    s.dispatch()
+
+    assert started == ['5', '4', '3', '2']
+
+    # Estimation of the time to finish: two slots, one job running for one
+    # second out of four and three queued jobs of 3, 2 and 2 seconds
+    now = time.time()
+
+    reg = jobmgr.JobRegistry(jobmgr.Scheduler(max_running=2), history=h)
+
+    try:
+        assert reg.eta() == 0
+
+        reg.register(_TimedJob('4', started, jobmgr.StatusCode.running, now - 1.))
+
+        for n in ('3', '2', '2'):
+            reg.register(_TimedJob(n, started, jobmgr.StatusCode.queued))
+
+        reg.register(_TimedJob('1', started, jobmgr.StatusCode.terminated, 0., 1.))
+
+        assert abs(reg.eta() - 5.) < 0.1
+    finally:
+        reg.watchdog.stop()
+
+
+def test_registry_submit( tmpdir ):
+    '''
+    Test the submission of jobs to the scheduler of a registry.
+    '''
+    path = tmpdir.join('test_registry_submit').strpath
+
+    reg = jobmgr.JobRegistry(scheduler=jobmgr.Scheduler(max_running=1))
+
+    cmd = ['-c', 'import time; time.sleep(0.1)']
+
+    jobs = [jobmgr.Job('python', cmd, path, registry=reg) for _ in range(3)]
+
+    for j in jobs:
+        reg.submit(j)
+
+    assert [j.status() for j in jobs] == [jobmgr.StatusCode.running] + 2 * [jobmgr.StatusCode.queued]
+
+    jobs[-1].kill()
+
+    for j in jobs:
+        j.wait()
+
+    reg.watchdog.stop()
+
+    assert [j.status() for j in jobs] == 2 * [jobmgr.StatusCode.terminated] + [jobmgr.StatusCode.killed]
+    assert jobs[0].end_time <= jobs[1].start_time
+
+
+def test_registry_concurrency():
+    '''
+    Test the registration of jobs from many threads.
+    '''
+    reg = jobmgr.JobRegistry()
+
+    jobs = [[] for _ in range(8)]
+
+    def register( lst ):
+        for i in range(500):
+            j = _FakeJob(i, [])
+            j.jid = reg.register(j)
+            lst.append(j)
+
+    threads = [threading.Thread(target=register, args=(l,)) for l in jobs]
+
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    reg.watchdog.stop()
+
+    assert len(reg) == 4000
+    assert all(reg[j.jid] is j for l in jobs for j in l)
+
+
+def test_scheduler_concurrency():
+    '''
+    Test the submission and killing of queued jobs from many threads, while
+    the running jobs finish in another thread.
+    '''
+    s = jobmgr.Scheduler(max_running=4)
+
+    started = []
+    killed  = []
+    jobs    = {}
+
+    def submit( k ):
+        for i in range(200):
+
+            j = _FakeJob((k, i), started)
+            jobs[j.name] = j
+
+            s.submit(j)
+
+            # This is what happens when queued jobs are killed
+            if i % 2 and jobmgr.core.compare_and_set(j, (jobmgr.StatusCode.queued,), jobmgr.StatusCode.killed):
+                killed.append(j.name)
+
+    threads = [threading.Thread(target=submit, args=(k,)) for k in range(8)]
+
+    for t in threads:
+        t.start()
+
+    while any(t.is_alive() for t in threads) or len(s):
+
+        assert s.running() <= 4
+
+        for n in list(started):
+            jobmgr.core.compare_and_set(jobs[n], (jobmgr.StatusCode.running,), jobmgr.StatusCode.terminated)
+
+        s.dispatch()
+
+    # Each job is either started once or killed while queued
+    assert len(started) == len(set(started))
+    assert not set(started) & set(killed)
+    assert len(started) + len(killed) == 1600
+
+
+def test_stall_detector( tmpdir ):
+    '''
+    Test the detection of stalled processes.
+    '''
+    path = tmpdir.join('test_stall_detector').strpath
+
+    with pytest.raises(ValueError):
+        jobmgr.StallDetector()
+
+    with pytest.raises(ValueError):
+        jobmgr.StallDetector(output=1, action='unknown')
+
+    # Killing stalled processes
+    reg = jobmgr.JobRegistry(stall=jobmgr.StallDetector(output=0.3, cpu=0.3, interval=0.05))
+
+    stalled = jobmgr.Job('python', ['-c', 'import time; time.sleep(60)'], path, registry=reg)
+
+    # Processes writing output or consuming CPU are not stalled
+    writing = jobmgr.Job('python', ['-u', '-c', 'import time\nfor i in range(20): print(i); time.sleep(0.05)'], path, registry=reg)
+    busy    = jobmgr.Job('python', ['-c', 'import time\nt = time.time()\nwhile time.time() - t < 1: pass'], path, registry=reg)
+
+    job = jobmgr.SteppedJob(path, registry=reg)
+    jobmgr.Step('a', 'python', ['-c', 'import time; time.sleep(60)'], job)
+
+    jobs = (stalled, writing, busy, job)
+
+    try:
+        for j in jobs:
+            j.start()
+
+        for j in jobs:
+            j.wait()
+
+        time.sleep(0.3)
+
+        assert stalled.stalled
+        assert stalled.status() == jobmgr.StatusCode.killed
+        assert stalled.end_time - stalled.start_time < 30
+
+        assert not writing.stalled and writing.status() == jobmgr.StatusCode.terminated
+        assert not busy.stalled and busy.status() == jobmgr.StatusCode.terminated
+
+        assert job.steps[0].stalled
+        assert job.status() == jobmgr.StatusCode.killed
+    finally:
+        job.steps.watchdog.stop()
+        reg.watchdog.stop()
+
+    # Flagging processes without heartbeat
+    reg = jobmgr.JobRegistry(stall=jobmgr.StallDetector(heartbeat=0.3, action='flag', interval=0.05))
+
+    beating = jobmgr.Job('python', ['-c', 'import time\nfor i in range(20): open("heartbeat", "wt").close(); time.sleep(0.05)'], path, registry=reg)
+    silent  = jobmgr.Job('python', ['-c', 'import time; time.sleep(1)'], path, registry=reg)
+
+    try:
+        for j in (beating, silent):
+            j.start()
+
+        for j in (beating, silent):
+            j.wait()
+
+        time.sleep(0.3)
+
+        assert not beating.stalled
+        assert silent.stalled
+
+        # Flagged jobs are not killed
+        assert silent.status() == jobmgr.StatusCode.terminated
+    finally:
+        reg.watchdog.stop()
+
+
+def test_job_dependencies( tmpdir ):
+    '''
+    Test the jobs waiting for other jobs and files in a JobRegistry.
+    '''
+    path = tmpdir.join('test_job_dependencies').strpath
+
+    inputs = tmpdir.mkdir('inputs')
+
+    reg = jobmgr.JobRegistry()
+
+    try:
+        j0 = jobmgr.Job('python', ['-c', 'import time; time.sleep(0.3)'], path, registry=reg)
+        j1 = jobmgr.Job('true', [], path, registry=reg)
+        j2 = jobmgr.Job('true', [], path, registry=reg)
+        j3 = jobmgr.Job('false', [], path, registry=reg)
+        j4 = jobmgr.Job('true', [], path, registry=reg)
+
+        reg.submit(j0)
+
+        assert reg.submit(j1, after=[j0], files=[inputs.join('*.txt').strpath])
+        assert not reg.submit(j1, after=[j0])
+
+        time.sleep(0.6)
+
+        # The file has not appeared yet
+        assert j0.status() == jobmgr.StatusCode.terminated
+        assert j1.status() == jobmgr.StatusCode.new
+
+        inputs.join('a.txt').write('a')
+
+        time.sleep(0.3)
+
+        assert j1.status() == jobmgr.StatusCode.terminated
+
+        # Files which already exist satisfy the patterns
+        reg.submit(j2, files=[inputs.join('a.txt').strpath])
+
+        time.sleep(0.3)
+
+        assert j2.status() == jobmgr.StatusCode.terminated
+
+        # Jobs depending on failed jobs are killed
+        reg.submit(j3)
+        reg.submit(j4, after=[j3])
+
+        time.sleep(0.5)
+
+        assert j4.status() == jobmgr.StatusCode.killed
+        assert j4.start_time is None
+
+        with pytest.raises(ValueError):
+            reg.submit(j4, files=[tmpdir.join('*', 'a.txt').strpath])
+    finally:
+        reg.watchdog.stop()
+
+
+def test_single_flight( tmpdir ):
+    '''
+    Test the execution of identical jobs only once in a JobRegistry.
+    '''
+    path = tmpdir.join('test_single_flight').strpath
+
+    cmd = ['-c', 'import os, time; time.sleep(0.3); print(os.getpid())']
+
+    reg = jobmgr.JobRegistry(single_flight=True)
+
+    try:
+        j0 = jobmgr.Job('python', cmd, path, registry=reg)
+        j1 = jobmgr.Job('python', cmd, path, registry=reg)
+        j2 = jobmgr.Job('python', cmd + ['other'], path, registry=reg)
+        j3 = jobmgr.Job('python', cmd, path, registry=reg)
+
+        for j in (j0, j1, j2, j3):
+            assert reg.submit(j)
+
+        assert j1._odir == j3._odir == j0._odir
+        assert j2._odir != j0._odir
+
+        # Attached jobs can be killed without affecting the other job
+        j3.kill()
+
+        assert j3.status() == jobmgr.StatusCode.killed
+        assert j0.status() == jobmgr.StatusCode.running
+
+        j1.wait()
+
+        # The status is updated by the watchdog
+        time.sleep(0.3)
+
+        assert j0.status() == j1.status() == jobmgr.StatusCode.terminated
+        assert j1.exit_code == 0 and j1.end_time == j0.end_time
+        assert j3.status() == jobmgr.StatusCode.killed
+
+        # Identical jobs submitted once the others have finished are run
+        j4 = jobmgr.Job('python', cmd, path, registry=reg)
+
+        assert reg.submit(j4)
+
+        assert j4._odir != j0._odir
+
+        j4.wait()
+
+        time.sleep(0.3)
+
+        assert j4.status() == jobmgr.StatusCode.terminated
+        assert j4.start_time >= j0.end_time
+    finally:
+        reg.watchdog.stop()
@@ -0,0 +1,102 @@
+'''
+Test functions for the "executor" module.
+'''
+
+__author__  = ['Miguel Ramos Pernas']
+__email__   = ['miguel.ramos.pernas@cern.ch']
+
+# Python
+import concurrent.futures
+import pytest
+
+# Local
+import jobmgr
+
+
+def _fail():
+    '''
+    Function raising an error, to be run in a worker process.
+    '''
+    raise RuntimeError('failure')
+
+
+def test_job_executor( tmpdir ):
+    '''
+    Test the futures returned by the JobExecutor class.
+    '''
+    path = tmpdir.join('test_job_executor').strpath
+
+    reg = jobmgr.JobRegistry(jobmgr.Scheduler(max_running=2))
+
+    ex = jobmgr.JobExecutor(reg, path)
+
+    try:
+        jobs = [jobmgr.Job('python', ['-c', 'import time; time.sleep({})'.format(0.05 * i)], path, registry=reg)
+                for i in range(4)]
+
+        fail = jobmgr.Job('python', ['-c', 'cause error'], path, registry=reg)
+
+        stepped = jobmgr.SteppedJob(path, registry=reg)
+        jobmgr.Step('a', 'python', ['-c', 'pass'], stepped)
+
+        done = []
+
+        futures = [ex.submit(j) for j in jobs]
+        futures[0].add_done_callback(done.append)
+
+        ffail    = ex.submit(fail, priority=-1)
+        fstepped = ex.submit(stepped)
+
+        completed = list(concurrent.futures.as_completed(futures + [ffail, fstepped], timeout=30))
+
+        assert len(completed) == 6
+
+        assert [f.result() for f in futures] == jobs
+        assert done == [futures[0]]
+
+        assert fstepped.result() is stepped
+
+        with pytest.raises(RuntimeError):
+            ffail.result()
+
+        # Callables are run through jobs
+        fcall = ex.submit(_fail)
+
+        concurrent.futures.wait([fcall], timeout=30)
+
+        assert isinstance(fcall.exception(), RuntimeError)
+
+        assert all(j.status() == jobmgr.StatusCode.terminated for j in ex.map(print, [1, 2]))
+
+        # Cancelling queued jobs kills them
+        reg.scheduler.max_running = 0
+
+        queued = jobmgr.Job('python', ['-c', 'pass'], path, registry=reg)
+
+        fqueued = ex.submit(queued)
+
+        # Submitting a pending job again gives the same future
+        assert ex.submit(queued) is fqueued
+
+        # Jobs submitted to the registry can not be submitted again
+        other = jobmgr.Job('python', ['-c', 'pass'], path, registry=reg)
+
+        reg.submit(other)
+
+        with pytest.raises(ValueError):
+            ex.submit(other)
+
+        other.kill()
+
+        assert fqueued.cancel()
+        assert queued.status() == jobmgr.StatusCode.killed
+
+        ex.shutdown()
+
+        with pytest.raises(RuntimeError):
+            ex.submit(queued)
+    finally:
+        for j in reg:
+            if hasattr(j, 'steps'):
+                j.steps.watchdog.stop()
+        reg.watchdog.stop()
@@ -6,7 +6,10 @@ __author__  = ['Miguel Ramos Pernas']
 __email__   = ['miguel.ramos.pernas@cern.ch']
 
 # Python
+import os
 import pytest
+import sys
+import time
 
 # Local
 import jobmgr
@@ -185,3 +188,704 @@ def test_stepped_job_kill( tmpdir ):
     reg.watchdog.stop()
 
     assert job.status() == jobmgr.core.StatusCode.killed
+
+
+def test_job_compact( tmpdir ):
+    '''
+    Test the compaction of finished jobs and their rehydration.
+    '''
+    path = tmpdir.join('test_job_compact').strpath
+
+    reg = jobmgr.JobRegistry()
+
+    j0 = jobmgr.Job('python', ['-c', 'print("testing")'], path, registry=reg)
+    j1 = jobmgr.Job('python', ['-c', 'import sys; sys.exit(3)'], path, registry=reg)
+
+    for j in (j0, j1):
+        j.start()
+        j.wait()
+
+    reg.watchdog.stop()
+
+    odir = j0._odir
+
+    del j, j0, j1
+
+    assert reg.compact() == 2
+    assert all(map(lambda r: isinstance(r, jobmgr.JobRecord), reg))
+
+    r0, r1 = reg
+
+    assert r0.status() == jobmgr.StatusCode.terminated
+    assert r0.exit_code == 0
+    assert r1.status() == jobmgr.StatusCode.killed
+    assert r1.exit_code == 3
+
+    # Records do not have a dictionary
+    assert not hasattr(r0, '__dict__')
+
+    # Compacting again does nothing
+    assert reg.compact() == 0
+
+    # Rehydrate the job on start
+    r0.start()
+
+    j0 = reg[0]
+
+    assert isinstance(j0, jobmgr.Job)
+    assert j0._odir == odir
+
+    j0.wait()
+
+    reg.watchdog.start()
+    reg.watchdog.stop()
+
+    assert j0.status() == jobmgr.StatusCode.terminated
+
+
+def test_job_compact_stale_handle( tmpdir ):
+    '''
+    Test starting jobs through handles kept after their compaction.
+    '''
+    path = tmpdir.join('test_job_compact_stale_handle').strpath
+
+    reg = jobmgr.JobRegistry()
+
+    try:
+        job = jobmgr.Job('python', ['-c', 'pass'], path, registry=reg)
+        job.start()
+        job.wait()
+
+        while job.status() != jobmgr.StatusCode.terminated:
+            time.sleep(0.01)
+
+        assert reg.compact() == 1
+
+        # The handle takes back its place in the registry and is watched
+        job.start()
+
+        assert reg[0] is job
+
+        job.wait()
+
+        while job.status() != jobmgr.StatusCode.terminated:
+            time.sleep(0.01)
+
+        # The record has been rehydrated in another job
+        assert reg.compact() == 1
+
+        reg[0].rehydrate()
+
+        with pytest.raises(RuntimeError):
+            job.start()
+
+        assert job.status() == jobmgr.StatusCode.terminated
+    finally:
+        reg.watchdog.stop()
+
+
+def test_job_retry( tmpdir ):
+    '''
+    Test that failed jobs are retried following the retry policy.
+    '''
+    path = tmpdir.join('test_job_retry').strpath
+
+    counter = tmpdir.join('counter').strpath
+
+    # Fail on the first attempt, succeed in the second
+    opts = ['-c', 'import os, sys; c = "{0}"; e = os.path.exists(c); '\
+            'open(c, "wt").close(); sys.exit(0 if e else 2)'.format(counter)]
+
+    reg = jobmgr.JobRegistry()
+
+    retry = jobmgr.RetryPolicy(max_attempts=2, backoff=0.01, exit_codes=(2,))
+
+    j0 = jobmgr.Job('python', opts, path, registry=reg, retry=retry)
+    j1 = jobmgr.Job('python', ['-c', 'import sys; sys.exit(1)'], path, registry=reg, retry=retry)
+
+    for j in (j0, j1):
+        j.start()
+        j.wait()
+
+    reg.watchdog.stop()
+
+    assert j0.status() == jobmgr.StatusCode.terminated
+    assert j0.attempts == 2
+
+    # Exit code not allowed to be retried
+    assert j1.status() == jobmgr.StatusCode.killed
+    assert j1.attempts == 1
+
+
+def test_stepped_job_retry( tmpdir ):
+    '''
+    Test the retry of steps and the resumption of stepped jobs.
+    '''
+    path = tmpdir.join('test_stepped_job_retry').strpath
+
+    counter = tmpdir.join('counter').strpath
+    trigger = tmpdir.join('trigger').strpath
+
+    reg = jobmgr.JobRegistry()
+
+    job = jobmgr.SteppedJob(path, registry=reg,
+                            retry=jobmgr.RetryPolicy(max_attempts=2, backoff=0.01))
+
+    opts_create = [
+        '-c',
+        'with open("dummy.txt", "wt") as f: f.write("testing")'
+        ]
+    jobmgr.Step('create', 'python', opts_create, job, data_regex='.*txt')
+
+    # Fails the first time, using the data from the previous step
+    opts_retry = ['-c', 'import os, sys; c = "{0}"; e = os.path.exists(c); '\
+                  'open(c, "wt").close(); open(sys.argv[1]); '\
+                  'sys.exit(0 if e else 1)'.format(counter)]
+    jobmgr.Step('retry', 'python', opts_retry, job, data_regex='.*txt')
+
+    # Fails unless the trigger file exists
+    opts_resume = ['-c', 'import os, sys; sys.exit(0 if os.path.exists("{}") '\
+                   'else 1)'.format(trigger)]
+    jobmgr.Step('resume', 'python', opts_resume, job, data_regex='.*txt',
+                retry=jobmgr.RetryPolicy(max_attempts=1))
+
+    job.start()
+    job.wait()
+    job.steps.watchdog.stop()
+
+    create, retry, resume = job.steps
+
+    assert create.attempts == 1
+    assert retry.attempts == 2
+    assert resume.status() == jobmgr.StatusCode.killed
+
+    open(trigger, 'wt').close()
+
+    job.steps.watchdog.start()
+    job.resume()
+    job.wait()
+    job.steps.watchdog.stop()
+    reg.watchdog.stop()
+
+    # Only the last step must have been run again
+    assert create.attempts == 1 and retry.attempts == 2
+    assert all(map(lambda s: s.status() == jobmgr.StatusCode.terminated, job.steps))
+
+
+def test_stepped_job_manifest( tmpdir ):
+    '''
+    Test for the SteppedJob class, sending the data through a manifest.
+    '''
+    path = tmpdir.join('test_stepped_job_manifest').strpath
+
+    reg = jobmgr.JobRegistry()
+
+    job = jobmgr.SteppedJob(path, registry=reg)
+
+    opts_create = [
+        '-c',
+        'import os; os.mkdir("sub"); '\
+        '[open(os.path.join("sub", "{}.txt".format(i)), "wt").close() for i in range(10)]'
+        ]
+    jobmgr.Step('create', 'python', opts_create, job, data_glob='*.txt',
+                data_recursive=True, data_manifest=True)
+
+    opts_consume = [
+        '-c',
+        'import sys; assert len(sys.argv) == 2; '\
+        'assert len(open(sys.argv[1]).readlines()) == 10'
+        ]
+    jobmgr.Step('consume', 'python', opts_consume, job)
+
+    job.start()
+    job.wait()
+    job.steps.watchdog.stop()
+    reg.watchdog.stop()
+
+    assert job.status() == jobmgr.StatusCode.terminated
+
+    # The last step has no output data
+    assert job.steps[-1]._channel.get() == []
+
+
+def test_job_speculation( tmpdir ):
+    '''
+    Test that speculative copies of stragglers are launched.
+    '''
+    path = tmpdir.join('test_job_speculation').strpath
+
+    counter = tmpdir.join('counter').strpath
+
+    # The first copy hangs, the second finishes immediately
+    opts = ['-c', 'import os, time; c = "{0}"; e = os.path.exists(c); '\
+            'open(c, "wt").close(); open("copy.txt", "wt").write(str(e)); '\
+            'time.sleep(0 if e else 60)'.format(counter)]
+
+    detector = jobmgr.StragglerDetector(min_samples=1)
+
+    reg = jobmgr.JobRegistry()
+
+    j = jobmgr.Job('python', opts, path, registry=reg, speculation=detector)
+
+    j.start()
+
+    # The runtimes of other jobs are known once the job is running
+    detector.record('python', 0.05)
+
+    j.wait()
+
+    reg.watchdog.stop()
+
+    assert j.status() == jobmgr.StatusCode.terminated
+    assert j.end_time - j.start_time < 30
+
+    with open(os.path.join(j._odir, 'copy.txt')) as f:
+        assert f.read() == 'True'
+
+    assert not os.path.exists(os.path.join(j._odir, '.speculative'))
+
+
+def test_job_cleanup( tmpdir ):
+    '''
+    Test the different ways to clean the output directory of jobs.
+    '''
+    path = tmpdir.join('test_job_cleanup').strpath
+
+    with pytest.raises(ValueError):
+        jobmgr.Job('python', [], path, registry=jobmgr.JobRegistry(), cleanup='unknown')
+
+    reg = jobmgr.JobRegistry()
+
+    opts = ['-c', 'import os; assert not os.path.exists("dummy.txt"); '\
+            'open("dummy.txt", "wt").close()']
+
+    j = jobmgr.Job('python', opts, path, registry=reg, cleanup='trash')
+
+    for _ in range(2):
+        j.start()
+        j.wait()
+
+    reg.watchdog.stop()
+
+    assert j.status() == jobmgr.StatusCode.terminated
+
+
+def test_py_job( tmpdir ):
+    '''
+    Test the behaviour of jobs running Python callables in a pool.
+    '''
+    path = tmpdir.join('test_py_job').strpath
+
+    reg = jobmgr.JobRegistry()
+
+    p = jobmgr.WorkerPool(processes=2)
+
+    j0 = jobmgr.PyJob(print, ('testing',), path, pool=p, registry=reg)
+    j1 = jobmgr.PyJob(sys.exit, (3,), path, pool=p, registry=reg)
+    j2 = jobmgr.PyJob(time.sleep, (60,), path, pool=p, registry=reg)
+
+    for j in (j0, j1, j2):
+        j.start()
+
+    j0.wait()
+    j1.wait()
+    j2.kill()
+
+    # Workers are reused after a task finishes, and replaced if killed
+    j0.start()
+    j0.wait()
+
+    reg.watchdog.stop()
+
+    p.close()
+
+    assert j0.status() == jobmgr.StatusCode.terminated
+    assert j1.status() == jobmgr.StatusCode.killed and j1.exit_code == 3
+    assert j2.status() == jobmgr.StatusCode.killed
+
+    with open(os.path.join(j0._odir, 'stdout')) as f:
+        assert f.read() == 'testing\n'
+
+
+def test_py_job_errors( tmpdir ):
+    '''
+    Test jobs running Python callables which can not be launched, or whose
+    speculative copies must wait for a free worker.
+    '''
+    path = tmpdir.join('test_py_job_errors').strpath
+
+    reg = jobmgr.JobRegistry()
+
+    p = jobmgr.WorkerPool(processes=1)
+
+    detector = jobmgr.StragglerDetector(min_samples=1)
+    detector.record('sleep', 0.01)
+
+    # Lambdas can not be pickled
+    j0 = jobmgr.PyJob(lambda: None, (), path, pool=p, registry=reg)
+    j1 = jobmgr.PyJob(time.sleep, (0.5,), path, pool=p, registry=reg, speculation=detector)
+
+    try:
+        for j in (j0, j1):
+            j.start()
+            j.wait()
+
+        time.sleep(0.3)
+
+        assert j0.status() == jobmgr.StatusCode.killed and j0.exit_code == 1
+        assert j1.status() == jobmgr.StatusCode.terminated
+    finally:
+        reg.watchdog.stop()
+        p.close()
+
+
+def test_stepped_job_fan_out( tmpdir ):
+    '''
+    Test for the SteppedJob class, splitting the data among many steps.
+    '''
+    path = tmpdir.join('test_stepped_job_fan_out').strpath
+
+    reg = jobmgr.JobRegistry()
+
+    job = jobmgr.SteppedJob(path, registry=reg)
+
+    opts_create = [
+        '-c',
+        '[open("{}.txt".format(i), "wt").close() for i in range(10)]'
+        ]
+    jobmgr.Step('create', 'python', opts_create, job, data_regex='.*txt')
+
+    opts_consume = [
+        '-c',
+        'import sys; assert len(sys.argv) == 6; open("n.txt", "wt").close()'
+        ]
+    jobmgr.Step('consume-0', 'python', opts_consume, job, data_regex='.*txt', source='create')
+    jobmgr.Step('consume-1', 'python', opts_consume, job, data_regex='.*txt', source='create')
+
+    with pytest.raises(LookupError):
+        jobmgr.Step('unknown', 'python', [], job, source='unknown')
+
+    for _ in range(2):
+
+        job.start()
+        job.wait()
+
+        # Restart from one of the consumers
+        job.start('consume-0')
+        job.wait()
+
+    job.steps.watchdog.stop()
+    reg.watchdog.stop()
+
+    assert job.status() == jobmgr.StatusCode.terminated
+
+
+def test_job_logs( tmpdir ):
+    '''
+    Test the functions to read the logs of the jobs.
+    '''
+    path = tmpdir.join('test_job_logs').strpath
+
+    reg = jobmgr.JobRegistry()
+
+    opts = ['-c', 'import time\nfor i in range(5):\n    print(i, flush=True)\n    time.sleep(0.1)']
+
+    j0 = jobmgr.Job('python', opts, path, registry=reg)
+    j1 = jobmgr.Job('python', opts, path, registry=reg)
+
+    j0.start()
+
+    assert list(j0.follow(interval=0.01)) == ['0', '1', '2', '3', '4']
+
+    assert j0.tail(2) == ['3', '4']
+    assert j0.tail(2, pattern='[0-2]') == ['1', '2']
+
+    with pytest.raises(ValueError):
+        j0.tail(name='unknown')
+
+    j1.start()
+
+    lines = [(j, l) for j, l in reg.follow(interval=0.01, refresh=0.05)]
+
+    assert all(j is j1 for j, _ in lines)
+    assert [l for _, l in lines] == ['0', '1', '2', '3', '4']
+
+    reg.watchdog.stop()
+
+
+def test_registry_search( tmpdir ):
+    '''
+    Test the search in the log files of the jobs of a registry.
+    '''
+    path = tmpdir.join('test_registry_search').strpath
+
+    reg = jobmgr.JobRegistry()
+
+    opts = ['-c', 'import sys\nfor i in range(100): print("line", i)\n'\
+            'if sys.argv[1] == "1": print("Error: failed")']
+
+    j0 = jobmgr.Job('python', opts + ['0'], path, registry=reg, index_logs=True)
+    j1 = jobmgr.Job('python', opts + ['1'], path, registry=reg)
+
+    for j in (j0, j1):
+        j.start()
+        j.wait()
+
+    reg.watchdog.stop()
+
+    assert os.path.exists(os.path.join(j0._odir, '.stdout.idx'))
+
+    # Logs of jobs without an index are scanned
+    assert not os.path.exists(os.path.join(j1._odir, '.stdout.idx'))
+
+    assert reg.search('failed') == [(j1, 100, 'Error: failed')]
+    assert reg.search(markers_only=True) == [(j1, 100, 'Error: failed')]
+    assert [(j, n) for j, n, _ in reg.search('line 5$')] == [(j0, 5), (j1, 5)]
+
+
+def test_stepped_job_incremental( tmpdir ):
+    '''
+    Test the incremental execution of stepped jobs.
+    '''
+    path = tmpdir.join('test_stepped_job_incremental').strpath
+
+    reg = jobmgr.JobRegistry()
+
+    job = jobmgr.SteppedJob(path, registry=reg, incremental='hash')
+
+    opts_create = ['-c', 'open("dummy.txt", "wt").write("testing")']
+    create = jobmgr.Step('create', 'python', opts_create, job, data_regex='.*txt')
+
+    opts_copy = ['-c', 'import sys; open("copy.txt", "wt").write(open(sys.argv[1]).read())']
+    copy = jobmgr.Step('copy', 'python', opts_copy, job, data_regex='.*txt', data_manifest=True)
+
+    opts_check = ['-c', 'import sys; assert open(open(sys.argv[1]).read().strip()).read() == "testing"']
+    jobmgr.Step('check', 'python', opts_check, job)
+
+    def run():
+        job.start()
+        job.wait()
+        assert all(s.exit_code == 0 for s in job.steps)
+        return [s.name for s in job.steps if not s.skipped]
+
+    try:
+        assert run() == ['create', 'copy', 'check']
+
+        # Nothing changed
+        assert run() == []
+
+        # The command changes, but the output is the same
+        create.command.append('--unused')
+        assert run() == ['create']
+
+        # The output of an intermediate step is regenerated with the same
+        # content, so the next step is up to date
+        os.remove(os.path.join(copy._odir, 'copy.txt'))
+        assert run() == ['copy']
+
+        # Comparing only the sizes and modification times, the next step
+        # is considered out of date
+        for s in job.steps:
+            s.incremental = 'stat'
+
+        os.remove(os.path.join(copy._odir, 'copy.txt'))
+        assert run() == ['copy', 'check']
+    finally:
+        job.steps.watchdog.stop()
+        reg.watchdog.stop()
+
+
+def test_stepped_job_killed_input( tmpdir ):
+    '''
+    Test that steps are not run without input if the previous step has been
+    killed.
+    '''
+    path = tmpdir.join('test_stepped_job_killed_input').strpath
+
+    reg = jobmgr.JobRegistry()
+
+    job = jobmgr.SteppedJob(path, registry=reg)
+
+    jobmgr.Step('a', 'python', ['-c', 'cause error'], job, data_regex='.*txt')
+    jobmgr.Step('b', 'python', ['-c', 'print("running")'], job)
+
+    try:
+        job.start()
+        job.wait()
+
+        job.start('b')
+        job.wait()
+
+        time.sleep(0.3)
+
+        assert all(s.status() == jobmgr.StatusCode.killed for s in job.steps)
+        assert job.steps[1].exit_code is None
+    finally:
+        job.steps.watchdog.stop()
+        reg.watchdog.stop()
+
+
+def test_job_array( tmpdir ):
+    '''
+    Test the behaviour of job arrays.
+    '''
+    path = tmpdir.join('test_job_array').strpath
+
+    reg = jobmgr.JobRegistry(jobmgr.Scheduler(max_running=1))
+
+    opts = ['-c', 'import sys; print(sys.argv[1]); sys.exit(int(sys.argv[1]) == 7)', '{index}']
+
+    a = jobmgr.JobArray('python', opts, path, 20, registry=reg, max_running=4)
+    b = jobmgr.JobArray('python', ['-c', 'import time; time.sleep(60)'], path, 1000, registry=reg)
+
+    try:
+        assert len(reg) == 2 and len(a) == 20
+        assert a.task_command(3) == ['python'] + opts[:2] + ['3']
+
+        # The arrays are scheduled as single jobs
+        reg.submit(a)
+        reg.submit(b)
+
+        assert b.status() == jobmgr.StatusCode.queued
+
+        a.wait()
+
+        time.sleep(0.3)
+
+        assert a.status() == jobmgr.StatusCode.killed
+        assert a.counts()['terminated'] == 19 and a.counts()['killed'] == 1
+        assert a.task_status(7) == 'killed' and a.task_exit_code(7) == 1
+
+        with open(os.path.join(a.task_dir(3), 'stdout')) as f:
+            assert f.read() == '3\n'
+
+        # Only the failed task is run again
+        a.start([7])
+        a.wait()
+
+        assert a.counts()['killed'] == 1 and a.task_exit_code(0) == 0
+
+        # Directories are created only for the launched tasks
+        b.kill()
+
+        assert b.counts()['killed'] == 1000
+        assert len(os.listdir(b._odir)) <= b.max_running
+    finally:
+        reg.watchdog.stop()
+
+
+def test_stepped_job_scratch( tmpdir ):
+    '''
+    Test that steps run in the scratch area and only their output data is
+    moved to the output directory.
+    '''
+    path    = tmpdir.join('test_stepped_job_scratch').strpath
+    scratch = tmpdir.join('scratch').strpath
+
+    os.mkdir(scratch)
+
+    reg = jobmgr.JobRegistry()
+
+    job = jobmgr.SteppedJob(path, registry=reg, scratch=scratch)
+
+    opts_create = [
+        '-c',
+        'import os; assert os.getcwd().startswith({!r}); '\
+        'open("a.txt", "wt").write("a"); open("tmp.dat", "wt").close(); '\
+        'print("created")'.format(scratch)
+        ]
+    jobmgr.Step('create', 'python', opts_create, job, data_regex='.*txt')
+
+    opts_consume = [
+        '-c',
+        'import sys; assert sys.argv[1].startswith({!r}); '\
+        'assert open(sys.argv[1]).read() == "a"; '\
+        'open("b.txt", "wt").write("b")'.format(scratch)
+        ]
+    jobmgr.Step('consume', 'python', opts_consume, job, data_regex='.*txt')
+
+    # Plain jobs move all their files
+    other = jobmgr.Job('python', ['-c', 'open("c.dat", "wt").close()'],
+                       tmpdir.join('test_job_scratch').strpath,
+                       registry=reg, scratch=scratch)
+
+    try:
+        job.start()
+        other.start()
+        job.wait()
+        other.wait()
+    finally:
+        job.steps.watchdog.stop()
+        reg.watchdog.stop()
+
+    assert job.status() == jobmgr.StatusCode.terminated
+    assert other.status() == jobmgr.StatusCode.terminated
+
+    create, consume = job.steps
+
+    assert sorted(os.listdir(create._odir)) == ['a.txt', 'stderr', 'stdout']
+    assert open(os.path.join(create._odir, 'stdout')).read() == 'created\n'
+    assert create._channel.get() == [os.path.join(create._odir, 'a.txt')]
+
+    assert open(os.path.join(consume._odir, 'b.txt')).read() == 'b'
+
+    assert os.path.exists(os.path.join(other._odir, 'c.dat'))
+
+    # The scratch area is cleaned
+    assert os.listdir(scratch) == []
+
+
+def test_job_timeout( tmpdir ):
+    '''
+    Test the timeouts of jobs and the deadlines of stepped jobs.
+    '''
+    path = tmpdir.join('test_job_timeout').strpath
+
+    reg = jobmgr.JobRegistry()
+
+    opts = ['-c', 'import time; time.sleep(60)']
+
+    j = jobmgr.Job('python', opts, path, registry=reg, timeout=0.3,
+                   retry=jobmgr.RetryPolicy(backoff=0))
+
+    # Jobs finishing on time are not affected
+    f = jobmgr.Job('python', ['-c', 'pass'], path, registry=reg, timeout=5)
+
+    job = jobmgr.SteppedJob(path, registry=reg, deadline=0.3)
+
+    jobmgr.Step('a', 'python', ['-c', 'pass'], job)
+    jobmgr.Step('b', 'python', opts, job)
+
+    try:
+        j.start()
+        f.start()
+        job.start()
+
+        j.wait()
+        f.wait()
+        job.wait()
+
+        time.sleep(0.3)
+
+        assert j.status() == jobmgr.StatusCode.timed_out
+        assert j.attempts == 1
+        assert j.end_time - j.start_time < 30
+
+        assert f.status() == jobmgr.StatusCode.terminated
+
+        assert job.status() == jobmgr.StatusCode.timed_out
+        assert job.steps[0].status() == jobmgr.StatusCode.terminated
+        assert job.steps[1].status() == jobmgr.StatusCode.killed
+
+        # Jobs which timed out can be started again
+        j.timeout = None
+        j.command = ['python', '-c', 'pass']
+        j.start()
+        j.wait()
+
+        time.sleep(0.3)
+
+        assert j.status() == jobmgr.StatusCode.terminated
+    finally:
+        job.steps.watchdog.stop()
+        reg.watchdog.stop()
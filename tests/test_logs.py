@@ -0,0 +1,134 @@
+'''
+Test functions for the "logs" module.
+'''
+
+__author__  = ['Miguel Ramos Pernas']
+__email__   = ['miguel.ramos.pernas@cern.ch']
+
+# Python
+import json
+
+# Local
+import jobmgr
+
+
+def test_tail( tmpdir ):
+    '''
+    Test for "tail"
+    '''
+    path = tmpdir.join('log').strpath
+
+    with open(path, 'wt') as f:
+        for i in range(1000):
+            f.write('line {}\n'.format(i))
+
+    assert jobmgr.logs.tail(path, 3, block=7) == ['line 997', 'line 998', 'line 999']
+    assert jobmgr.logs.tail(path, 2, pattern='9$', block=16) == ['line 989', 'line 999']
+    assert len(jobmgr.logs.tail(path, 2000)) == 1000
+
+    # Files without end-of-line at the end
+    with open(path, 'at') as f:
+        f.write('last')
+
+    assert jobmgr.logs.tail(path, 2) == ['line 999', 'last']
+
+
+def test_log_follower( tmpdir ):
+    '''
+    Test the behaviour of the LogFollower class.
+    '''
+    a = tmpdir.join('a').strpath
+    b = tmpdir.join('b').strpath
+
+    with open(a, 'wt') as f:
+        f.write('old\n')
+
+    f = jobmgr.LogFollower(pattern='^new')
+
+    f.add('a', a)
+    f.add('b', b)
+
+    assert f.poll() == []
+
+    with open(a, 'at') as fa, open(b, 'wt') as fb:
+        fa.write('new a\nnew incomplete')
+        fb.write('new b\nignored\n')
+
+    assert sorted(f.poll()) == [('a', 'new a'), ('b', 'new b')]
+
+    # Truncated files are read again
+    with open(b, 'wt') as fb:
+        fb.write('new\n')
+
+    assert f.poll() == [('b', 'new')]
+
+    assert f.remove('a') == [('a', 'new incomplete')]
+    assert f.keys() == ['b']
+
+
+def test_log_index( tmpdir ):
+    '''
+    Test the behaviour of the LogIndex class.
+    '''
+    path = tmpdir.join('log').strpath
+
+    with open(path, 'wt') as f:
+        for i in range(1000):
+            f.write('line {}\n'.format(i))
+        f.write('ERROR: unable to open file\n')
+
+    idx = jobmgr.LogIndex.build(path)
+
+    assert idx.lines == 1001
+    assert list(idx.markers) == [1000]
+
+    assert idx.search('line 99[0-2]$') == [(990, 'line 990'), (991, 'line 991'), (992, 'line 992')]
+    assert idx.search('unable|line 5$') == [(5, 'line 5'), (1000, 'ERROR: unable to open file')]
+    assert idx.search('open', markers_only=True) == [(1000, 'ERROR: unable to open file')]
+    assert idx.search('not present') == []
+    assert idx.search('(?i)^error(: unable)?') == [(1000, 'ERROR: unable to open file')]
+
+    # Searching without an index gives the same result
+    assert jobmgr.logs.search(path, 'unable|line 5$') == idx.search('unable|line 5$')
+    assert jobmgr.logs.search(path, 'open', markers_only=True) == [(1000, 'ERROR: unable to open file')]
+
+    # Incremental update, including incomplete lines
+    with open(path, 'at') as f:
+        f.write('Warning: last\nincomplete')
+
+    idx = jobmgr.LogIndex.build(path)
+
+    assert idx.lines == 1002
+    assert list(idx.markers) == [1000, 1001]
+    assert idx.search('last') == [(1001, 'Warning: last')]
+
+    # The index is stored as JSON, and invalid indices are rebuilt
+    ipath = jobmgr.LogIndex.index_path(path)
+
+    with open(ipath, 'rt') as f:
+        assert json.load(f)['lines'] == 1002
+
+    with open(ipath, 'wb') as f:
+        f.write(b'\x80\x02}q\x00.')
+
+    idx = jobmgr.LogIndex.build(path)
+
+    assert idx.lines == 1002
+    assert idx.search('last') == [(1001, 'Warning: last')]
+
+
+def test_log_index_non_ascii( tmpdir ):
+    '''
+    Test the search of non-ASCII strings with a LogIndex.
+    '''
+    path = tmpdir.join('log').strpath
+
+    with open(path, 'wb') as f:
+        for i in range(200):
+            f.write('line {}\n'.format(i).encode('utf-8'))
+        f.write(u'ÉRROR found\n'.encode('utf-8'))
+
+    idx = jobmgr.LogIndex.build(path)
+
+    assert idx.search(u'ÉRROR') == [(200, u'ÉRROR found')]
+    assert idx.search(u'ÉRROR') == jobmgr.logs.search(path, u'ÉRROR')
@@ -0,0 +1,166 @@
+'''
+Test functions for the "shared" module.
+'''
+
+__author__  = ['Miguel Ramos Pernas']
+__email__   = ['miguel.ramos.pernas@cern.ch']
+
+# Python
+import os
+import time
+
+# Local
+import jobmgr
+
+
+def test_shared_queue( tmpdir ):
+    '''
+    Test the SharedQueue class, with two managers in the same process.
+    '''
+    path = tmpdir.join('test_shared_queue').strpath
+    db   = tmpdir.join('queue.db').strpath
+
+    cmd = ['-c', 'import time; time.sleep(0.4); print("done")']
+
+    # The busy manager runs one job at a time, so the idle one takes its jobs
+    q0 = jobmgr.SharedQueue(db, slots=3)
+    q1 = jobmgr.SharedQueue(db)
+
+    r0 = jobmgr.JobRegistry(jobmgr.Scheduler(max_running=1, shared=q0))
+    r1 = jobmgr.JobRegistry(jobmgr.Scheduler(shared=q1))
+
+    try:
+        jobs = [jobmgr.Job('python', cmd, path, registry=r0) for _ in range(4)]
+
+        # Jobs with a retry policy are always run by their manager
+        jobs.append(jobmgr.Job('python', cmd, path, registry=r0, retry=jobmgr.RetryPolicy()))
+
+        start = time.time()
+
+        for j in jobs:
+            r0.submit(j)
+
+        # The number of running jobs in the host is limited
+        while not all(j.status() == jobmgr.StatusCode.terminated for j in jobs):
+
+            assert sum(j.status() == jobmgr.StatusCode.running for j in jobs) <= 3
+
+            assert time.time() - start < 10.
+
+            time.sleep(0.05)
+
+        # Five jobs, one at a time, would take at least 2 seconds
+        assert time.time() - start < 2.
+
+        # The processes of the jobs taken by the other manager are unknown
+        assert sum(j.pid is None for j in jobs) >= 2
+        assert jobs[-1].pid is not None
+
+        for j in jobs:
+            j.wait()
+            assert j.exit_code == 0
+            assert j.end_time > j.start_time
+
+            with open(os.path.join(j._odir, 'stdout')) as f:
+                assert f.read() == 'done\n'
+
+        # Killing a job run by another manager kills its process
+        j = jobmgr.Job('python', ['-c', 'import time; time.sleep(10)'], path, registry=r0)
+
+        r0.submit(jobs[0])
+        r0.submit(j)
+
+        while j.status() != jobmgr.StatusCode.running:
+            time.sleep(0.05)
+
+        assert j.pid is None and q1._stolen
+
+        start = time.time()
+
+        j.kill()
+
+        time.sleep(0.3)
+
+        assert j.status() == jobmgr.StatusCode.killed
+        assert time.time() - start < 1.
+        assert not q1._stolen
+    finally:
+        r0.watchdog.stop()
+        r1.watchdog.stop()
+        q0.close()
+        q1.close()
+
+
+def test_shared_queue_environment( tmpdir, monkeypatch ):
+    '''
+    Test that the jobs taken from other managers run in the output
+    directories and with the environments of their managers.
+    '''
+    db = tmpdir.join('queue.db').strpath
+
+    monkeypatch.chdir(tmpdir.mkdir('owner').strpath)
+    monkeypatch.setenv('JOBMGR_TEST_VALUE', 'owner')
+
+    q0 = jobmgr.SharedQueue(db, slots=2)
+    q1 = jobmgr.SharedQueue(db)
+
+    # The owner does not start jobs by itself
+    reg = jobmgr.JobRegistry(jobmgr.Scheduler(max_running=0, shared=q0))
+
+    try:
+        job = jobmgr.Job('python', ['-c', 'import os; print(os.environ.get("JOBMGR_TEST_VALUE"))'], 'out', registry=reg)
+
+        reg.submit(job)
+
+        # The other manager runs in another directory and environment
+        other = tmpdir.mkdir('other')
+        other.mkdir('out').mkdir(os.path.basename(job._odir)).join('keep').write('keep')
+
+        monkeypatch.chdir(other.strpath)
+        monkeypatch.setenv('JOBMGR_TEST_VALUE', 'other')
+
+        start = time.time()
+        while job.status() != jobmgr.StatusCode.terminated:
+            q1.update(0, 0)
+            assert time.time() - start < 10.
+            time.sleep(0.05)
+
+        assert job.pid is None
+
+        with open(tmpdir.join('owner', job._odir, 'stdout').strpath) as f:
+            assert f.read() == 'owner\n'
+
+        assert other.join('out', os.path.basename(job._odir)).listdir() == [other.join('out', os.path.basename(job._odir), 'keep')]
+    finally:
+        reg.watchdog.stop()
+        q0.close()
+        q1.close()
+
+
+def test_shared_queue_idle( tmpdir ):
+    '''
+    Test that idle managers do not write in the database of a SharedQueue.
+    '''
+    db = tmpdir.join('queue.db').strpath
+
+    q = jobmgr.SharedQueue(db, slots=2, lease=0.6)
+
+    try:
+        def heartbeat():
+            return q._conn.execute('SELECT heartbeat FROM managers WHERE id = ?', (q.manager,)).fetchone()[0]
+
+        first = heartbeat()
+
+        for _ in range(5):
+            assert q.update(0, 0) == 2
+
+        assert heartbeat() == first
+
+        # The heartbeat is renewed every third of the lease
+        time.sleep(0.25)
+
+        q.update(0, 0)
+
+        assert heartbeat() > first
+    finally:
+        q.close()
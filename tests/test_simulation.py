@@ -0,0 +1,123 @@
+'''
+Test functions for the "simulation" module.
+'''
+
+__author__  = ['Miguel Ramos Pernas']
+__email__   = ['miguel.ramos.pernas@cern.ch']
+
+# Python
+import pytest
+
+# Local
+import jobmgr
+
+
+def test_simulator():
+    '''
+    Test the Simulator class.
+    '''
+    trace = jobmgr.Trace({'name': str(d), 'submit': 0., 'priority': d, 'steps': [{'name': 'main', 'attempts': [[d, 0]]}]}
+                         for d in (4, 3, 2, 1))
+
+    sched = jobmgr.Scheduler(max_running=2)
+    clock = sched.clock
+
+    r = jobmgr.Simulator(sched).run(trace)
+
+    # The scheduler keeps its clock
+    assert sched.clock is clock
+
+    assert r.makespan == 5.
+    assert r.utilisation == 1.
+    assert r.max_wait == 4.
+    assert r.mean_wait == pytest.approx(7. / 4.)
+    assert r.terminated == 4 and r.killed == 0
+
+    # Without limit, all the jobs run at the same time
+    r = jobmgr.Simulator().run(trace)
+
+    assert r.makespan == 4.
+    assert r.utilisation == pytest.approx(10. / 16.)
+    assert r.max_wait == 0.
+
+    # Steps run one after the other, and the job keeps its slot while a
+    # failed step waits to be retried
+    trace = jobmgr.Trace([
+        {'submit': 0., 'steps': [{'name': 'a', 'attempts': [[2, 1], [2, 0]]}, {'name': 'b', 'attempts': [[1, 0]]}]},
+        {'submit': 1., 'steps': [{'name': 'a', 'attempts': [[1, 0]]}]},
+    ])
+
+    retry = jobmgr.RetryPolicy(max_attempts=3, backoff=1., factor=1.)
+
+    r = jobmgr.Simulator(jobmgr.Scheduler(max_running=1), retry).run(trace)
+
+    assert r.makespan == 7.
+    assert r.max_wait == 5.
+    assert r.terminated == 2 and r.killed == 0
+
+    # Without retries, the failed step kills the job
+    r = jobmgr.Simulator(jobmgr.Scheduler(max_running=1)).run(trace)
+
+    assert r.makespan == 3.
+    assert r.terminated == 1 and r.killed == 1
+
+
+def test_simulator_errors( tmpdir ):
+    '''
+    Test the errors raised by the Simulator class.
+    '''
+    trace = jobmgr.Trace([{'submit': 0., 'steps': [{'name': 'a', 'attempts': [[1, 0]]}]}])
+
+    # Schedulers depending on the real load can not be simulated
+    sched = jobmgr.Scheduler(admission=jobmgr.AdmissionController(start=1, interval=0, probe=lambda: {}))
+
+    with pytest.raises(ValueError):
+        jobmgr.Simulator(sched).run(trace)
+
+    q = jobmgr.SharedQueue(tmpdir.join('queue.db').strpath)
+    try:
+        with pytest.raises(ValueError):
+            jobmgr.Simulator(jobmgr.Scheduler(shared=q)).run(trace)
+    finally:
+        q.close()
+
+    # Entries without steps or attempts
+    for entry in ({'submit': 0.}, {'submit': 0., 'steps': []}, {'submit': 0., 'steps': [{'name': 'a', 'attempts': []}]}):
+        with pytest.raises(ValueError):
+            jobmgr.Simulator().run(jobmgr.Trace([entry]))
+
+
+def test_trace( tmpdir ):
+    '''
+    Test the Trace class.
+    '''
+    path = tmpdir.join('trace.json').strpath
+
+    trace = jobmgr.Trace([{'name': 'a', 'submit': 1., 'steps': [{'name': 'main', 'attempts': [[2., 0]]}]}])
+
+    trace.save(path)
+
+    assert jobmgr.Trace.load(path) == trace
+
+    # Build a trace from jobs which have been run
+    reg = jobmgr.JobRegistry()
+    try:
+        job = jobmgr.Job('true', [], tmpdir.join('job').strpath, registry=reg)
+        job.start()
+        job.wait()
+
+        trace = jobmgr.Trace.from_registry(reg)
+
+        assert len(trace) == 1
+        assert trace[0]['submit'] == 0.
+
+        (step,) = trace[0]['steps']
+
+        assert step['name'] == 'true'
+        assert step['attempts'] == [[job.end_time - job.start_time, 0]]
+
+        r = jobmgr.Simulator().run(trace)
+
+        assert r.terminated == 1
+    finally:
+        reg.watchdog.stop()
@@ -0,0 +1,79 @@
+'''
+Test functions for the "spawn" module.
+'''
+
+__author__  = ['Miguel Ramos Pernas']
+__email__   = ['miguel.ramos.pernas@cern.ch']
+
+# Python
+import os
+import signal
+import time
+
+# Local
+import jobmgr
+
+
+def test_spawn( tmpdir ):
+    '''
+    Test for "spawn"
+    '''
+    cwd = tmpdir.strpath
+
+    out = os.path.join(cwd, 'stdout')
+    err = os.path.join(cwd, 'stderr')
+
+    cmd = ['python', '-c', 'import os, sys; print(os.getcwd()); sys.exit(3)']
+
+    p = jobmgr.spawn.spawn(cmd, cwd, out, err)
+
+    assert p.wait() == 3
+
+    with open(out) as f:
+        assert os.path.samefile(f.read().strip(), cwd)
+
+    # Unknown executables make the process fail
+    p = jobmgr.spawn.spawn(['unknown-executable'], cwd, out, err)
+
+    assert p.wait() != 0
+
+
+def test_spawn_kill( tmpdir ):
+    '''
+    Test that killing a process also kills its children.
+    '''
+    cwd = tmpdir.strpath
+
+    out = os.path.join(cwd, 'stdout')
+    err = os.path.join(cwd, 'stderr')
+
+    cmd = ['python', '-c', 'import subprocess, time; '\
+           'p = subprocess.Popen(["python", "-c", "import time; time.sleep(60)"]); '\
+           'print(p.pid, flush=True); time.sleep(60)']
+
+    p = jobmgr.spawn.spawn(cmd, cwd, out, err)
+
+    assert p.poll() is None
+
+    # Wait for the child to be created
+    while not os.path.getsize(out):
+        time.sleep(0.01)
+
+    with open(out) as f:
+        child = int(f.read())
+
+    p.kill()
+
+    assert p.wait() == -signal.SIGKILL
+
+    # The child is killed (it might remain as a zombie till it is reaped)
+    for _ in range(100):
+        try:
+            with open('/proc/{}/stat'.format(child)) as f:
+                if f.read().split(')')[-1].split()[0] == 'Z':
+                    break
+        except IOError:
+            break
+        time.sleep(0.01)
+    else:
+        assert False, 'Child process not killed'
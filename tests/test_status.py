@@ -0,0 +1,114 @@
+'''
+Test functions for the "status" module.
+'''
+
+__author__  = ['Miguel Ramos Pernas']
+__email__   = ['miguel.ramos.pernas@cern.ch']
+
+# Python
+import multiprocessing
+import struct
+import sys
+
+# Local
+import jobmgr
+
+
+def _read_table( path, n, out ):
+    '''
+    Read the records of a status table many times, checking that they are
+    consistent.
+    '''
+    reader = jobmgr.StatusReader(path)
+
+    bad = 0
+    for _ in range(n):
+        for r in reader:
+            if r.exit_code != r.pid or r.start_time != r.end_time:
+                bad += 1
+
+    out.put(bad)
+
+
+def test_status_table( tmpdir ):
+    '''
+    Test the behaviour of the StatusTable and StatusReader classes.
+    '''
+    path = tmpdir.join('status').strpath
+
+    table = jobmgr.StatusTable(path, capacity=2)
+
+    table.write(0, 'running', pid=10, start_time=1.)
+    table.write(3, 'terminated', pid=11, start_time=1., end_time=2., exit_code=0)
+
+    reader = jobmgr.StatusReader(path)
+
+    assert len(reader) == 4
+    assert reader.read(0) == (0, 10, 'running', 1., None, None)
+    assert reader.read(1) is None
+    assert [r.jid for r in reader] == [0, 3]
+
+    # The table grows, and the reader maps it again
+    table.write(100, 'killed')
+
+    assert table.capacity == 128
+    assert reader.read(100) == (100, None, 'killed', None, None, None)
+    assert reader.read(3).exit_code == 0
+
+    # Concurrent writes and reads from another process
+    ctx = multiprocessing.get_context('fork') if sys.version_info.major > 2 else multiprocessing
+
+    def write( i ):
+        for jid in range(10):
+            table.write(jid, 'running', pid=i, start_time=float(i), end_time=float(i), exit_code=i)
+
+    write(1)
+
+    out = ctx.Queue()
+
+    proc = ctx.Process(target=_read_table, args=(path, 200, out))
+    proc.start()
+
+    i = 2
+    while proc.is_alive():
+        write(i)
+        i += 1
+
+    assert out.get() == 0
+
+    # A writer dying in the middle of a write does not block the readers
+    struct.pack_into('<I', table._mm, jobmgr.status._offset(5), 1)
+
+    assert reader.read(5) is None
+
+    # A new table replaces the file, without modifying the mapped one
+    other = jobmgr.StatusTable(path)
+
+    assert len(jobmgr.StatusReader(path)) == 0
+    assert reader.read(0).pid == i - 1
+
+    reader.close()
+    table.close()
+    other.close()
+
+
+def test_registry_status( tmpdir ):
+    '''
+    Test the publication of the status of the jobs of a registry.
+    '''
+    path = tmpdir.join('test_registry_status').strpath
+
+    reg = jobmgr.JobRegistry(status_path=tmpdir.join('status').strpath)
+
+    j = jobmgr.Job('python', ['-c', 'import sys; sys.exit(3)'], path, registry=reg)
+    j.start()
+    j.wait()
+
+    reg.watchdog.stop()
+
+    r = jobmgr.StatusReader(reg.status_table.path).read(j.jid)
+
+    assert r.status == 'killed'
+    assert r.exit_code == 3
+    assert r.pid == j.pid
+    assert r.end_time >= r.start_time
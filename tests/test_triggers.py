@@ -0,0 +1,70 @@
+'''
+Test functions for the "triggers" module.
+'''
+
+__author__  = ['Miguel Ramos Pernas']
+__email__   = ['miguel.ramos.pernas@cern.ch']
+
+# Python
+import os
+import pytest
+import time
+
+# Local
+import jobmgr
+
+
+@pytest.mark.parametrize('inotify', [True, False])
+def test_file_watcher( tmpdir, monkeypatch, inotify ):
+    '''
+    Test the FileWatcher class, with and without inotify.
+    '''
+    if not inotify:
+        monkeypatch.setattr(jobmgr.triggers, '_inotify', lambda: None)
+
+    tmpdir.join('old.txt').write('old')
+
+    w = jobmgr.FileWatcher(poll_interval=0.05)
+
+    try:
+        if not inotify:
+            assert w._libc is None
+
+        found = []
+
+        h = w.add(tmpdir.join('*.txt').strpath, found.append)
+
+        # Existing files are reported
+        assert found == [tmpdir.join('old.txt').strpath]
+
+        with pytest.raises(ValueError):
+            w.add(tmpdir.join('*', 'a.txt').strpath, found.append)
+
+        # Files are reported once they are written
+        with open(tmpdir.join('new.txt').strpath, 'wt') as f:
+            f.write('new')
+
+            if inotify:
+                time.sleep(0.1)
+                assert len(found) == 1
+
+        tmpdir.join('other.dat').write('other')
+
+        # Moved files are reported too
+        tmpdir.join('moved.dat').write('moved')
+
+        os.rename(tmpdir.join('moved.dat').strpath, tmpdir.join('moved.txt').strpath)
+
+        time.sleep(0.2)
+
+        assert sorted(found[1:]) == [tmpdir.join('moved.txt').strpath, tmpdir.join('new.txt').strpath]
+
+        w.remove(h)
+
+        tmpdir.join('last.txt').write('last')
+
+        time.sleep(0.2)
+
+        assert len(found) == 3
+    finally:
+        w.stop()
@@ -51,3 +51,63 @@ def test_merge_dicts():
     res = {'a': 3, 'b': 3, 'c': 4, 'd': 4}
 
     assert set(jobmgr.utils.merge_dicts(a, b, c).items()) == set(res.items())
+
+
+def test_find_files( tmpdir ):
+    '''
+    Test for "find_files"
+    '''
+    path = tmpdir.join('find_files')
+    path.mkdir()
+
+    for n in ('a.txt', 'b.txt', 'c.dat'):
+        path.join(n).write('')
+
+    sub = path.join('sub')
+    sub.mkdir()
+    sub.join('d.txt').write('')
+
+    def find( *args, **kwargs ):
+        return set(os.path.relpath(f, path.strpath) for f in
+                   jobmgr.utils.find_files(path.strpath, *args, **kwargs))
+
+    assert find() == set()
+    assert find('.*txt') == {'a.txt', 'b.txt'}
+    assert find('su.*') == {'sub'}
+    assert find(glob='*.txt', recursive=True) == {'a.txt', 'b.txt', os.path.join('sub', 'd.txt')}
+    assert find('.*/.*', glob='*.txt', recursive=True) == {os.path.join('sub', 'd.txt')}
+
+
+def test_manifest( tmpdir ):
+    '''
+    Test for "write_manifest" and "read_manifest"
+    '''
+    path = tmpdir.join('manifest').strpath
+
+    files = ['a.txt', 'b b.txt', 'c.txt']
+
+    assert jobmgr.utils.write_manifest(path, iter(files)) == 3
+    assert jobmgr.utils.read_manifest(path) == files
+
+
+def test_trash_dir( tmpdir ):
+    '''
+    Test for "trash_dir"
+    '''
+    path = tmpdir.join('trash').strpath
+
+    cdir = jobmgr.utils.create_dir(path)
+
+    for i in range(10):
+        open(os.path.join(cdir, str(i)), 'wt').close()
+
+    jobmgr.utils.trash_dir(cdir)
+
+    assert os.listdir(cdir) == []
+
+    jobmgr.utils.wait_trash()
+
+    assert os.listdir(os.path.join(path, '.trash')) == []
+
+    # The trash directory is not taken into account to create directories
+    assert jobmgr.utils.create_dir(path) == os.path.join(path, '1')